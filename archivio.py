@@ -0,0 +1,253 @@
+"""
+Archivio delle stagioni chiuse
+
+I trattamenti degli anni precedenti le ultime STAGIONI_APERTE vengono
+spostati da trattamenti a trattamenti_archivio (stesse colonne, stesso id):
+la tabella usata ogni giorno, con i suoi indici e trigger, resta piccola.
+Per ogni (campo, prodotto, anno) archiviato resta una riga di riepilogo in
+riepiloghi_archivio, su cui si calcolano i report delle stagioni chiuse.
+
+Lo spostamento procede a blocchi in ordine cronologico, ognuno nella
+propria transazione (come le eliminazioni di manutenzione.py): si può
+interrompere e riprendere. Le giacenze di magazzino non cambiano, i
+trattamenti archiviati restano consumi avvenuti (i movimenti di scarico
+restano, senza il collegamento al trattamento). Per i dispositivi offline
+i trattamenti archiviati risultano eliminati.
+
+Le letture con un anno archiviato o senza anno (quaderno, export, report,
+richiamo lotti) leggono anche l'archivio: per chi consulta il quaderno non
+cambia nulla.
+
+Uso:
+    python archivio.py                 # archivia le stagioni chiuse
+    python archivio.py --fino-al 2021  # archivia fino al 2021 compreso
+    python archivio.py --stato
+"""
+import time
+from datetime import date
+from typing import Callable, List, Optional, Set
+
+from sqlalchemy import select, insert, delete, update, func
+from sqlalchemy.orm import Session
+
+from models import Trattamento, TrattamentoArchiviato, RiepilogoArchivio, StagioneArchiviata
+
+try:
+    from config import STAGIONI_APERTE
+except ImportError:
+    STAGIONI_APERTE = 2
+
+DIMENSIONE_BLOCCO = 1000
+
+# Colonne copiate da trattamenti all'archivio (le altre servono solo alla tabella viva)
+COLONNE = [
+    "id", "campo_id", "data", "prodotto_id", "avversita", "quantita_per_ettaro", "quantita_totale",
+    "operatore", "mezzo_id", "condizioni_meteo", "temperatura", "umidita", "velocita_vento", "note",
+    "numero_lotto", "id_client",
+]
+
+
+def ultimo_anno_da_archiviare() -> int:
+    """Ultimo anno chiuso: le STAGIONI_APERTE più recenti (anno corrente compreso) restano vive"""
+    return date.today().year - STAGIONI_APERTE
+
+
+def anni_archiviati(db: Session) -> Set[int]:
+    """Anni con trattamenti nell'archivio (anche con archiviazione in corso)"""
+    return set(db.execute(select(StagioneArchiviata.anno)).scalars())
+
+
+def in_archivio(db: Session, anno: Optional[int]) -> bool:
+    """True se le letture di quell'anno (di tutti gli anni con None) devono includere l'archivio"""
+    if anno is None:
+        return db.execute(select(StagioneArchiviata.anno).limit(1)).first() is not None
+    return db.get(StagioneArchiviata, anno) is not None
+
+
+def _filtro_anno(modello, anno: int) -> list:
+    return [modello.data >= date(anno, 1, 1), modello.data < date(anno + 1, 1, 1)]
+
+
+def _aggiorna_riepiloghi(db: Session, blocco: list):
+    """Aggiunge un blocco di trattamenti ai riepiloghi con un upsert multiplo (senza commit)"""
+    aggregati = {}
+    for t in blocco:
+        chiave = (t.campo_id, t.prodotto_id, t.data.year)
+        riepilogo = aggregati.setdefault(chiave, {
+            "campo_id": chiave[0],
+            "prodotto_id": chiave[1],
+            "anno": chiave[2],
+            "applicazioni": 0,
+            "quantita_totale": 0.0,
+            "dose_min": t.quantita_per_ettaro,
+            "dose_max": t.quantita_per_ettaro,
+            "ultima_data": t.data,
+        })
+        riepilogo["applicazioni"] += 1
+        riepilogo["quantita_totale"] += t.quantita_totale
+        riepilogo["dose_min"] = min(riepilogo["dose_min"], t.quantita_per_ettaro)
+        riepilogo["dose_max"] = max(riepilogo["dose_max"], t.quantita_per_ettaro)
+        riepilogo["ultima_data"] = max(riepilogo["ultima_data"], t.data)
+
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as insert_dialetto
+        minimo, massimo = func.least, func.greatest
+    else:
+        from sqlalchemy.dialects.sqlite import insert as insert_dialetto
+        minimo, massimo = func.min, func.max
+
+    stmt = insert_dialetto(RiepilogoArchivio).values(list(aggregati.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["campo_id", "prodotto_id", "anno"],
+        set_={
+            "applicazioni": RiepilogoArchivio.applicazioni + stmt.excluded.applicazioni,
+            "quantita_totale": RiepilogoArchivio.quantita_totale + stmt.excluded.quantita_totale,
+            "dose_min": minimo(RiepilogoArchivio.dose_min, stmt.excluded.dose_min),
+            "dose_max": massimo(RiepilogoArchivio.dose_max, stmt.excluded.dose_max),
+            "ultima_data": massimo(RiepilogoArchivio.ultima_data, stmt.excluded.ultima_data),
+        },
+    )
+    db.execute(stmt)
+
+
+def archivia_stagione(
+    db: Session,
+    anno: int,
+    dimensione_blocco: int = DIMENSIONE_BLOCCO,
+    progresso: Optional[Callable[[int, int], None]] = None,
+    pausa: float = 0,
+) -> int:
+    """
+    Sposta nell'archivio i trattamenti di un anno, un blocco per transazione
+
+    La stagione è registrata prima del primo blocco, così durante lo
+    spostamento le letture di quell'anno consultano già entrambe le tabelle.
+    I blocchi seguono l'ordine cronologico: l'archivio contiene sempre i
+    trattamenti più vecchi dell'anno. Restituisce i trattamenti spostati.
+    """
+    if db.get(StagioneArchiviata, anno) is None:
+        db.add(StagioneArchiviata(anno=anno))
+        db.commit()
+
+    filtro = _filtro_anno(Trattamento, anno)
+    spostati = 0
+    while True:
+        blocco = db.execute(
+            select(
+                Trattamento.id, Trattamento.campo_id, Trattamento.prodotto_id, Trattamento.data,
+                Trattamento.quantita_per_ettaro, Trattamento.quantita_totale,
+            )
+            .where(*filtro)
+            .order_by(Trattamento.data, Trattamento.id)
+            .limit(dimensione_blocco)
+        ).all()
+        if not blocco:
+            break
+        ids = [t.id for t in blocco]
+
+        try:
+            db.execute(insert(TrattamentoArchiviato).from_select(
+                COLONNE,
+                select(*[getattr(Trattamento, c) for c in COLONNE]).where(Trattamento.id.in_(ids)),
+            ))
+            _aggiorna_riepiloghi(db, blocco)
+            db.execute(
+                delete(Trattamento).where(Trattamento.id.in_(ids)).execution_options(synchronize_session=False)
+            )
+            db.execute(
+                update(StagioneArchiviata)
+                .where(StagioneArchiviata.anno == anno)
+                .values(trattamenti=StagioneArchiviata.trattamenti + len(ids))
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        spostati += len(ids)
+        if progresso:
+            progresso(anno, spostati)
+        if len(blocco) < dimensione_blocco:
+            break
+        if pausa:
+            time.sleep(pausa)
+
+    db.execute(update(StagioneArchiviata).where(StagioneArchiviata.anno == anno).values(completata=True))
+    db.commit()
+    return spostati
+
+
+def archivia_stagioni_chiuse(
+    db: Session,
+    fino_al: Optional[int] = None,
+    dimensione_blocco: int = DIMENSIONE_BLOCCO,
+    progresso: Optional[Callable[[int, int], None]] = None,
+    pausa: float = 0,
+) -> dict:
+    """Archivia ogni anno fino a `fino_al` compreso (default: ultimo anno chiuso); {anno: trattamenti spostati}"""
+    if fino_al is None:
+        fino_al = ultimo_anno_da_archiviare()
+
+    spostati = {}
+    while True:
+        # Anno del trattamento vivo più vecchio: nessuna scansione degli anni vuoti
+        prima_data = db.execute(select(func.min(Trattamento.data))).scalar()
+        if prima_data is None or prima_data.year > fino_al:
+            break
+        spostati[prima_data.year] = archivia_stagione(db, prima_data.year, dimensione_blocco, progresso, pausa)
+    return spostati
+
+
+# ========== LETTURA ==========
+
+def trattamenti_archiviati(db: Session, azienda_id: int, anno: Optional[int]) -> List[TrattamentoArchiviato]:
+    """Trattamenti archiviati di un'azienda e di un anno (di tutti gli anni con None), in ordine cronologico"""
+    from models import Campo
+    return db.execute(
+        select(TrattamentoArchiviato)
+        .where(
+            TrattamentoArchiviato.campo_id.in_(select(Campo.id).where(Campo.azienda_id == azienda_id)),
+            *(_filtro_anno(TrattamentoArchiviato, anno) if anno is not None else []),
+        )
+        .order_by(TrattamentoArchiviato.data, TrattamentoArchiviato.id)
+    ).scalars().all()
+
+
+def elimina_archivio_campo(db: Session, campo_id: int):
+    """Elimina archivio e riepiloghi di un campo (senza commit)"""
+    for modello in (TrattamentoArchiviato, RiepilogoArchivio):
+        db.execute(
+            delete(modello).where(modello.campo_id == campo_id).execution_options(synchronize_session=False)
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+    from models import SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(description="Archiviazione delle stagioni chiuse")
+    parser.add_argument("--fino-al", type=int, help="Ultimo anno da archiviare (default: anno corrente - STAGIONI_APERTE)")
+    parser.add_argument("--blocco", type=int, default=DIMENSIONE_BLOCCO, help="Trattamenti per transazione")
+    parser.add_argument("--pausa", type=float, default=0, help="Secondi di pausa tra i blocchi")
+    parser.add_argument("--stato", action="store_true", help="Mostra le stagioni archiviate senza archiviare")
+    args = parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if not args.stato:
+            fino_al = args.fino_al or ultimo_anno_da_archiviare()
+            print(f"📦 Archiviazione dei trattamenti fino al {fino_al}...")
+            spostati = archivia_stagioni_chiuse(
+                db, fino_al, args.blocco,
+                lambda anno, numero: print(f"  {anno}: {numero} trattamenti spostati"),
+                args.pausa,
+            )
+            print(f"✅ Archiviati {sum(spostati.values())} trattamenti ({len(spostati)} stagioni)")
+
+        print("\n📋 Stagioni archiviate:")
+        for stagione in db.execute(select(StagioneArchiviata).order_by(StagioneArchiviata.anno)).scalars():
+            stato = "completa" if stagione.completata else "in corso (rilanciare per completare)"
+            print(f"  {stagione.anno}: {stagione.trattamenti} trattamenti, {stato}")
+    finally:
+        db.close()
@@ -0,0 +1,295 @@
+"""
+Backup a caldo del database, rotazione e verifica del ripristino
+
+SQLite: API di backup online, a passi di BACKUP_PAGINE_PER_PASSO pagine con
+una pausa tra i passi. In modalità WAL (impostata da models.py) la copia
+legge da una transazione di sola lettura aperta all'inizio: la copia è
+coerente con quell'istante e le scritture dell'app (nuovi trattamenti,
+import) continuano durante il backup. Il file copiato viene poi compresso
+con gzip.
+
+PostgreSQL: pg_dump in formato custom (già compresso), che legge da uno
+snapshot MVCC senza bloccare le scritture.
+
+Le copie hanno nome agrinote-AAAAMMGG-HHMMSS.* e vengono scritte con un
+nome temporaneo e rinominate solo a copia completa: una copia interrotta
+non viene mai scambiata per un backup valido. Dopo ogni backup restano le
+ultime BACKUP_CONSERVA copie.
+
+Uso:
+    python backup.py                          # nuovo backup + rotazione
+    python backup.py --verifica backups/agrinote-20250301-020000.db.gz
+    python backup.py --ripristina backups/agrinote-20250301-020000.db.gz --destinazione agrinote.db
+"""
+import gzip
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy.engine import make_url
+
+try:
+    from config import DATABASE_URL, BACKUP_DIR, BACKUP_CONSERVA, BACKUP_PAGINE_PER_PASSO, BACKUP_PAUSA
+except ImportError:
+    DATABASE_URL = "sqlite:///./agrinote.db"
+    BACKUP_DIR = "backups"
+    BACKUP_CONSERVA = 7
+    BACKUP_PAGINE_PER_PASSO = 1024
+    BACKUP_PAUSA = 0.05
+
+PREFISSO = "agrinote-"
+ESTENSIONI = (".db.gz", ".db", ".dump")
+
+# Tabelle contate dalla verifica (le altre sono derivate e ricostruibili)
+TABELLE_VERIFICA = ("aziende", "campi", "prodotti", "mezzi", "trattamenti", "movimenti_magazzino")
+
+
+# ========== SQLITE ==========
+
+def backup_sqlite(
+    sorgente: str,
+    destinazione: str,
+    pagine_per_passo: int = BACKUP_PAGINE_PER_PASSO,
+    pausa: float = BACKUP_PAUSA,
+    progresso: Optional[Callable[[int, int], None]] = None,
+):
+    """
+    Copia coerente di un database SQLite con l'API di backup online
+
+    `progresso(copiate, totali)` riceve le pagine dopo ogni passo. Senza WAL
+    la transazione di lettura bloccherebbe le scritture: in quel caso i
+    passi restano brevi ma SQLite ricomincia la copia se il database
+    cambia nel frattempo.
+    """
+    connessione = sqlite3.connect(sorgente, isolation_level=None)
+    copia = sqlite3.connect(destinazione)
+    try:
+        wal = connessione.execute("PRAGMA journal_mode").fetchone()[0].lower() == "wal"
+        if wal:
+            # Lo snapshot resta fisso per tutta la copia, le scritture vanno nel WAL
+            connessione.execute("BEGIN")
+            connessione.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+        def passo(_stato, rimanenti, totali):
+            if progresso:
+                progresso(totali - rimanenti, totali)
+            if pausa and rimanenti:
+                time.sleep(pausa)
+
+        connessione.backup(copia, pages=pagine_per_passo, progress=passo)
+        if wal:
+            connessione.execute("COMMIT")
+    finally:
+        copia.close()
+        connessione.close()
+
+
+def _comprimi(percorso: str, destinazione: str):
+    with open(percorso, "rb") as origine, gzip.open(destinazione, "wb", compresslevel=6) as compresso:
+        shutil.copyfileobj(origine, compresso, 1024 * 1024)
+
+
+def _decomprimi(percorso: str, destinazione: str):
+    with gzip.open(percorso, "rb") as compresso, open(destinazione, "wb") as file:
+        shutil.copyfileobj(compresso, file, 1024 * 1024)
+
+
+# ========== POSTGRESQL ==========
+
+def _ambiente_postgres(url: str):
+    """URL per libpq (senza driver SQLAlchemy) e password in PGPASSWORD, non sulla riga di comando"""
+    url = make_url(url).set(drivername="postgresql")
+    ambiente = dict(os.environ)
+    if url.password:
+        ambiente["PGPASSWORD"] = url.password
+    return url.set(password=None).render_as_string(hide_password=False), ambiente
+
+
+def backup_postgres(url: str, destinazione: str):
+    """pg_dump in formato custom (compresso, ripristinabile con pg_restore)"""
+    dsn, ambiente = _ambiente_postgres(url)
+    subprocess.run(
+        ["pg_dump", "--format=custom", "--compress=6", "--file", destinazione, "--dbname", dsn],
+        check=True, env=ambiente,
+    )
+
+
+# ========== BACKUP E ROTAZIONE ==========
+
+def crea_backup(
+    cartella: str = BACKUP_DIR,
+    comprimi: bool = True,
+    pagine_per_passo: int = BACKUP_PAGINE_PER_PASSO,
+    pausa: float = BACKUP_PAUSA,
+    progresso: Optional[Callable[[int, int], None]] = None,
+    url: str = DATABASE_URL,
+) -> str:
+    """Crea un backup nella cartella e restituisce il percorso del file"""
+    os.makedirs(cartella, exist_ok=True)
+    nome = PREFISSO + datetime.now().strftime("%Y%m%d-%H%M%S")
+    postgres = url.startswith("postgresql")
+    estensione = ".dump" if postgres else (".db.gz" if comprimi else ".db")
+    destinazione = os.path.join(cartella, nome + estensione)
+    temporaneo = destinazione + ".parziale"
+
+    try:
+        if postgres:
+            backup_postgres(url, temporaneo)
+        elif comprimi:
+            copia = os.path.join(cartella, nome + ".db.parziale")
+            try:
+                backup_sqlite(make_url(url).database, copia, pagine_per_passo, pausa, progresso)
+                _comprimi(copia, temporaneo)
+            finally:
+                if os.path.exists(copia):
+                    os.remove(copia)
+        else:
+            backup_sqlite(make_url(url).database, temporaneo, pagine_per_passo, pausa, progresso)
+        os.replace(temporaneo, destinazione)
+    finally:
+        if os.path.exists(temporaneo):
+            os.remove(temporaneo)
+    return destinazione
+
+
+def elenco_backup(cartella: str = BACKUP_DIR) -> List[str]:
+    """Backup completi nella cartella, dal più vecchio al più recente"""
+    if not os.path.isdir(cartella):
+        return []
+    return sorted(
+        os.path.join(cartella, nome) for nome in os.listdir(cartella)
+        if nome.startswith(PREFISSO) and nome.endswith(ESTENSIONI)
+    )
+
+
+def ruota_backup(cartella: str = BACKUP_DIR, conserva: int = BACKUP_CONSERVA) -> List[str]:
+    """Elimina i backup oltre gli ultimi `conserva` e restituisce i file eliminati"""
+    da_eliminare = elenco_backup(cartella)[:-conserva] if conserva > 0 else []
+    for percorso in da_eliminare:
+        os.remove(percorso)
+    return da_eliminare
+
+
+# ========== VERIFICA E RIPRISTINO ==========
+
+def _verifica_sqlite(percorso: str) -> dict:
+    connessione = sqlite3.connect(f"file:{percorso}?mode=ro", uri=True)
+    try:
+        integrita = connessione.execute("PRAGMA integrity_check").fetchone()[0]
+        tabelle = {r[0] for r in connessione.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        versione = None
+        if "schema_versione" in tabelle:
+            versione = connessione.execute("SELECT MAX(versione) FROM schema_versione").fetchone()[0]
+        righe = {
+            tabella: connessione.execute(f"SELECT COUNT(*) FROM {tabella}").fetchone()[0]
+            for tabella in TABELLE_VERIFICA if tabella in tabelle
+        }
+    finally:
+        connessione.close()
+    return {"valido": integrita == "ok", "integrita": integrita, "versione_schema": versione, "righe": righe}
+
+
+def verifica_backup(percorso: str) -> dict:
+    """
+    Controlla che un backup sia ripristinabile
+
+    SQLite: decompressione in una cartella temporanea, PRAGMA integrity_check,
+    versione dello schema e righe delle tabelle principali.
+    PostgreSQL: lettura dell'indice dell'archivio con pg_restore --list.
+    """
+    if percorso.endswith(".dump"):
+        elenco = subprocess.run(["pg_restore", "--list", percorso], check=True, capture_output=True, text=True).stdout
+        tabelle = [riga.split()[-2] for riga in elenco.splitlines() if " TABLE DATA " in riga]
+        return {"valido": bool(tabelle), "tabelle": len(tabelle)}
+
+    if not percorso.endswith(".gz"):
+        return _verifica_sqlite(percorso)
+    with tempfile.TemporaryDirectory() as cartella:
+        copia = os.path.join(cartella, "verifica.db")
+        _decomprimi(percorso, copia)
+        return _verifica_sqlite(copia)
+
+
+def ripristina_backup(percorso: str, destinazione: Optional[str] = None, url: str = DATABASE_URL):
+    """
+    Ripristina un backup (con l'app ferma)
+
+    SQLite: il file viene prima scritto accanto alla destinazione e poi
+    sostituito in un colpo solo; i vecchi file -wal/-shm vengono rimossi.
+    PostgreSQL: pg_restore --clean nel database di DATABASE_URL.
+    """
+    if percorso.endswith(".dump"):
+        dsn, ambiente = _ambiente_postgres(url)
+        subprocess.run(
+            ["pg_restore", "--clean", "--if-exists", "--no-owner", "--dbname", dsn, percorso],
+            check=True, env=ambiente,
+        )
+        return
+
+    destinazione = destinazione or make_url(url).database
+    temporaneo = destinazione + ".ripristino"
+    if percorso.endswith(".gz"):
+        _decomprimi(percorso, temporaneo)
+    else:
+        shutil.copyfile(percorso, temporaneo)
+    if not _verifica_sqlite(temporaneo)["valido"]:
+        os.remove(temporaneo)
+        raise ValueError(f"Backup danneggiato: {percorso}")
+    for suffisso in ("-wal", "-shm"):
+        if os.path.exists(destinazione + suffisso):
+            os.remove(destinazione + suffisso)
+    os.replace(temporaneo, destinazione)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Backup a caldo del database")
+    parser.add_argument("--cartella", default=BACKUP_DIR, help="Cartella dei backup")
+    parser.add_argument("--conserva", type=int, default=BACKUP_CONSERVA, help="Backup da conservare")
+    parser.add_argument("--pagine", type=int, default=BACKUP_PAGINE_PER_PASSO, help="Pagine SQLite per passo")
+    parser.add_argument("--pausa", type=float, default=BACKUP_PAUSA, help="Secondi di pausa tra i passi")
+    parser.add_argument("--senza-compressione", action="store_true", help="Copia SQLite non compressa")
+    parser.add_argument("--verifica", metavar="FILE", help="Verifica un backup invece di crearne uno")
+    parser.add_argument("--ripristina", metavar="FILE", help="Ripristina un backup (app ferma)")
+    parser.add_argument("--destinazione", help="File SQLite da sostituire nel ripristino")
+    parser.add_argument("--force", action="store_true", help="Non chiedere conferma per il ripristino")
+    args = parser.parse_args()
+
+    if args.verifica:
+        esito = verifica_backup(args.verifica)
+        print(f"{'✅' if esito['valido'] else '❌'} {args.verifica}")
+        for chiave, valore in esito.items():
+            print(f"  {chiave}: {valore}")
+        raise SystemExit(0 if esito["valido"] else 1)
+
+    if args.ripristina:
+        if not args.force:
+            conferma = input("⚠️  ATTENZIONE: il database attuale verrà sostituito. Continuare? (s/n): ")
+            if conferma.lower() != 's':
+                print("❌ Operazione annullata")
+                exit(0)
+        ripristina_backup(args.ripristina, args.destinazione)
+        print(f"✅ Ripristinato {args.ripristina}")
+        raise SystemExit(0)
+
+    inizio = time.perf_counter()
+    ultimo = [0.0]
+
+    def stampa_progresso(copiate: int, totali: int):
+        if time.perf_counter() - ultimo[0] >= 1 or copiate == totali:
+            ultimo[0] = time.perf_counter()
+            print(f"  💾 {copiate}/{totali} pagine ({time.perf_counter() - inizio:.1f}s)")
+
+    print("💾 Backup del database...")
+    percorso = crea_backup(args.cartella, not args.senza_compressione, args.pagine, args.pausa, stampa_progresso)
+    dimensione = os.path.getsize(percorso) / (1024 * 1024)
+    print(f"✅ {percorso} ({dimensione:.1f} MB, {time.perf_counter() - inizio:.1f}s)")
+
+    for eliminato in ruota_backup(args.cartella, args.conserva):
+        print(f"  🗑️  {eliminato}")
@@ -0,0 +1,19 @@
+"""
+Benchmark riproducibili dei percorsi critici di AgriNote
+
+    python -m benchmark                          # tutti i casi, dimensioni 1000,10000,100000
+    python -m benchmark --dimensioni 1000 --casi dashboard,quaderno
+    python -m benchmark --casi avvio             # solo il tempo di import (python -X importtime)
+    python -m benchmark --salva-baseline         # registra i tempi come riferimento
+
+I database di prova sono generati una volta con seed.py --massivo (seme e
+anni fissi, quindi identici su ogni macchina) e conservati in
+benchmark/dati/. Ogni dimensione gira in un processo separato con il proprio
+DATABASE_URL; le route passano dal client ASGI in-process di Starlette e
+Open-Meteo è sostituito da risposte locali (benchmark/meteo.py): nessun
+accesso alla rete.
+
+I risultati (JSON) vengono confrontati con benchmark/baseline.json: un caso
+la cui mediana supera quella di riferimento di più della soglia è una
+regressione e il comando esce con codice 1.
+"""
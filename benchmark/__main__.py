@@ -0,0 +1,156 @@
+"""
+Orchestratore dei benchmark: database di prova, esecuzione per dimensione, confronto con la baseline
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+from benchmark.avvio import misura_avvio
+from benchmark.casi import CASI, RADICE, STAGIONI, ULTIMO_ANNO
+from benchmark.misura import confronta
+
+CARTELLA_DATI = os.path.join(RADICE, "benchmark", "dati")
+BASELINE = os.path.join(RADICE, "benchmark", "baseline.json")
+SEME = 42
+GENERATORE = 2  # Versione dei dati di seed.py --massivo: cambiandola i database in cache vengono rigenerati
+AVVIO = "avvio"  # Import di main in processi nuovi (python -X importtime), non dipende dal database
+
+
+def database_di_prova(trattamenti: int, aziende: int = 1, cartella: str = CARTELLA_DATI) -> str:
+    """Percorso del database con `trattamenti` trattamenti, generato con seed.py --massivo se manca"""
+    os.makedirs(cartella, exist_ok=True)
+    nome = f"agrinote-{trattamenti}" + (f"-a{aziende}" if aziende > 1 else "") + f"-s{SEME}-g{GENERATORE}.db"
+    percorso = os.path.join(cartella, nome)
+    if os.path.exists(percorso):
+        return percorso
+
+    print(f"🌱 Generazione del database di prova con {trattamenti} trattamenti...", flush=True)
+    parziale = percorso + ".parziale"
+    if os.path.exists(parziale):
+        os.remove(parziale)
+    subprocess.run(
+        [
+            sys.executable, "seed.py", "--massivo", "--aziende", str(aziende), "--campi", "40", "--prodotti", "25",
+            "--mezzi", "6", "--interventi", "10", "--trattamenti", str(trattamenti), "--stagioni", str(STAGIONI),
+            "--ultimo-anno", str(ULTIMO_ANNO), "--seme", str(SEME),
+        ],
+        cwd=RADICE, check=True, stdout=subprocess.DEVNULL,
+        env={**os.environ, "DATABASE_URL": f"sqlite:///{parziale}"},
+    )
+    # Tutto nel file principale prima di rinominarlo (il WAL resterebbe con il vecchio nome)
+    connessione = sqlite3.connect(parziale)
+    connessione.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    connessione.close()
+    os.replace(parziale, percorso)
+    return percorso
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RADICE, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def _ms(valore) -> str:
+    return "-" if valore is None else f"{valore:.3f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dei percorsi critici di AgriNote")
+    parser.add_argument("--dimensioni", default="1000,10000,100000", help="Trattamenti nei database di prova")
+    parser.add_argument("--casi", default=",".join([AVVIO, *CASI]), help=f"Casi separati da virgola ({AVVIO}, {', '.join(CASI)})")
+    parser.add_argument("--ripetizioni", type=int, default=10, help="Campioni per caso")
+    parser.add_argument("--tempo-max", type=float, default=30.0, help="Secondi massimi per caso (almeno 3 campioni)")
+    parser.add_argument("--output", default="risultati-benchmark.json", help="File JSON dei risultati")
+    parser.add_argument("--baseline", default=BASELINE, help="Baseline con cui confrontare")
+    parser.add_argument("--soglia", type=float, default=0.25, help="Aumento della mediana considerato regressione (0.25 = +25%%)")
+    parser.add_argument("--salva-baseline", action="store_true", help="Salva i risultati come nuova baseline")
+    args = parser.parse_args()
+
+    casi = args.casi.split(",")
+    sconosciuti = [c for c in casi if c not in CASI and c != AVVIO]
+    if sconosciuti:
+        parser.error(f"casi sconosciuti: {', '.join(sconosciuti)}")
+    dimensioni = [int(d) for d in args.dimensioni.split(",")]
+
+    risultati = {}
+    if AVVIO in casi:
+        print("🚀 Avvio: import di main", flush=True)
+        risultati[f"{AVVIO}[main]"] = {**misura_avvio("main", args.ripetizioni), "caso": AVVIO, "dimensione": "main"}
+        pesanti = risultati[f"{AVVIO}[main]"]["pesanti_caricati"]
+        if pesanti:
+            print(f"  ⚠️  Librerie da caricare al primo uso importate all'avvio: {', '.join(pesanti)}", flush=True)
+        casi = [c for c in casi if c != AVVIO]
+
+    for indice, dimensione in enumerate(dimensioni):
+        # I casi con dimensioni proprie (area, fattura, login) non dipendono dal database: una volta sola
+        casi_dimensione = [c for c in casi if CASI[c].dimensioni is None or indice == 0]
+        if not casi_dimensione:
+            continue
+        database = database_di_prova(dimensione)
+        print(f"\n📊 Database con {dimensione} trattamenti", flush=True)
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as file:
+            uscita = file.name
+        try:
+            subprocess.run(
+                [
+                    sys.executable, "-m", "benchmark.casi", "--database", database, "--dimensione", str(dimensione),
+                    "--casi", ",".join(casi_dimensione), "--ripetizioni", str(args.ripetizioni),
+                    "--tempo-max", str(args.tempo_max), "--output", uscita,
+                ],
+                cwd=RADICE, check=True,
+            )
+            with open(uscita, encoding="utf-8") as file:
+                risultati.update(json.load(file))
+        finally:
+            os.remove(uscita)
+
+    documento = {
+        "creato_il": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "piattaforma": platform.platform(),
+        "processore": platform.processor() or platform.machine(),
+        "risultati": risultati,
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(documento, file, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file).get("risultati", {})
+    confronto = confronta(risultati, baseline, args.soglia)
+
+    simboli = {"regressione": "🔴", "miglioramento": "🟢", "invariato": "⚪", "nuovo": "🆕", "errore": "❌"}
+    print(f"\n{'caso':<36} {'mediana ms':>12} {'baseline ms':>12} {'var.':>8}")
+    for voce in confronto:
+        variazione = "-" if voce["variazione"] is None else f"{voce['variazione']:+.0%}"
+        print(
+            f"{simboli[voce['stato']]} {voce['chiave']:<34} {_ms(voce['mediana_ms']):>12} "
+            f"{_ms(voce['baseline_ms']):>12} {variazione:>8}"
+        )
+    print(f"\n📄 Risultati in {args.output}")
+
+    if args.salva_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(documento, file, indent=2)
+        print(f"💾 Baseline salvata in {args.baseline}")
+
+    regressioni = [v["chiave"] for v in confronto if v["stato"] in ("regressione", "errore")]
+    if regressioni and not args.salva_baseline:
+        print(f"⚠️  Regressioni o errori: {', '.join(regressioni)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
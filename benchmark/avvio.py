@@ -0,0 +1,113 @@
+"""
+Costo di avvio: tempo di import dell'app misurato con python -X importtime
+
+Ogni campione è un processo nuovo (nessun modulo già in memoria, come un
+worker appena avviato). Oltre al tempo totale riporta i moduli importati
+direttamente più costosi e quali librerie pesanti, da caricare solo al
+primo uso, sono finite nell'avvio.
+
+    python -m benchmark.avvio                 # import di main, 5 campioni
+    python -m benchmark.avvio --ripetizioni 10 --moduli 20
+"""
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+from benchmark.casi import RADICE
+from benchmark.misura import percentile
+
+# Caricate al primo uso (upload fattura, export PDF, login, meteo): non devono comparire all'avvio
+PESANTI = ("fitz", "reportlab", "httpx", "jose", "passlib")
+
+# "import time: <self us> | <cumulativo us> | <rientro><modulo>"
+RIGA = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+
+def profilo_import(modulo: str = "main") -> Dict[str, dict]:
+    """
+    Un import di `modulo` in un processo nuovo: {modulo: {"proprio_us", "cumulativo_us", "livello"}}
+
+    Il livello è la profondità nell'albero degli import (0 per `modulo` e
+    per i moduli caricati dall'interprete prima di lui).
+    """
+    esito = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        cwd=RADICE, capture_output=True, text=True, check=True,
+        env={**os.environ, "LOG_LIVELLO": "WARNING"},
+    )
+    profilo = {}
+    for riga in esito.stderr.splitlines():
+        corrispondenza = RIGA.match(riga)
+        if corrispondenza:
+            proprio, cumulativo, rientro, nome = corrispondenza.groups()
+            profilo[nome] = {
+                "proprio_us": int(proprio),
+                "cumulativo_us": int(cumulativo),
+                "livello": len(rientro) // 2,
+            }
+    return profilo
+
+
+def misura_avvio(modulo: str = "main", ripetizioni: int = 5, moduli: int = 10) -> dict:
+    """
+    Tempo di import di `modulo` in millisecondi (mediana, p95, minimo, media su processi nuovi)
+
+    Stesso formato di misura(), più "moduli" (i `moduli` import diretti più
+    costosi, mediana in ms) e "pesanti_caricati" (librerie di PESANTI
+    importate durante l'avvio).
+    """
+    totali: List[float] = []
+    diretti = defaultdict(list)
+    caricati = set()
+    for _ in range(ripetizioni):
+        profilo = profilo_import(modulo)
+        totali.append(profilo[modulo]["cumulativo_us"] / 1000)
+        # Le righe seguono l'ordine di fine import: i figli di `modulo` lo precedono
+        figli = []
+        for nome, voce in profilo.items():
+            if voce["livello"] == 1:
+                figli.append((nome, voce["cumulativo_us"] / 1000))
+            elif voce["livello"] == 0:
+                if nome == modulo:
+                    for figlio, tempo in figli:
+                        diretti[figlio].append(tempo)
+                figli = []
+            if nome.split(".")[0] in PESANTI:
+                caricati.add(nome.split(".")[0])
+
+    mediane = {nome: statistics.median(tempi) for nome, tempi in diretti.items()}
+    return {
+        "campioni": len(totali),
+        "cicli": 1,
+        "mediana_ms": round(statistics.median(totali), 4),
+        "p95_ms": round(percentile(totali, 95), 4),
+        "min_ms": round(min(totali), 4),
+        "media_ms": round(statistics.fmean(totali), 4),
+        "moduli": {
+            nome: round(tempo, 2)
+            for nome, tempo in sorted(mediane.items(), key=lambda v: v[1], reverse=True)[:moduli]
+        },
+        "pesanti_caricati": sorted(caricati),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tempo di import dell'app (python -X importtime)")
+    parser.add_argument("--modulo", default="main")
+    parser.add_argument("--ripetizioni", type=int, default=5, help="Processi misurati")
+    parser.add_argument("--moduli", type=int, default=15, help="Import diretti più costosi da mostrare")
+    args = parser.parse_args()
+
+    risultato = misura_avvio(args.modulo, args.ripetizioni, args.moduli)
+    print(f"🚀 import {args.modulo}: {risultato['mediana_ms']:.1f} ms "
+          f"(min {risultato['min_ms']:.1f}, p95 {risultato['p95_ms']:.1f}, {risultato['campioni']} processi)")
+    for nome, tempo in risultato["moduli"].items():
+        print(f"  {tempo:>9.1f} ms  {nome}")
+    if risultato["pesanti_caricati"]:
+        print(f"⚠️  Caricati all'avvio: {', '.join(risultato['pesanti_caricati'])}")
@@ -0,0 +1,450 @@
+"""
+Test di carico HTTP con sessioni realistiche di operatori
+
+Ogni operatore virtuale fa login con il proprio cookie e alterna, con
+pause di riflessione, le azioni di una giornata tipo: dashboard (con la
+chiamata a /api/meteo della pagina), quaderno, registrazione di un
+trattamento, mappa con salvataggio di un campo, caricamento di una fattura
+ed export PDF del quaderno. Le fasi aumentano (o riducono) gli operatori
+contemporanei; per ogni fase e route si riportano richieste al secondo,
+latenze p50/p95/p99 ed errori.
+
+    python -m benchmark.carico                                    # app e Open-Meteo locali, 5, 10 e 20 operatori
+    python -m benchmark.carico --utenti 10,50,100 --durata-fase 60 --workers 4
+    python -m benchmark.carico --url http://127.0.0.1:8000 --database agrinote.db
+
+Con --avvia (predefinito) il database di prova di benchmark/dati viene
+copiato in una cartella temporanea (le scritture non lo modificano) e
+servito da uvicorn, con Open-Meteo sostituito da benchmark/meteo.py: il
+test gira su una sola macchina, senza rete. Con --url si usa un server già
+avviato; --database serve comunque per leggere campi, prodotti e mezzi
+delle aziende.
+"""
+import asyncio
+import glob
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Callable, Dict, List, NamedTuple
+
+import httpx
+
+from benchmark.casi import RADICE, ULTIMO_ANNO
+from benchmark.misura import percentile
+
+PASSWORD = "admin123"  # Stessa password per tutti gli utenti di seed.py --massivo
+PREFISSO_FATTURE = "carico-"  # Fatture caricate dal test in static/uploads (rimosse a fine test con --avvia)
+
+
+class Azione(NamedTuple):
+    peso: int
+    esegui: Callable[["Operatore"], object]  # Coroutine: una o più richieste della stessa azione
+
+
+class Azienda(NamedTuple):
+    username: str
+    campi: List[tuple]  # (id, centro_lat, centro_lng)
+    prodotti: List[int]
+    mezzi: List[int]
+
+
+def aziende_del_database(percorso: str) -> List[Azienda]:
+    """
+    Utenti, campi, fitofarmaci e mezzi di ogni azienda del database di prova
+
+    Solo i fitofarmaci senza limiti d'impiego: con molti operatori i
+    trattamenti registrati supererebbero prima o poi le applicazioni
+    ammesse, e il rifiuto conterebbe come errore.
+    """
+    connessione = sqlite3.connect(f"file:{percorso}?mode=ro", uri=True)
+    try:
+        aziende = []
+        for azienda_id, username in connessione.execute(
+            "SELECT a.id, u.username FROM aziende a JOIN users u ON u.id = a.user_id ORDER BY a.id"
+        ):
+            campi = connessione.execute(
+                "SELECT id, centro_lat, centro_lng FROM campi WHERE azienda_id = ? ORDER BY id", (azienda_id,)
+            ).fetchall()
+            prodotti = [r[0] for r in connessione.execute(
+                "SELECT id FROM prodotti p WHERE azienda_id = ? AND tipo = 'FITOFARMACO' "
+                "AND NOT EXISTS (SELECT 1 FROM limiti_prodotti l WHERE l.prodotto_id = p.id) ORDER BY id",
+                (azienda_id,)
+            )]
+            mezzi = [r[0] for r in connessione.execute(
+                "SELECT id FROM mezzi WHERE azienda_id = ? ORDER BY id", (azienda_id,)
+            )]
+            if campi and prodotti:
+                aziende.append(Azienda(username, campi, prodotti, mezzi))
+        return aziende
+    finally:
+        connessione.close()
+
+
+def fatture_pdf() -> List[bytes]:
+    """Due fatture d'acquisto (fitofarmaco e concime), come le riconosce l'analisi del magazzino"""
+    import fitz
+
+    fatture = []
+    for righe in (
+        ["Fattura n. 2025/0412 - Consorzio Agrario", "Fungicida Rame 20 WG", "Confezione 10 kg, lotto RM2025"],
+        ["Fattura n. 2025/0413 - Consorzio Agrario", "Concime NPK 20-10-10", "Sacchi 25 kg, bancale da 40"],
+    ):
+        documento = fitz.open()
+        documento.new_page().insert_text((50, 60), "\n".join(righe * 10), fontsize=9)
+        fatture.append(documento.tobytes())
+        documento.close()
+    return fatture
+
+
+# ========== OPERATORE ==========
+
+class Operatore:
+    """Sessione di un operatore: client con cookie proprio, azienda e generatore casuale"""
+
+    def __init__(self, indice: int, client: httpx.AsyncClient, azienda: Azienda, registro, fatture: List[bytes], seme: int):
+        self.indice = indice
+        self.client = client
+        self.azienda = azienda
+        self.registro = registro
+        self.fatture = fatture
+        self.rng = random.Random(seme * 100003 + indice)
+        self.richieste = 0
+
+    async def richiesta(self, etichetta: str, metodo: str, url: str, stato: int = 200, **kwargs):
+        """Esegue e registra una richiesta; errore se lo stato non è quello atteso o la richiesta fallisce"""
+        inizio = time.perf_counter()
+        try:
+            risposta = await self.client.request(metodo, url, **kwargs)
+            esito = "ok" if risposta.status_code == stato else str(risposta.status_code)
+        except httpx.HTTPError as e:
+            esito = type(e).__name__
+        self.registro(etichetta, (time.perf_counter() - inizio) * 1000, esito)
+        self.richieste += 1
+        return esito == "ok"
+
+    def campo(self) -> tuple:
+        return self.rng.choice(self.azienda.campi)
+
+    def giorno(self) -> str:
+        """Un giorno della stagione di prova, tra aprile e settembre"""
+        return (date(ULTIMO_ANNO, 4, 1) + timedelta(days=self.rng.randrange(183))).isoformat()
+
+
+async def _login(op: Operatore):
+    return await op.richiesta(
+        "POST /login", "POST", "/login", 303, data={"username": op.azienda.username, "password": PASSWORD}
+    )
+
+
+async def _dashboard(op: Operatore):
+    if await op.richiesta("GET /dashboard", "GET", "/dashboard"):
+        # La pagina chiede il meteo della posizione dell'azienda: stesse coordinate, cache condivisa
+        _, lat, lng = op.azienda.campi[0]
+        await op.richiesta("GET /api/meteo", "GET", "/api/meteo", params={"lat": round(lat, 2), "lng": round(lng, 2)})
+
+
+async def _quaderno(op: Operatore):
+    await op.richiesta("GET /quaderno", "GET", "/quaderno")
+
+
+async def _trattamento(op: Operatore):
+    campo_id, _, _ = op.campo()
+    dati = {
+        "campo_id": campo_id,
+        "data": op.giorno(),
+        "prodotto_id": op.rng.choice(op.azienda.prodotti),
+        "quantita_per_ettaro": round(op.rng.uniform(0.5, 2.5), 2),
+        "avversita": op.rng.choice(["Peronospora", "Oidio", "Afidi", "Piralide"]),
+        "operatore": f"Operatore {op.indice + 1}",
+        "note": "Test di carico",
+    }
+    if op.azienda.mezzi:
+        dati["mezzo_id"] = op.rng.choice(op.azienda.mezzi)
+    if await op.richiesta("GET /quaderno", "GET", "/quaderno"):
+        await op.richiesta("POST /quaderno/trattamento/nuovo", "POST", "/quaderno/trattamento/nuovo", 303, data=dati)
+
+
+async def _mappa(op: Operatore):
+    if not await op.richiesta("GET /mappa", "GET", "/mappa"):
+        return
+    if op.rng.random() < 0.3:
+        # Nuovo appezzamento (quadrilatero di circa un ettaro) vicino a un campo esistente
+        _, lat, lng = op.campo()
+        lat += op.rng.uniform(-0.01, 0.01)
+        lng += op.rng.uniform(-0.01, 0.01)
+        coordinate = [[lat, lng], [lat + 0.0009, lng], [lat + 0.0009, lng + 0.0013], [lat, lng + 0.0013]]
+        await op.richiesta("POST /api/campo/salva", "POST", "/api/campo/salva", data={
+            "nome": f"Carico {op.indice + 1}-{op.richieste}",
+            "coordinate": json.dumps(coordinate),
+            "coltura": "Mais",
+        })
+
+
+async def _fattura(op: Operatore):
+    nome = f"{PREFISSO_FATTURE}{op.indice + 1}-{op.richieste}.pdf"
+    await op.richiesta(
+        "POST /magazzino/upload", "POST", "/magazzino/upload", 303,
+        files={"file": (nome, op.rng.choice(op.fatture), "application/pdf")},
+        data={"quantita": str(op.rng.choice([10, 25, 50]))},
+    )
+
+
+async def _export_pdf(op: Operatore):
+    await op.richiesta("GET /quaderno/export/pdf", "GET", "/quaderno/export/pdf", params={"anno": ULTIMO_ANNO})
+
+
+# Giornata tipo: soprattutto consultazione, registrazioni frequenti, export e fatture occasionali
+AZIONI = {
+    "dashboard": Azione(30, _dashboard),
+    "quaderno": Azione(25, _quaderno),
+    "trattamento": Azione(20, _trattamento),
+    "mappa": Azione(12, _mappa),
+    "fattura": Azione(5, _fattura),
+    "export_pdf": Azione(8, _export_pdf),
+}
+
+
+# ========== ESECUZIONE ==========
+
+class Registro:
+    """Tempi ed esiti per fase e route"""
+
+    def __init__(self):
+        self.fase = 0
+        self.tempi: Dict[tuple, List[float]] = defaultdict(list)
+        self.esiti: Dict[tuple, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def __call__(self, etichetta: str, durata_ms: float, esito: str):
+        self.tempi[(self.fase, etichetta)].append(durata_ms)
+        self.esiti[(self.fase, etichetta)][esito] += 1
+
+    def riepilogo(self, fase: int, durata: float) -> Dict[str, dict]:
+        """{route: richieste, rps, p50/p95/p99 in ms, errori (frazione e dettaglio)}"""
+        riepilogo = {}
+        etichette = sorted(e for f, e in self.tempi if f == fase)
+        for etichetta in etichette + ["TOTALE"]:
+            if etichetta == "TOTALE":
+                tempi = [t for (f, _), valori in self.tempi.items() if f == fase for t in valori]
+                esiti = defaultdict(int)
+                for (f, _), conteggi in self.esiti.items():
+                    if f == fase:
+                        for esito, n in conteggi.items():
+                            esiti[esito] += n
+            else:
+                tempi, esiti = self.tempi[(fase, etichetta)], self.esiti[(fase, etichetta)]
+            if not tempi:
+                continue
+            errori = {e: n for e, n in esiti.items() if e != "ok"}
+            riepilogo[etichetta] = {
+                "richieste": len(tempi),
+                "rps": round(len(tempi) / durata, 2),
+                "p50_ms": round(percentile(tempi, 50), 1),
+                "p95_ms": round(percentile(tempi, 95), 1),
+                "p99_ms": round(percentile(tempi, 99), 1),
+                "errori": round(sum(errori.values()) / len(tempi), 4),
+                "dettaglio_errori": errori,
+            }
+        return riepilogo
+
+
+async def _sessione(indice: int, url: str, azienda: Azienda, registro: Registro, fatture, pensiero: float,
+                    timeout: float, seme: int):
+    """Ciclo di un operatore: login, poi azioni pesate con pause di riflessione (esponenziali)"""
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, follow_redirects=False) as client:
+        op = Operatore(indice, client, azienda, registro, fatture, seme)
+        nomi = list(AZIONI)
+        pesi = [AZIONI[n].peso for n in nomi]
+        # Gli operatori non arrivano tutti nello stesso istante
+        await asyncio.sleep(op.rng.uniform(0, pensiero))
+        while not await _login(op):
+            await asyncio.sleep(1)
+        while True:
+            await AZIONI[op.rng.choices(nomi, pesi)[0]].esegui(op)
+            if pensiero:
+                await asyncio.sleep(op.rng.expovariate(1 / pensiero))
+
+
+async def esegui_fasi(url: str, aziende: List[Azienda], utenti: List[int], durata_fase: float, pensiero: float = 2.0,
+                      timeout: float = 30.0, seme: int = 42, progresso=print) -> List[dict]:
+    """
+    Esegue le fasi di carico, una per numero di operatori contemporanei
+
+    Gli operatori restano attivi da una fase all'altra (un aumento ne
+    aggiunge, una riduzione ferma gli ultimi) e sono assegnati alle aziende
+    a rotazione. Le richieste contano nella fase in cui terminano.
+    """
+    fatture = fatture_pdf()
+    registro = Registro()
+    sessioni: List[asyncio.Task] = []
+    fasi = []
+    try:
+        for fase, operatori in enumerate(utenti):
+            registro.fase = fase
+            while len(sessioni) < operatori:
+                indice = len(sessioni)
+                sessioni.append(asyncio.create_task(_sessione(
+                    indice, url, aziende[indice % len(aziende)], registro, fatture, pensiero, timeout, seme
+                )))
+            while len(sessioni) > operatori:
+                sessioni.pop().cancel()
+
+            await asyncio.sleep(durata_fase)
+            # Un operatore terminato per un'eccezione non prevista è un errore dell'harness, non del server
+            for sessione in sessioni:
+                if sessione.done() and not sessione.cancelled() and sessione.exception():
+                    raise sessione.exception()
+            fasi.append({"operatori": operatori, "secondi": durata_fase, "route": registro.riepilogo(fase, durata_fase)})
+            progresso(fasi[-1])
+    finally:
+        for sessione in sessioni:
+            sessione.cancel()
+        await asyncio.gather(*sessioni, return_exceptions=True)
+    return fasi
+
+
+# ========== SERVER LOCALE ==========
+
+def _porta_libera() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _attendi(url: str, processo: subprocess.Popen, secondi: float = 60.0):
+    scadenza = time.monotonic() + secondi
+    while time.monotonic() < scadenza:
+        if processo.poll() is not None:
+            raise RuntimeError(f"Il processo per {url} è terminato con codice {processo.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} non risponde dopo {secondi:.0f} secondi")
+
+
+@contextmanager
+def server_locale(database: str, workers: int = 1, latenza_meteo: float = 0.2):
+    """
+    Avvia Open-Meteo locale e l'app (uvicorn) su una copia del database; restituisce l'URL dell'app
+
+    A fine test i processi vengono fermati, la copia eliminata e le
+    fatture caricate rimosse da static/uploads.
+    """
+    cartella = tempfile.mkdtemp(prefix="agrinote-carico-")
+    copia = os.path.join(cartella, "agrinote.db")
+    shutil.copyfile(database, copia)
+    porta_meteo, porta_app = _porta_libera(), _porta_libera()
+    ambiente = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{copia}",
+        "METEO_URL": f"http://127.0.0.1:{porta_meteo}/v1/forecast",
+        "LOG_LIVELLO": os.environ.get("LOG_LIVELLO", "ERROR"),  # Solo gli errori: le query lente sono attese
+        "PROMETHEUS_MULTIPROC_DIR": os.path.join(cartella, "metriche"),
+    }
+    os.makedirs(ambiente["PROMETHEUS_MULTIPROC_DIR"])
+    processi = []
+    try:
+        processi.append(subprocess.Popen(
+            [sys.executable, "-m", "benchmark.meteo", "--porta", str(porta_meteo), "--latenza", str(latenza_meteo)],
+            cwd=RADICE, stdout=subprocess.DEVNULL,
+        ))
+        _attendi(f"http://127.0.0.1:{porta_meteo}/statistiche", processi[-1])
+        processi.append(subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(porta_app),
+                "--workers", str(workers), "--log-level", "warning", "--no-access-log",
+            ],
+            cwd=RADICE, env=ambiente,
+        ))
+        url = f"http://127.0.0.1:{porta_app}"
+        _attendi(f"{url}/login", processi[-1])
+        yield url
+    finally:
+        for processo in reversed(processi):
+            processo.terminate()
+            try:
+                processo.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+        shutil.rmtree(cartella, ignore_errors=True)
+        for fattura in glob.glob(os.path.join(RADICE, "static", "uploads", f"{PREFISSO_FATTURE}*.pdf")):
+            os.remove(fattura)
+
+
+def _stampa_fase(fase: dict):
+    print(f"\n👥 {fase['operatori']} operatori, {fase['secondi']:.0f} s", flush=True)
+    print(f"{'route':<34} {'richieste':>9} {'rich/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errori':>8}")
+    for etichetta, voce in fase["route"].items():
+        simbolo = "❌" if voce["errori"] else "  "
+        print(
+            f"{simbolo}{etichetta:<32} {voce['richieste']:>9} {voce['rps']:>8.2f} {voce['p50_ms']:>9.1f} "
+            f"{voce['p95_ms']:>9.1f} {voce['p99_ms']:>9.1f} {voce['errori']:>8.1%}",
+            flush=True,
+        )
+        if voce["dettaglio_errori"]:
+            print(f"    {', '.join(f'{e}: {n}' for e, n in voce['dettaglio_errori'].items())}")
+
+
+def main():
+    import argparse
+    from benchmark.__main__ import SEME, database_di_prova
+
+    parser = argparse.ArgumentParser(description="Test di carico HTTP con sessioni di operatori")
+    parser.add_argument("--utenti", default="5,10,20", help="Operatori contemporanei per fase, separati da virgola")
+    parser.add_argument("--durata-fase", type=float, default=30.0, help="Secondi per fase")
+    parser.add_argument("--pensiero", type=float, default=2.0, help="Pausa media tra due azioni (secondi, 0 = nessuna)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Timeout per richiesta (secondi)")
+    parser.add_argument("--trattamenti", type=int, default=100000, help="Trattamenti nel database di prova (con --avvia)")
+    parser.add_argument("--aziende", type=int, default=5, help="Aziende nel database di prova (con --avvia)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker uvicorn (con --avvia)")
+    parser.add_argument("--latenza-meteo", type=float, default=0.2, help="Latenza di Open-Meteo locale (con --avvia)")
+    parser.add_argument("--url", help="Server già avviato (al posto di --avvia)")
+    parser.add_argument("--database", help="Database da copiare e servire (default: quello di prova); con --url quello del server, per leggere le aziende")
+    parser.add_argument("--seme", type=int, default=SEME)
+    parser.add_argument("--output", help="File JSON dei risultati")
+    args = parser.parse_args()
+
+    utenti = [int(u) for u in args.utenti.split(",")]
+    database = args.database or database_di_prova(args.trattamenti, args.aziende)
+    aziende = aziende_del_database(database)
+    if not aziende:
+        parser.error(f"nessuna azienda con campi e fitofarmaci in {database}")
+
+    def esegui(url: str) -> List[dict]:
+        print(f"🚜 {url}: fasi da {', '.join(map(str, utenti))} operatori su {len(aziende)} aziende", flush=True)
+        return asyncio.run(esegui_fasi(
+            url, aziende, utenti, args.durata_fase, args.pensiero, args.timeout, args.seme, _stampa_fase
+        ))
+
+    if args.url:
+        fasi = esegui(args.url.rstrip("/"))
+    else:
+        with server_locale(database, args.workers, args.latenza_meteo) as url:
+            fasi = esegui(url)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({
+                "url": args.url or "locale",
+                "database": os.path.basename(database),
+                "workers": None if args.url else args.workers,
+                "pensiero": args.pensiero,
+                "fasi": fasi,
+            }, file, indent=2)
+        print(f"\n📄 Risultati in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
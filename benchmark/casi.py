@@ -0,0 +1,190 @@
+"""
+Casi di benchmark ed esecuzione su un database di prova
+
+Eseguito dall'orchestratore (python -m benchmark) in un processo per ogni
+dimensione dei dati: DATABASE_URL va impostato prima di importare l'app.
+
+    python -m benchmark.casi --database benchmark/dati/agrinote-1000.db --dimensione 1000 --output r.json
+"""
+import json
+import math
+import os
+import sys
+import tempfile
+from datetime import date
+from typing import Callable, NamedTuple, Optional, Tuple
+
+RADICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dati dei database di prova (seed.py --massivo): anni fissi, così la baseline resta confrontabile
+ULTIMO_ANNO = 2025
+STAGIONI = 3
+UTENTE = {"username": "admin", "password": "admin123"}
+
+
+class Caso(NamedTuple):
+    prepara: Callable[["Contesto", int], Callable[[], object]]  # (contesto, dimensione) -> funzione da misurare
+    dimensioni: Optional[Tuple[int, ...]] = None  # None: le dimensioni del database di prova
+
+
+class Contesto:
+    """App importata, client ASGI autenticato e cartella per i file temporanei"""
+
+    def __init__(self, app_main, client, cartella: str):
+        self.main = app_main
+        self.client = client
+        self.cartella = cartella
+
+
+def _verifica(risposta, stato: int = 200):
+    if risposta.status_code != stato:
+        raise RuntimeError(f"{risposta.request.url.path}: stato {risposta.status_code} invece di {stato}")
+    return risposta
+
+
+# ========== CASI ==========
+
+def _area(ctx: Contesto, vertici: int):
+    """Poligono regolare di circa 10 ettari con `vertici` punti"""
+    coordinate = [
+        [45.46 + 0.0016 * math.sin(2 * math.pi * i / vertici), 9.19 + 0.0023 * math.cos(2 * math.pi * i / vertici)]
+        for i in range(vertici)
+    ]
+    return lambda: ctx.main.calcola_area_poligono(coordinate)
+
+
+def _fattura(ctx: Contesto, pagine: int):
+    """Fattura PDF di `pagine` pagine, creata con PyMuPDF"""
+    import fitz
+
+    percorso = os.path.join(ctx.cartella, f"fattura-{pagine}.pdf")
+    documento = fitz.open()
+    for numero in range(pagine):
+        pagina = documento.new_page()
+        righe = [f"Fattura n. 2025/{numero + 1:04d} - Consorzio Agrario", "Fungicida Rame 20 WG", ""]
+        righe += [f"Riga {r + 1}: Concime NPK 20-10-10, sacchi 25 kg, quantita {r + 3}" for r in range(40)]
+        pagina.insert_text((50, 60), "\n".join(righe), fontsize=9)
+    documento.save(percorso)
+    documento.close()
+    return lambda: ctx.main.analizza_fattura_pdf(percorso)
+
+
+def _login(ctx: Contesto, _):
+    return lambda: _verifica(ctx.client.post("/login", data=UTENTE, follow_redirects=False), 303)
+
+
+def _quaderno_pdf(ctx: Contesto, _):
+    """PDF dell'ultima stagione, con la stessa query dell'export (relazioni caricate a richiesta)"""
+    from models import SessionLocal, Azienda, Campo, Trattamento, User
+    from pdf_quaderno import genera_quaderno_pdf
+
+    percorso = os.path.join(ctx.cartella, "quaderno.pdf")
+
+    def genera():
+        db = SessionLocal()
+        try:
+            azienda = db.query(Azienda).join(User).filter(User.username == UTENTE["username"]).first()
+            trattamenti = db.query(Trattamento).join(Campo).filter(
+                Campo.azienda_id == azienda.id,
+                Trattamento.data >= date(ULTIMO_ANNO, 1, 1),
+            ).order_by(Trattamento.data.asc(), Trattamento.id).all()
+            genera_quaderno_pdf(azienda, trattamenti, percorso)
+        finally:
+            db.close()
+    return genera
+
+
+def _pagina(percorso: str):
+    def prepara(ctx: Contesto, _):
+        return lambda: _verifica(ctx.client.get(percorso))
+    return prepara
+
+
+def _pagina_senza_frammenti(percorso: str):
+    """Rendering completo: la cache dei frammenti è svuotata prima di ogni richiesta"""
+    def prepara(ctx: Contesto, _):
+        def chiama():
+            ctx.main.cache_template.frammenti.svuota()
+            return _verifica(ctx.client.get(percorso))
+        return chiama
+    return prepara
+
+
+def _api_meteo(ctx: Contesto, _):
+    """Chiamata completa (cache svuotata), con le risposte Open-Meteo locali"""
+    def chiama():
+        ctx.main._cache_meteo.clear()
+        return _verifica(ctx.client.get("/api/meteo", params={"lat": 45.46, "lng": 9.19}))
+    return chiama
+
+
+CASI = {
+    "calcola_area_poligono": Caso(_area, (10, 100, 1000)),
+    "analizza_fattura_pdf": Caso(_fattura, (1, 10, 50)),
+    "login": Caso(_login, (1,)),
+    "genera_quaderno_pdf": Caso(_quaderno_pdf),
+    "dashboard": Caso(_pagina("/dashboard")),
+    "quaderno": Caso(_pagina("/quaderno")),
+    "quaderno_senza_frammenti": Caso(_pagina_senza_frammenti("/quaderno")),
+    "mappa": Caso(_pagina("/mappa")),
+    "api_meteo": Caso(_api_meteo),
+}
+
+
+# ========== ESECUZIONE ==========
+
+def esegui(database: str, dimensione: int, casi: list, ripetizioni: int, tempo_max: float, progresso=print) -> dict:
+    """Misura i casi indicati su un database di prova; {"caso[dimensione]": risultato}"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(database)}"
+    os.environ.setdefault("LOG_LIVELLO", "WARNING")
+    os.environ["SQL_LENTA_MS"] = "1e9"  # Le query lente sono attese, non vanno nel log
+    os.chdir(RADICE)  # Template e file statici sono relativi alla radice del progetto
+    sys.path.insert(0, RADICE)
+
+    from fastapi.testclient import TestClient
+    from benchmark.meteo import meteo_offline
+    from benchmark.misura import misura
+
+    risultati = {}
+    with meteo_offline(), tempfile.TemporaryDirectory() as cartella:
+        import main as app_main
+
+        with TestClient(app_main.app) as client:
+            _verifica(client.post("/login", data=UTENTE, follow_redirects=False), 303)
+            contesto = Contesto(app_main, client, cartella)
+
+            for nome in casi:
+                caso = CASI[nome]
+                for dimensione_caso in caso.dimensioni or (dimensione,):
+                    chiave = f"{nome}[{dimensione_caso}]"
+                    try:
+                        funzione = caso.prepara(contesto, dimensione_caso)
+                        risultati[chiave] = misura(funzione, ripetizioni, tempo_max)
+                    except Exception as e:
+                        risultati[chiave] = {"errore": f"{type(e).__name__}: {e}"}
+                    risultati[chiave].update({"caso": nome, "dimensione": dimensione_caso})
+                    progresso(chiave, risultati[chiave])
+    return risultati
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Esegue i casi di benchmark su un database di prova")
+    parser.add_argument("--database", required=True, help="File SQLite generato con seed.py --massivo")
+    parser.add_argument("--dimensione", type=int, required=True, help="Trattamenti nel database")
+    parser.add_argument("--casi", default=",".join(CASI), help="Casi separati da virgola")
+    parser.add_argument("--ripetizioni", type=int, default=10)
+    parser.add_argument("--tempo-max", type=float, default=30.0, help="Secondi massimi per caso (almeno 3 campioni)")
+    parser.add_argument("--output", required=True, help="File JSON dei risultati")
+    args = parser.parse_args()
+
+    def stampa(chiave, risultato):
+        if "errore" in risultato:
+            print(f"  ❌ {chiave}: {risultato['errore']}", flush=True)
+        else:
+            print(f"  ⏱️  {chiave}: {risultato['mediana_ms']:.3f} ms (p95 {risultato['p95_ms']:.3f})", flush=True)
+
+    risultati = esegui(args.database, args.dimensione, args.casi.split(","), args.ripetizioni, args.tempo_max, stampa)
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(risultati, file, indent=2)
@@ -0,0 +1,198 @@
+"""
+Open-Meteo locale, per benchmark e test di carico senza rete
+
+Le risposte hanno la stessa forma di /v1/forecast (blocchi current, hourly
+e daily con le sole variabili richieste) e valori plausibili, deterministici
+per coordinate e giorno. Due modi d'uso:
+
+- nello stesso processo (meteo_offline): un MockTransport per httpx, usato
+  da python -m benchmark;
+- come server HTTP, con latenza, errori e richieste bloccate configurabili,
+  per i test di carico sull'app avviata con METEO_URL:
+
+    python -m benchmark.meteo --porta 8090 --latenza 0.3 --errori 0.05 --blocchi 0.02
+    METEO_URL=http://127.0.0.1:8090/v1/forecast METEO_TIMEOUT_SECONDI=2 uvicorn main:app
+
+GET /statistiche riporta le richieste ricevute per esito (con ?azzera=1 le
+azzera): confrontate con le richieste fatte all'app mostrano quante
+chiamate la cache meteo risparmia e quante ne partono in parallelo per la
+stessa previsione.
+"""
+import asyncio
+import math
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import httpx
+
+# Variabile -> (unità, generatore del valore da (rng, ora del giorno o None, giorno))
+VARIABILI = {
+    "temperature_2m": ("°C", lambda rng, ora, g: round(14 + 8 * math.sin(math.pi * ((ora or 14) - 8) / 12) + rng.uniform(-2, 2), 1)),
+    "temperature_2m_max": ("°C", lambda rng, ora, g: round(22 + rng.uniform(-4, 6), 1)),
+    "temperature_2m_min": ("°C", lambda rng, ora, g: round(10 + rng.uniform(-4, 4), 1)),
+    "relative_humidity_2m": ("%", lambda rng, ora, g: rng.randint(40, 95)),
+    "precipitation": ("mm", lambda rng, ora, g: round(max(0.0, rng.gauss(0, 1.5)), 1)),
+    "precipitation_sum": ("mm", lambda rng, ora, g: round(max(0.0, rng.gauss(0, 6)), 1)),
+    "precipitation_probability_max": ("%", lambda rng, ora, g: rng.randint(0, 100)),
+    "wind_speed_10m": ("km/h", lambda rng, ora, g: round(rng.uniform(0, 25), 1)),
+    "wind_speed_10m_max": ("km/h", lambda rng, ora, g: round(rng.uniform(5, 40), 1)),
+    "weather_code": ("wmo code", lambda rng, ora, g: rng.choice([0, 1, 2, 3, 45, 51, 61, 63, 80, 95])),
+}
+
+
+def _variabili(valore: str) -> list:
+    return [v for v in valore.split(",") if v]
+
+
+def _valore(variabile: str, rng: random.Random, ora, giorno: date):
+    generatore = VARIABILI.get(variabile)
+    return generatore[1](rng, ora, giorno) if generatore else 0
+
+
+def risposta_previsioni(params: dict, oggi: date = None) -> dict:
+    """Corpo JSON di /v1/forecast per i parametri della richiesta (valori stringa)"""
+    lat = round(float(params.get("latitude", 45.46)), 2)
+    lng = round(float(params.get("longitude", 9.19)), 2)
+    giorni = int(params.get("forecast_days", 7))
+    oggi = oggi or date.today()
+    # Seme da stringa: stabile tra processi (a differenza di hash())
+    rng = random.Random(f"{lat}:{lng}:{oggi.isoformat()}")
+
+    risposta = {
+        "latitude": lat,
+        "longitude": lng,
+        "generationtime_ms": 0.1,
+        "utc_offset_seconds": 7200,
+        "timezone": params.get("timezone", "GMT"),
+        "elevation": 120.0,
+    }
+    if "current" in params:
+        variabili = _variabili(params["current"])
+        adesso = datetime.combine(oggi, datetime.min.time()).replace(hour=datetime.now().hour)
+        risposta["current_units"] = {"time": "iso8601", **{v: VARIABILI.get(v, ("",))[0] for v in variabili}}
+        risposta["current"] = {
+            "time": adesso.strftime("%Y-%m-%dT%H:00"),
+            "interval": 900,
+            **{v: _valore(v, rng, adesso.hour, oggi) for v in variabili},
+        }
+    if "hourly" in params:
+        variabili = _variabili(params["hourly"])
+        ore = [datetime.combine(oggi, datetime.min.time()) + timedelta(hours=h) for h in range(24 * giorni)]
+        risposta["hourly_units"] = {"time": "iso8601", **{v: VARIABILI.get(v, ("",))[0] for v in variabili}}
+        risposta["hourly"] = {
+            "time": [o.strftime("%Y-%m-%dT%H:00") for o in ore],
+            **{v: [_valore(v, rng, o.hour, o.date()) for o in ore] for v in variabili},
+        }
+    if "daily" in params:
+        variabili = _variabili(params["daily"])
+        date_previsione = [oggi + timedelta(days=g) for g in range(giorni)]
+        risposta["daily_units"] = {"time": "iso8601", **{v: VARIABILI.get(v, ("",))[0] for v in variabili}}
+        risposta["daily"] = {
+            "time": [d.isoformat() for d in date_previsione],
+            **{v: [_valore(v, rng, None, d) for d in date_previsione] for v in variabili},
+        }
+    return risposta
+
+
+def _gestore(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json=risposta_previsioni(dict(request.url.params)))
+
+
+@contextmanager
+def meteo_offline():
+    """
+    Sostituisce le chiamate HTTP asincrone con risposte locali
+
+    Ogni httpx.AsyncClient creato nel blocco usa un MockTransport: il
+    codice dell'app (cache, parsing, alert) gira invariato, senza rete.
+    """
+    originale = httpx.AsyncClient
+
+    class ClientOffline(originale):
+        def __init__(self, *args, **kwargs):
+            kwargs["transport"] = httpx.MockTransport(_gestore)
+            super().__init__(*args, **kwargs)
+
+    httpx.AsyncClient = ClientOffline
+    try:
+        yield
+    finally:
+        httpx.AsyncClient = originale
+
+
+# ========== SERVER ==========
+
+def crea_app(latenza: float = 0.2, variazione: float = 0.1, errori: float = 0.0, blocchi: float = 0.0,
+             attesa_blocco: float = 60.0, seme: int = 0):
+    """
+    App ASGI che imita /v1/forecast
+
+    Ogni richiesta attende `latenza` secondi (± `variazione`); una frazione
+    `errori` risponde 503, una frazione `blocchi` resta in attesa per
+    `attesa_blocco` secondi (oltre il timeout del client, per provocarlo).
+    """
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    rng = random.Random(seme)
+    statistiche = Counter()
+    avvio = [time.monotonic()]
+
+    async def previsioni(request):
+        statistiche["richieste"] += 1
+        statistiche["in_corso"] += 1
+        statistiche["picco_in_corso"] = max(statistiche["picco_in_corso"], statistiche["in_corso"])
+        try:
+            estrazione = rng.random()
+            if estrazione < blocchi:
+                statistiche["bloccate"] += 1
+                await asyncio.sleep(attesa_blocco)
+                return JSONResponse(risposta_previsioni(dict(request.query_params)))
+
+            await asyncio.sleep(max(0.0, latenza + rng.uniform(-variazione, variazione)))
+            if estrazione < blocchi + errori:
+                statistiche["errori"] += 1
+                return JSONResponse({"error": True, "reason": "Servizio non disponibile (simulato)"}, status_code=503)
+            statistiche["ok"] += 1
+            return JSONResponse(risposta_previsioni(dict(request.query_params)))
+        finally:
+            statistiche["in_corso"] -= 1
+
+    async def leggi_statistiche(request):
+        dati = {**statistiche, "secondi": round(time.monotonic() - avvio[0], 1)}
+        if request.query_params.get("azzera"):
+            statistiche.clear()
+            avvio[0] = time.monotonic()
+        return JSONResponse(dati)
+
+    return Starlette(routes=[
+        Route("/v1/forecast", previsioni),
+        Route("/statistiche", leggi_statistiche),
+    ])
+
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Server Open-Meteo locale per i test di carico")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8090)
+    parser.add_argument("--latenza", type=float, default=0.2, help="Secondi di attesa per risposta")
+    parser.add_argument("--variazione", type=float, default=0.1, help="Variazione casuale della latenza (±secondi)")
+    parser.add_argument("--errori", type=float, default=0.0, help="Frazione di risposte 503")
+    parser.add_argument("--blocchi", type=float, default=0.0, help="Frazione di richieste che non rispondono in tempo")
+    parser.add_argument("--attesa-blocco", type=float, default=60.0, help="Secondi di attesa delle richieste bloccate")
+    parser.add_argument("--seme", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"🌦️  Open-Meteo locale su http://{args.host}:{args.porta}/v1/forecast "
+          f"(latenza {args.latenza}s, errori {args.errori:.0%}, blocchi {args.blocchi:.0%})")
+    uvicorn.run(
+        crea_app(args.latenza, args.variazione, args.errori, args.blocchi, args.attesa_blocco, args.seme),
+        host=args.host, port=args.porta, log_level="warning",
+    )
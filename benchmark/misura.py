@@ -0,0 +1,84 @@
+"""
+Misura dei tempi, statistiche e confronto con la baseline
+"""
+import math
+import statistics
+import time
+from typing import Callable, Dict, List, Optional
+
+# Un campione dura almeno così: le funzioni veloci sono ripetute in un ciclo (come timeit)
+DURATA_MINIMA_CAMPIONE = 0.01
+
+
+def percentile(valori: List[float], p: float) -> float:
+    """Percentile nearest-rank (p tra 0 e 100)"""
+    ordinati = sorted(valori)
+    return ordinati[max(0, math.ceil(p / 100 * len(ordinati)) - 1)]
+
+
+def misura(funzione: Callable[[], object], ripetizioni: int = 10, tempo_max: float = 30.0, riscaldamento: int = 1) -> dict:
+    """
+    Tempi di `funzione` in millisecondi: mediana, p95, minimo, media
+
+    Dopo `riscaldamento` esecuzioni (cache, import, compilazione dei
+    template), raccoglie fino a `ripetizioni` campioni e si ferma prima se
+    supera `tempo_max` secondi (con almeno 3 campioni).
+    """
+    for _ in range(riscaldamento):
+        funzione()
+
+    # Esecuzioni per campione, così i tempi di pochi microsecondi restano misurabili
+    cicli = 1
+    while True:
+        inizio = time.perf_counter()
+        for _ in range(cicli):
+            funzione()
+        if time.perf_counter() - inizio >= DURATA_MINIMA_CAMPIONE:
+            break
+        cicli *= 10
+
+    campioni = []
+    avvio = time.perf_counter()
+    while len(campioni) < ripetizioni and (len(campioni) < 3 or time.perf_counter() - avvio < tempo_max):
+        inizio = time.perf_counter()
+        for _ in range(cicli):
+            funzione()
+        campioni.append((time.perf_counter() - inizio) / cicli * 1000)
+
+    return {
+        "campioni": len(campioni),
+        "cicli": cicli,
+        "mediana_ms": round(statistics.median(campioni), 4),
+        "p95_ms": round(percentile(campioni, 95), 4),
+        "min_ms": round(min(campioni), 4),
+        "media_ms": round(statistics.fmean(campioni), 4),
+    }
+
+
+def confronta(risultati: Dict[str, dict], baseline: Dict[str, dict], soglia: float) -> List[dict]:
+    """
+    Confronto delle mediane con la baseline, per ogni caso misurato
+
+    stato: "regressione" se la mediana supera quella di riferimento di più
+    di `soglia` (0.25 = +25%), "miglioramento" se scende di altrettanto,
+    "nuovo" se il caso non è nella baseline.
+    """
+    confronto = []
+    for chiave, risultato in risultati.items():
+        riferimento: Optional[dict] = baseline.get(chiave)
+        voce = {"chiave": chiave, "mediana_ms": risultato.get("mediana_ms"), "baseline_ms": None, "variazione": None}
+        if "errore" in risultato:
+            voce["stato"] = "errore"
+        elif not riferimento or "mediana_ms" not in riferimento:
+            voce["stato"] = "nuovo"
+        else:
+            voce["baseline_ms"] = riferimento["mediana_ms"]
+            voce["variazione"] = risultato["mediana_ms"] / riferimento["mediana_ms"] - 1
+            if voce["variazione"] > soglia:
+                voce["stato"] = "regressione"
+            elif voce["variazione"] < -soglia:
+                voce["stato"] = "miglioramento"
+            else:
+                voce["stato"] = "invariato"
+        confronto.append(voce)
+    return confronto
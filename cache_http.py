@@ -0,0 +1,223 @@
+"""
+Cache HTTP e compressione delle risposte (tablet in campo su reti lente)
+
+ETag deboli: le pagine che mostrano solo dati sincronizzati (campi,
+prodotti, mezzi, trattamenti, interventi) ricavano l'ETag dalla revisione
+dei dati dell'azienda (sync_revisioni_aziende, aggiornata dai trigger a
+ogni modifica: le modifiche di altre aziende non la cambiano), più
+utente, azienda, indirizzo, giorno e versione di template e risorse
+statiche. Se il browser ripresenta lo stesso ETag (If-None-Match) la route
+risponde 304 dopo tre query brevi, senza caricare i dati né eseguire il
+template. Sono deboli perché il corpo cambia con la compressione ma il
+contenuto è lo stesso.
+
+Compressione: le risposte testuali (HTML, JSON, CSV, JavaScript) sopra
+COMPRESSIONE_MIN_BYTE vengono compresse con brotli, se il pacchetto è
+installato e il client lo accetta, altrimenti con gzip. Le risposte in
+streaming (export CSV/NDJSON) sono compresse un blocco alla volta.
+"""
+import hashlib
+import os
+import zlib
+from datetime import date
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli  # Opzionale: pip install brotli
+except ImportError:
+    brotli = None
+
+try:
+    from config import COMPRESSIONE_MIN_BYTE
+except ImportError:
+    COMPRESSIONE_MIN_BYTE = 1024
+
+# Pagine con dati dell'utente: il browser conserva la copia ma la riconvalida sempre
+PRIVATA_RICONVALIDA = "private, no-cache"
+
+TIPI_COMPRIMIBILI = ("text/", "application/json", "application/javascript", "application/x-ndjson", "image/svg+xml")
+LIVELLO_GZIP = 6
+QUALITA_BROTLI = 4  # Compromesso per contenuti dinamici: 11 costa troppa CPU per richiesta
+
+
+def _impronta_cartelle(*cartelle: str) -> str:
+    """Nomi, dimensioni e date dei file: un deploy che li modifica cambia tutti gli ETag"""
+    impronta = hashlib.sha1()
+    for cartella in cartelle:
+        for radice, _, file in sorted(os.walk(cartella)):
+            for nome in sorted(file):
+                stato = os.stat(os.path.join(radice, nome))
+                impronta.update(f"{radice}/{nome}:{stato.st_size}:{stato.st_mtime_ns}".encode())
+    return impronta.hexdigest()[:12]
+
+
+# Template e risorse con impronta (le pagine contengono gli URL di CSS e Leaflet)
+VERSIONE_PAGINE = _impronta_cartelle("templates", "static/css", "static/vendor")
+
+
+# ========== ETAG ==========
+
+def etag_debole(request: Request, *parti) -> str:
+    """ETag debole da indirizzo, query string, giorno corrente, versione delle pagine e `parti`"""
+    chiave = "|".join(str(p) for p in (VERSIONE_PAGINE, request.url.path, request.url.query, date.today(), *parti))
+    return f'W/"{hashlib.sha1(chiave.encode()).hexdigest()[:20]}"'
+
+
+def non_modificata(request: Request, etag: str) -> bool:
+    """True se If-None-Match contiene `etag` (confronto debole, come per le richieste GET)"""
+    intestazione = request.headers.get("if-none-match")
+    if not intestazione:
+        return False
+    if intestazione.strip() == "*":
+        return True
+    valore = etag.removeprefix("W/")
+    return any(candidato.strip().removeprefix("W/") == valore for candidato in intestazione.split(","))
+
+
+def etag_dati(request: Request, db, user, azienda, revisione: int = None) -> str:
+    """
+    ETag di una pagina costruita solo con dati sincronizzati dell'azienda
+
+    La revisione dell'azienda va letta prima dei dati: una modifica
+    concorrente produce al più una pagina più nuova del suo ETag, che alla
+    richiesta seguente non corrisponde e viene rigenerata. Le route che la
+    usano anche come chiave dei frammenti la leggono una volta e la passano
+    in `revisione`.
+    """
+    from sync import revisione_azienda
+
+    if revisione is None:
+        revisione = revisione_azienda(db, azienda.id)
+    anagrafica = [getattr(azienda, colonna.key) for colonna in azienda.__table__.columns]
+    return etag_debole(request, user.id, user.username, anagrafica, revisione)
+
+
+def risposta_304(etag: str, cache_control: str = PRIVATA_RICONVALIDA) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+def con_etag(risposta: Response, etag: str, cache_control: str = PRIVATA_RICONVALIDA) -> Response:
+    risposta.headers["ETag"] = etag
+    risposta.headers["Cache-Control"] = cache_control
+    return risposta
+
+
+# ========== COMPRESSIONE ==========
+
+def codifica_accettata(accept_encoding: str) -> str:
+    """"br", "gzip" o "" secondo Accept-Encoding (le codifiche con q=0 sono rifiutate)"""
+    accettate = set()
+    for voce in accept_encoding.lower().split(","):
+        nome, _, parametri = voce.strip().partition(";")
+        q = parametri.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accettate.add(nome.strip())
+    if brotli is not None and ("br" in accettate or "*" in accettate):
+        return "br"
+    if "gzip" in accettate or "*" in accettate:
+        return "gzip"
+    return ""
+
+
+class _Compressore:
+    """Interfaccia comune a gzip e brotli per corpi interi e a blocchi"""
+
+    def __init__(self, codifica: str):
+        self.codifica = codifica
+        if codifica == "br":
+            self._oggetto = brotli.Compressor(quality=QUALITA_BROTLI)
+        else:
+            self._oggetto = zlib.compressobj(LIVELLO_GZIP, zlib.DEFLATED, 31)  # 31: formato gzip
+
+    def blocco(self, dati: bytes) -> bytes:
+        """Comprime e svuota il buffer: il client riceve subito il blocco (streaming)"""
+        if self.codifica == "br":
+            return self._oggetto.process(dati) + self._oggetto.flush()
+        return self._oggetto.compress(dati) + self._oggetto.flush(zlib.Z_SYNC_FLUSH)
+
+    def fine(self, dati: bytes = b"") -> bytes:
+        if self.codifica == "br":
+            return self._oggetto.process(dati) + self._oggetto.finish()
+        return self._oggetto.compress(dati) + self._oggetto.flush()
+
+
+class MiddlewareCompressione:
+    """
+    Middleware ASGI per la compressione delle risposte testuali
+
+    Un corpo inviato in un solo messaggio è compresso se supera la soglia;
+    un corpo in streaming è compresso sempre, blocco per blocco. Le
+    risposte già codificate, i 304 e i tipi binari (PDF, immagini)
+    passano invariati.
+    """
+
+    def __init__(self, app, minimo: int = COMPRESSIONE_MIN_BYTE):
+        self.app = app
+        self.minimo = minimo
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        codifica = codifica_accettata(Headers(scope=scope).get("accept-encoding", ""))
+        if not codifica:
+            await self.app(scope, receive, send)
+            return
+
+        inizio = {}  # http.response.start trattenuto fino al primo blocco del corpo
+        avviata = []  # [True] dopo l'invio delle intestazioni
+        compressore = []  # [_Compressore] se la risposta viene compressa
+
+        async def invia(messaggio):
+            if messaggio["type"] == "http.response.start":
+                inizio.update(messaggio)
+                return
+            if messaggio["type"] != "http.response.body" or not inizio:
+                await send(messaggio)
+                return
+
+            if not avviata:
+                intestazioni = MutableHeaders(raw=list(inizio.get("headers", [])))
+                corpo, altro = messaggio.get("body", b""), messaggio.get("more_body", False)
+                comprimibile = (
+                    inizio["status"] not in (204, 304)
+                    and "content-encoding" not in intestazioni
+                    and intestazioni.get("content-type", "").startswith(TIPI_COMPRIMIBILI)
+                )
+                if comprimibile:
+                    intestazioni.add_vary_header("Accept-Encoding")
+                if comprimibile and (altro or len(corpo) >= self.minimo):
+                    compressore.append(_Compressore(codifica))
+                    intestazioni["Content-Encoding"] = codifica
+                    if altro:
+                        del intestazioni["Content-Length"]
+                    else:
+                        corpo = compressore[0].fine(corpo)
+                        intestazioni["Content-Length"] = str(len(corpo))
+                        messaggio = {**messaggio, "body": corpo}
+                inizio["headers"] = intestazioni.raw
+                avviata.append(True)
+                await send(inizio)
+                if not compressore or not altro:
+                    await send(messaggio)
+                    return
+
+            if compressore:
+                corpo = messaggio.get("body", b"")
+                if messaggio.get("more_body", False):
+                    corpo = compressore[0].blocco(corpo)
+                else:
+                    corpo = compressore[0].fine(corpo)
+                await send({**messaggio, "body": corpo})
+            else:
+                await send(messaggio)
+
+        await self.app(scope, receive, invia)
@@ -0,0 +1,189 @@
+"""
+Template Jinja2 precompilati e cache dei frammenti di pagina
+
+Bytecode: i template sono compilati all'avvio di ogni worker e il codice
+compilato è salvato in TEMPLATE_CACHE_DIR (FileSystemBytecodeCache), così
+i worker successivi e i riavvii caricano il bytecode invece di rifare
+parsing e compilazione. Jinja lo indicizza con il checksum del sorgente:
+un template modificato viene ricompilato.
+
+Frammenti: i blocchi costosi (tabella dei trattamenti, elenco dei mezzi)
+sono racchiusi in
+
+    {% frammento azienda.id, revisione %} ... {% endframmento %}
+
+e l'HTML prodotto resta in memoria, per worker, con chiave data dalle
+espressioni del tag (azienda e revisione dei dati dell'azienda, da
+sync_revisioni_aziende: le modifiche di altre aziende non la cambiano) e
+dal sorgente del template. Finché i dati non cambiano le visite successive
+copiano il frammento invece di eseguire il ciclo; le voci di revisioni
+superate escono per ultime usate quando si supera FRAMMENTI_CACHE_MB.
+I dati usati solo nel frammento si passano con Differito, così con il
+frammento in cache anche la query non parte.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from metriche import FRAMMENTI_CACHE
+
+try:
+    from config import TEMPLATE_CACHE_DIR, FRAMMENTI_CACHE_MB, ENVIRONMENT
+except ImportError:
+    TEMPLATE_CACHE_DIR = "template_compilati"
+    FRAMMENTI_CACHE_MB = 32
+    ENVIRONMENT = "development"
+
+log = logging.getLogger("agrinote.template")
+
+
+# ========== FRAMMENTI ==========
+
+class CacheFrammenti:
+    """HTML dei frammenti per chiave, eliminati per ultimo uso oltre `massimo_byte` (in caratteri)"""
+
+    def __init__(self, massimo_byte: int):
+        self.massimo_byte = massimo_byte
+        self._voci = OrderedDict()
+        self._dimensione = 0
+        self._lock = threading.Lock()  # Le route sincrone rendono i template nel threadpool
+
+    def leggi(self, chiave):
+        with self._lock:
+            html = self._voci.get(chiave)
+            if html is not None:
+                self._voci.move_to_end(chiave)
+            return html
+
+    def salva(self, chiave, html: str):
+        if len(html) > self.massimo_byte:
+            return
+        with self._lock:
+            precedente = self._voci.pop(chiave, None)
+            if precedente is not None:
+                self._dimensione -= len(precedente)
+            self._voci[chiave] = html
+            self._dimensione += len(html)
+            while self._dimensione > self.massimo_byte:
+                _, vecchio = self._voci.popitem(last=False)
+                self._dimensione -= len(vecchio)
+
+    def svuota(self):
+        with self._lock:
+            self._voci.clear()
+            self._dimensione = 0
+
+    def __len__(self):
+        return len(self._voci)
+
+
+frammenti = CacheFrammenti(FRAMMENTI_CACHE_MB * 1024 * 1024)
+
+
+class EstensioneFrammenti(Extension):
+    """Tag {% frammento chiave, ... %} ... {% endframmento %}"""
+
+    tags = {"frammento"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parti = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            parti.append(parser.parse_expression())
+        corpo = parser.parse_statements(("name:endframmento",), drop_needle=True)
+        # Template, riga e sorgente: dopo una modifica del template le vecchie voci non valgono più
+        nome = f"{parser.name}:{lineno}"
+        origine = nodes.Const(f"{nome}:{_versione_sorgente(parser.filename)}")
+        chiamata = self.call_method("_rendi", [nodes.Const(nome), origine, nodes.List(parti)])
+        return nodes.CallBlock(chiamata, [], [], corpo).set_lineno(lineno)
+
+    def _rendi(self, nome: str, origine: str, parti: list, caller) -> Markup:
+        chiave = (origine, *parti)
+        html = frammenti.leggi(chiave)
+        if html is not None:
+            FRAMMENTI_CACHE.labels(nome, "hit").inc()
+            return Markup(html)
+        FRAMMENTI_CACHE.labels(nome, "miss").inc()
+        html = caller()
+        frammenti.salva(chiave, html)
+        return Markup(html)
+
+
+def _versione_sorgente(percorso) -> str:
+    if not percorso:
+        return ""
+    with open(percorso, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()[:12]
+
+
+class Differito:
+    """
+    Sequenza caricata al primo uso (iterazione, len, test di verità)
+
+    Da passare al template per i dati letti solo dentro un frammento:
+    se il frammento è in cache la funzione non viene chiamata.
+    """
+
+    def __init__(self, carica):
+        self._carica = carica
+        self._valori = None
+
+    def _dati(self) -> list:
+        if self._valori is None:
+            self._valori = list(self._carica())
+        return self._valori
+
+    def __iter__(self):
+        return iter(self._dati())
+
+    def __len__(self):
+        return len(self._dati())
+
+    def __bool__(self):
+        return bool(self._dati())
+
+
+# ========== BYTECODE ==========
+
+def configura(templates):
+    """Bytecode su disco, tag frammento e controllo delle modifiche solo fuori produzione"""
+    env = templates.env
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+    env.add_extension(EstensioneFrammenti)
+    # In produzione i template cambiano solo con un deploy (e un riavvio): niente os.stat a ogni pagina
+    env.auto_reload = ENVIRONMENT != "production"
+    return templates
+
+
+def precompila(templates) -> int:
+    """Carica tutti i template .html (dal bytecode se presente): la prima visita non paga la compilazione"""
+    env = templates.env
+    inizio = time.perf_counter()
+    nomi = env.list_templates(extensions=("html",))
+    for nome in nomi:
+        env.get_template(nome)
+    log.info("Template precompilati: %d in %.0f ms", len(nomi), (time.perf_counter() - inizio) * 1000)
+    return len(nomi)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from fastapi.templating import Jinja2Templates
+
+    parser = argparse.ArgumentParser(description="Compila i template nella cache del bytecode")
+    parser.add_argument("--svuota", action="store_true", help="Elimina prima il bytecode esistente")
+    args = parser.parse_args()
+
+    modelli = configura(Jinja2Templates(directory="templates"))
+    if args.svuota:
+        modelli.env.bytecode_cache.clear()
+    print(f"✅ {precompila(modelli)} template compilati in {TEMPLATE_CACHE_DIR}/")
@@ -0,0 +1,162 @@
+"""
+Export del quaderno di campagna in formati leggibili da programmi (CSV, JSON lines)
+
+Le righe sono lette dal database a blocchi con un cursore lato server
+(yield_per) e scritte una alla volta, quindi la memoria resta costante
+anche per registri di molti anni e la risposta può partire subito.
+
+Uso:
+    python esporta_quaderno.py --azienda 1 --formato csv > quaderno.csv
+    python esporta_quaderno.py --azienda 1 --formato ndjson --anno 2024 > quaderno_2024.jsonl
+"""
+import csv
+import io
+import json
+from datetime import date
+from typing import Iterator, Optional
+
+from sqlalchemy import select, union_all
+
+from archivio import in_archivio
+from models import SessionLocal, Campo, Prodotto, Mezzo, Trattamento, TrattamentoArchiviato
+
+DIMENSIONE_BLOCCO = 1000
+RIGHE_PER_INVIO = 200  # righe CSV accumulate prima di inviare un pezzo di risposta
+
+COLONNE = [
+    "id", "data", "campo_id", "campo", "superficie_ettari", "coltura",
+    "prodotto_id", "prodotto", "tipo_prodotto", "unita_misura", "numero_lotto",
+    "avversita", "quantita_per_ettaro", "quantita_totale", "operatore", "mezzo",
+    "condizioni_meteo", "temperatura", "umidita", "velocita_vento", "note",
+]
+
+
+def _query(azienda_id: int, anno: Optional[int] = None, campo_id: Optional[int] = None, modello=Trattamento):
+    """Select delle colonne del quaderno da trattamenti o dall'archivio (stesse colonne)"""
+    query = (
+        select(
+            modello.id,
+            modello.data,
+            Campo.id.label("campo_id"),
+            Campo.nome.label("campo"),
+            Campo.superficie_ettari,
+            Campo.coltura_attuale.label("coltura"),
+            Prodotto.id.label("prodotto_id"),
+            Prodotto.nome_commerciale.label("prodotto"),
+            Prodotto.tipo.label("tipo_prodotto"),
+            Prodotto.unita_misura,
+            modello.numero_lotto,
+            modello.avversita,
+            modello.quantita_per_ettaro,
+            modello.quantita_totale,
+            modello.operatore,
+            Mezzo.nome.label("mezzo"),
+            modello.condizioni_meteo,
+            modello.temperatura,
+            modello.umidita,
+            modello.velocita_vento,
+            modello.note,
+        )
+        .join(Campo, modello.campo_id == Campo.id)
+        .join(Prodotto, modello.prodotto_id == Prodotto.id)
+        .outerjoin(Mezzo, modello.mezzo_id == Mezzo.id)
+        .where(Campo.azienda_id == azienda_id)
+    )
+    if anno is not None:
+        query = query.where(modello.data >= date(anno, 1, 1), modello.data < date(anno + 1, 1, 1))
+    if campo_id is not None:
+        query = query.where(modello.campo_id == campo_id)
+    return query
+
+
+def _query_quaderno(db, azienda_id: int, anno: Optional[int] = None, campo_id: Optional[int] = None):
+    """Query in ordine cronologico, come il PDF; per un anno archiviato (o senza anno) unisce anche l'archivio"""
+    query = _query(azienda_id, anno, campo_id)
+    if in_archivio(db, anno):
+        unione = union_all(_query(azienda_id, anno, campo_id, TrattamentoArchiviato), query).subquery()
+        return select(unione).order_by(unione.c.data, unione.c.id)
+    return query.order_by(Trattamento.data, Trattamento.id)
+
+
+def righe_quaderno(azienda_id: int, anno: Optional[int] = None, campo_id: Optional[int] = None) -> Iterator[dict]:
+    """
+    Trattamenti dell'azienda in ordine cronologico, come dict
+
+    Apre una propria sessione, così il generatore può essere consumato
+    dopo la fine della richiesta (StreamingResponse).
+    """
+    db = SessionLocal()
+    try:
+        risultato = db.execute(
+            _query_quaderno(db, azienda_id, anno, campo_id).execution_options(yield_per=DIMENSIONE_BLOCCO)
+        )
+        for riga in risultato:
+            valori = riga._asdict()
+            valori["data"] = valori["data"].isoformat()
+            valori["tipo_prodotto"] = valori["tipo_prodotto"].value
+            yield valori
+    finally:
+        db.close()
+
+
+def genera_csv(righe: Iterator[dict], separatore: str = ";") -> Iterator[str]:
+    """
+    CSV con intestazione, inviato a pezzi di RIGHE_PER_INVIO righe
+
+    Il BOM iniziale fa riconoscere a Excel la codifica UTF-8; il separatore
+    di default è il punto e virgola, come si aspetta Excel in italiano.
+    """
+    buffer = io.StringIO()
+    scrittore = csv.DictWriter(buffer, fieldnames=COLONNE, delimiter=separatore, lineterminator="\r\n")
+    buffer.write("\ufeff")
+    scrittore.writeheader()
+
+    # L'intestazione parte subito, prima ancora della prima riga dal database
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    for numero, riga in enumerate(righe, start=1):
+        scrittore.writerow(riga)
+        if numero % RIGHE_PER_INVIO == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def genera_ndjson(righe: Iterator[dict]) -> Iterator[str]:
+    """Un oggetto JSON per riga (JSON lines / NDJSON)"""
+    pezzo = []
+    for riga in righe:
+        pezzo.append(json.dumps(riga, ensure_ascii=False))
+        if len(pezzo) >= RIGHE_PER_INVIO:
+            yield "\n".join(pezzo) + "\n"
+            pezzo = []
+    if pezzo:
+        yield "\n".join(pezzo) + "\n"
+
+
+FORMATI = {
+    # formato: (generatore, media type, estensione)
+    "csv": (genera_csv, "text/csv", "csv"),
+    "ndjson": (genera_ndjson, "application/x-ndjson", "jsonl"),
+}
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Export del quaderno di campagna su standard output")
+    parser.add_argument("--azienda", type=int, required=True, help="ID dell'azienda")
+    parser.add_argument("--formato", choices=sorted(FORMATI), default="csv")
+    parser.add_argument("--anno", type=int, help="Solo i trattamenti di un anno")
+    parser.add_argument("--campo", type=int, help="Solo i trattamenti di un campo")
+    args = parser.parse_args()
+
+    generatore = FORMATI[args.formato][0]
+    for pezzo in generatore(righe_quaderno(args.azienda, args.anno, args.campo)):
+        sys.stdout.write(pezzo)
@@ -0,0 +1,288 @@
+"""
+Funzioni geometriche per i poligoni dei campi
+Coordinate sempre nel formato [lat, lng], come salvate in Campo.coordinate_poligono
+"""
+import heapq
+import math
+from typing import List, Tuple
+
+# Metri per grado di latitudine (costante)
+METRI_PER_GRADO_LAT = 111320.0
+
+
+def normalizza_anello(coordinate: list) -> List[List[float]]:
+    """
+    Valida e ripara un anello di coordinate [lat, lng]
+
+    - converte i valori in float
+    - scarta i punti consecutivi duplicati
+    - rimuove il punto di chiusura (Leaflet salva anelli aperti)
+
+    Solleva ValueError se l'anello non è utilizzabile.
+    """
+    anello = []
+    for p in coordinate:
+        if not isinstance(p, (list, tuple)) or len(p) < 2:
+            raise ValueError(f"Formato coordinata non valido: {p}")
+        lat, lng = float(p[0]), float(p[1])
+        if not (math.isfinite(lat) and math.isfinite(lng)):
+            raise ValueError(f"Coordinata non finita: {p}")
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0):
+            raise ValueError(f"Coordinata fuori range: {p}")
+        if anello and anello[-1][0] == lat and anello[-1][1] == lng:
+            continue
+        anello.append([lat, lng])
+
+    while len(anello) > 1 and anello[0] == anello[-1]:
+        anello.pop()
+
+    if len(anello) < 3:
+        raise ValueError(f"Servono almeno 3 punti distinti, trovati {len(anello)}")
+    return anello
+
+
+def area_ettari(anello: List[List[float]]) -> float:
+    """
+    Area in ettari di un anello già normalizzato
+
+    Stessa formula di calcola_area_poligono (Shoelace con conversione
+    alla latitudine media), senza log: adatta ai calcoli in batch.
+    """
+    n = len(anello)
+    lat_media = sum(p[0] for p in anello) / n
+    metri_per_grado_lng = METRI_PER_GRADO_LAT * math.cos(math.radians(lat_media))
+
+    area_gradi2 = 0.0
+    for i in range(n):
+        j = (i + 1) % n
+        area_gradi2 += anello[i][1] * anello[j][0] - anello[j][1] * anello[i][0]
+    area_gradi2 = abs(area_gradi2) / 2.0
+
+    if area_gradi2 < 1e-12:
+        return 0.0
+
+    area_metri2 = area_gradi2 * METRI_PER_GRADO_LAT * metri_per_grado_lng
+    return round(area_metri2 / 10000.0, 2)
+
+
+def punto_interno(anello: List[List[float]], lat: float, lng: float) -> bool:
+    """Verifica se (lat, lng) cade dentro l'anello (ray casting)"""
+    dentro = False
+    n = len(anello)
+    for i in range(n):
+        a, b = anello[i], anello[i - 1]
+        if (a[0] > lat) != (b[0] > lat):
+            lng_intersezione = (b[1] - a[1]) * (lat - a[0]) / (b[0] - a[0]) + a[1]
+            if lng < lng_intersezione:
+                dentro = not dentro
+    return dentro
+
+
+def centroide(anello: List[List[float]]) -> Tuple[float, float]:
+    """
+    Centroide pesato sull'area (lat, lng)
+
+    A differenza della media dei vertici non dipende da quanto fitti sono
+    i punti digitalizzati lungo i bordi. Le coordinate sono riferite al
+    primo vertice per limitare gli errori di arrotondamento.
+    """
+    lat0, lng0 = anello[0]
+    area2 = 0.0
+    cx = 0.0
+    cy = 0.0
+    n = len(anello)
+    for i in range(n):
+        j = (i + 1) % n
+        xi, yi = anello[i][1] - lng0, anello[i][0] - lat0
+        xj, yj = anello[j][1] - lng0, anello[j][0] - lat0
+        a = xi * yj - xj * yi
+        area2 += a
+        cx += (xi + xj) * a
+        cy += (yi + yj) * a
+
+    if abs(area2) < 1e-18:
+        # Poligono degenere: ripiega sulla media dei vertici
+        return (
+            sum(p[0] for p in anello) / n,
+            sum(p[1] for p in anello) / n,
+        )
+
+    return lat0 + cy / (3.0 * area2), lng0 + cx / (3.0 * area2)
+
+
+def _distanza_segmento2(px, py, ax, ay, bx, by) -> float:
+    """Quadrato della distanza punto-segmento"""
+    dx, dy = bx - ax, by - ay
+    if dx or dy:
+        t = ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)
+        if t > 1:
+            ax, ay = bx, by
+        elif t > 0:
+            ax += dx * t
+            ay += dy * t
+    dx, dy = px - ax, py - ay
+    return dx * dx + dy * dy
+
+
+def _distanza_bordo(x: float, y: float, punti: List[Tuple[float, float]]) -> float:
+    """Distanza dal bordo, positiva se il punto è interno"""
+    dentro = False
+    minimo = math.inf
+    n = len(punti)
+    for i in range(n):
+        ax, ay = punti[i]
+        bx, by = punti[i - 1]
+        if (ay > y) != (by > y) and x < (bx - ax) * (y - ay) / (by - ay) + ax:
+            dentro = not dentro
+        minimo = min(minimo, _distanza_segmento2(x, y, ax, ay, bx, by))
+    return math.sqrt(minimo) if dentro else -math.sqrt(minimo)
+
+
+def polo_inaccessibilita(anello: List[List[float]], precisione_m: float = 1.0) -> Tuple[float, float]:
+    """
+    Punto interno più lontano dal bordo (lat, lng), algoritmo polylabel
+
+    Usato per i poligoni concavi in cui il centroide cade fuori dal campo.
+    Il calcolo avviene in metri sulla proiezione locale del poligono.
+    """
+    lat_media = sum(p[0] for p in anello) / len(anello)
+    kx = METRI_PER_GRADO_LAT * math.cos(math.radians(lat_media))
+    ky = METRI_PER_GRADO_LAT
+    punti = [(p[1] * kx, p[0] * ky) for p in anello]
+
+    min_x = min(p[0] for p in punti)
+    max_x = max(p[0] for p in punti)
+    min_y = min(p[1] for p in punti)
+    max_y = max(p[1] for p in punti)
+    lato = min(max_x - min_x, max_y - min_y)
+    if lato <= 0:
+        return anello[0][0], anello[0][1]
+
+    def cella(x, y, h):
+        d = _distanza_bordo(x, y, punti)
+        # (priorità, distanza, x, y, metà lato): la priorità è la distanza massima possibile nella cella
+        return (-(d + h * math.sqrt(2)), d, x, y, h)
+
+    coda = []
+    h = lato / 2
+    x = min_x
+    while x < max_x:
+        y = min_y
+        while y < max_y:
+            heapq.heappush(coda, cella(x + h, y + h, h))
+            y += lato
+        x += lato
+
+    lat_c, lng_c = centroide(anello)
+    migliore = cella(lng_c * kx, lat_c * ky, 0)
+    centro_bbox = cella((min_x + max_x) / 2, (min_y + max_y) / 2, 0)
+    if centro_bbox[1] > migliore[1]:
+        migliore = centro_bbox
+
+    while coda:
+        c = heapq.heappop(coda)
+        if c[1] > migliore[1]:
+            migliore = c
+        if -c[0] - migliore[1] <= precisione_m:
+            continue
+        h = c[4] / 2
+        heapq.heappush(coda, cella(c[2] - h, c[3] - h, h))
+        heapq.heappush(coda, cella(c[2] + h, c[3] - h, h))
+        heapq.heappush(coda, cella(c[2] - h, c[3] + h, h))
+        heapq.heappush(coda, cella(c[2] + h, c[3] + h, h))
+
+    return migliore[3] / ky, migliore[2] / kx
+
+
+def centro_poligono(anello: List[List[float]]) -> Tuple[float, float]:
+    """
+    Centro rappresentativo del campo (lat, lng)
+
+    Restituisce il centroide pesato sull'area; se cade fuori dal poligono
+    (campi concavi a L o a U) usa il polo di inaccessibilità, così il punto
+    usato per il meteo è sempre dentro il campo.
+    """
+    lat, lng = centroide(anello)
+    if punto_interno(anello, lat, lng):
+        return lat, lng
+    return polo_inaccessibilita(anello)
+
+
+def _orientamento(a, b, c) -> int:
+    valore = (b[1] - a[1]) * (c[0] - b[0]) - (b[0] - a[0]) * (c[1] - b[1])
+    if valore > 0:
+        return 1
+    if valore < 0:
+        return -1
+    return 0
+
+
+def _su_segmento(a, b, c) -> bool:
+    """c collineare giace sul segmento a-b"""
+    return (min(a[0], b[0]) <= c[0] <= max(a[0], b[0])
+            and min(a[1], b[1]) <= c[1] <= max(a[1], b[1]))
+
+
+def _segmenti_intersecano(p1, p2, p3, p4) -> bool:
+    o1 = _orientamento(p1, p2, p3)
+    o2 = _orientamento(p1, p2, p4)
+    o3 = _orientamento(p3, p4, p1)
+    o4 = _orientamento(p3, p4, p2)
+    if o1 != o2 and o3 != o4:
+        return True
+    return ((o1 == 0 and _su_segmento(p1, p2, p3))
+            or (o2 == 0 and _su_segmento(p1, p2, p4))
+            or (o3 == 0 and _su_segmento(p3, p4, p1))
+            or (o4 == 0 and _su_segmento(p3, p4, p2)))
+
+
+def autointersezioni(anello: List[List[float]]) -> List[Tuple[int, int]]:
+    """
+    Coppie di lati (indici) che si intersecano
+
+    I lati sono ordinati per longitudine minima e confrontati solo quando
+    i loro intervalli si sovrappongono: per i poligoni reali il costo è
+    vicino a O(n log n), adatto anche agli import massivi.
+    """
+    n = len(anello)
+    lati = []
+    for i in range(n):
+        a, b = anello[i], anello[(i + 1) % n]
+        lati.append((min(a[1], b[1]), max(a[1], b[1]), i))
+    lati.sort()
+
+    coppie = []
+    for k in range(n):
+        _, max_i, i = lati[k]
+        for h in range(k + 1, n):
+            min_j, _, j = lati[h]
+            if min_j > max_i:
+                break
+            # I lati consecutivi condividono un vertice per costruzione
+            if abs(i - j) == 1 or abs(i - j) == n - 1:
+                continue
+            if _segmenti_intersecano(anello[i], anello[(i + 1) % n], anello[j], anello[(j + 1) % n]):
+                coppie.append((min(i, j), max(i, j)))
+    return coppie
+
+
+def verifica_anello(coordinate: list) -> Tuple[List[List[float]], List[str]]:
+    """
+    Normalizza un anello e ne verifica la validità
+
+    Restituisce l'anello riparato e le correzioni applicate (punti
+    duplicati, punto di chiusura). Solleva ValueError se l'anello non è
+    utilizzabile o se i lati si intersecano.
+    """
+    anello = normalizza_anello(coordinate)
+
+    incroci = autointersezioni(anello)
+    if incroci:
+        i, j = incroci[0]
+        raise ValueError(f"Poligono non valido: il lato {i + 1} interseca il lato {j + 1}")
+
+    correzioni = []
+    rimossi = len(coordinate) - len(anello)
+    if rimossi:
+        correzioni.append(f"Rimossi {rimossi} punti duplicati")
+    return anello, correzioni
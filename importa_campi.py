@@ -0,0 +1,447 @@
+"""
+Import massivo dei confini dei campi da GeoJSON / KML / CSV con WKT
+
+Legge i file in streaming (un elemento alla volta), ripara gli anelli,
+calcola superficie e centro in batch e inserisce con INSERT multipli
+in transazioni a blocchi.
+
+Uso:
+    python importa_campi.py particelle.geojson --azienda 1
+    python importa_campi.py catasto.kml --azienda 1 --blocco 1000
+    python importa_campi.py export_qgis.csv --azienda 1
+"""
+import csv
+import json
+import os
+import re
+import sys
+import xml.etree.ElementTree as ET
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from geometria import verifica_anello, area_ettari, centro_poligono
+from models import Campo
+
+DIMENSIONE_BLOCCO = 500
+DIMENSIONE_LETTURA = 1 << 20  # 1 MB per lettura dal file
+MAX_ERRORI_REPORT = 1000
+
+FORMATI = {
+    ".geojson": "geojson",
+    ".json": "geojson",
+    ".kml": "kml",
+    ".csv": "csv",
+}
+
+CHIAVI_NOME = ("nome", "name", "NOME", "Name", "NAME")
+CHIAVI_COLTURA = ("coltura", "coltura_attuale", "COLTURA", "crop")
+CHIAVI_WKT = ("WKT", "wkt", "geometry", "geom", "the_geom")
+
+# Elemento letto da un file: (indice, proprietà, geometria in formato GeoJSON)
+Elemento = Tuple[int, dict, Optional[dict]]
+
+
+def rileva_formato(percorso: str) -> str:
+    """Determina il formato dall'estensione del file"""
+    estensione = os.path.splitext(percorso)[1].lower()
+    if estensione not in FORMATI:
+        raise ValueError(f"Formato non supportato: {estensione or percorso}")
+    return FORMATI[estensione]
+
+
+# ========== LETTORI STREAMING ==========
+
+class _BufferJSON:
+    """Testo JSON letto a blocchi: salta separatori e decodifica un valore alla volta"""
+
+    def __init__(self, file):
+        self.file = file
+        self.decoder = json.JSONDecoder()
+        self.buffer = file.read(DIMENSIONE_LETTURA)
+        self.pos = 0
+
+    def _leggi(self) -> bool:
+        """Aggiunge un blocco al buffer scartando il testo già consumato, False a fine file"""
+        blocco = self.file.read(DIMENSIONE_LETTURA)
+        if not blocco:
+            return False
+        self.buffer, self.pos = self.buffer[self.pos:] + blocco, 0
+        return True
+
+    def prossimo(self, separatori: str = " \t\r\n") -> str:
+        """Primo carattere dopo i separatori (senza consumarlo), "" a fine file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in separatori:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._leggi():
+                return ""
+
+    def consuma(self, atteso: str):
+        if self.prossimo() != atteso:
+            raise ValueError("GeoJSON non valido")
+        self.pos += 1
+
+    def valore(self):
+        """Decodifica il prossimo valore completo, leggendo altro testo se serve"""
+        self.prossimo()
+        while True:
+            try:
+                valore, fine = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Valore incompleto nel buffer: leggi altro testo
+                if not self._leggi():
+                    raise
+                continue
+            # Un numero a fine buffer potrebbe continuare nel blocco successivo
+            if fine == len(self.buffer) and self._leggi():
+                continue
+            self.pos = fine
+            if self.pos > DIMENSIONE_LETTURA:
+                self.buffer, self.pos = self.buffer[self.pos:], 0
+            return valore
+
+
+def leggi_geojson(percorso: str) -> Iterator[Elemento]:
+    """
+    Legge le feature di un FeatureCollection una alla volta
+
+    Il file viene letto a blocchi e ogni feature è decodificata appena
+    completa, quindi la memoria non dipende dalla dimensione del file.
+    Le chiavi dell'oggetto principale sono lette una per una, così solo
+    la chiave "features" di primo livello apre l'array (non una chiave
+    omonima dentro le proprietà). Supporta anche file con una singola
+    Feature o geometria.
+    """
+    with open(percorso, "r", encoding="utf-8-sig") as f:
+        testo = _BufferJSON(f)
+        testo.consuma("{")
+
+        # Chiavi di primo livello fino all'array "features"
+        oggetto = {}
+        while True:
+            carattere = testo.prossimo(" \t\r\n,")
+            if carattere == "}":
+                # Non è un FeatureCollection: un solo oggetto
+                if oggetto.get("type") == "Feature":
+                    yield 1, oggetto.get("properties") or {}, oggetto.get("geometry")
+                else:
+                    yield 1, {}, oggetto
+                return
+            chiave = testo.valore()
+            if not isinstance(chiave, str):
+                raise ValueError("GeoJSON non valido")
+            testo.consuma(":")
+            if chiave == "features" and testo.prossimo() == "[":
+                testo.consuma("[")
+                break
+            oggetto[chiave] = testo.valore()
+
+        indice = 0
+        while True:
+            # Salta spazi e virgole tra le feature
+            carattere = testo.prossimo(" \t\r\n,")
+            if not carattere:
+                raise ValueError("GeoJSON troncato: array features non chiuso")
+            if carattere == "]":
+                return
+
+            feature = testo.valore()
+            indice += 1
+            if isinstance(feature, dict):
+                yield indice, feature.get("properties") or {}, feature.get("geometry")
+            else:
+                yield indice, {}, None
+
+
+def _tag(elemento) -> str:
+    """Nome del tag senza namespace"""
+    return elemento.tag.rsplit("}", 1)[-1]
+
+
+def _coordinate_kml(testo: str) -> List[List[float]]:
+    """Converte 'lng,lat[,alt] lng,lat[,alt] ...' in [[lng, lat], ...]"""
+    punti = []
+    for tupla in testo.split():
+        valori = tupla.split(",")
+        if len(valori) >= 2:
+            punti.append([float(valori[0]), float(valori[1])])
+    return punti
+
+
+def leggi_kml(percorso: str) -> Iterator[Elemento]:
+    """Legge i Placemark di un KML con iterparse, liberando ogni elemento letto"""
+    indice = 0
+    for _, elemento in ET.iterparse(percorso, events=("end",)):
+        if _tag(elemento) != "Placemark":
+            continue
+
+        indice += 1
+        proprieta = {}
+        poligoni = []
+        for figlio in elemento.iter():
+            tag = _tag(figlio)
+            if tag == "name" and "nome" not in proprieta:
+                proprieta["nome"] = (figlio.text or "").strip()
+            elif tag == "Data" and figlio.get("name"):
+                valore = next((v.text for v in figlio if _tag(v) == "value"), None)
+                proprieta[figlio.get("name")] = valore
+            elif tag == "SimpleData" and figlio.get("name"):
+                proprieta[figlio.get("name")] = figlio.text
+            elif tag == "outerBoundaryIs":
+                for sub in figlio.iter():
+                    if _tag(sub) == "coordinates" and sub.text:
+                        poligoni.append([_coordinate_kml(sub.text)])
+
+        elemento.clear()
+
+        if not poligoni:
+            yield indice, proprieta, None
+        elif len(poligoni) == 1:
+            yield indice, proprieta, {"type": "Polygon", "coordinates": poligoni[0]}
+        else:
+            yield indice, proprieta, {"type": "MultiPolygon", "coordinates": poligoni}
+
+
+def parse_wkt(wkt: str) -> dict:
+    """Converte un POLYGON / MULTIPOLYGON WKT in geometria GeoJSON"""
+    match = re.match(r"^\s*(MULTIPOLYGON|POLYGON)\s*(?:ZM|Z|M)?\s*(\(.*\))\s*$", wkt, re.I | re.S)
+    if not match:
+        raise ValueError("WKT non supportato: atteso POLYGON o MULTIPOLYGON")
+
+    pila = [[]]
+    token = ""
+    for carattere in match.group(2):
+        if carattere == "(":
+            pila.append([])
+        elif carattere in "),":
+            if token.strip():
+                valori = token.split()
+                pila[-1].append([float(valori[0]), float(valori[1])])
+            token = ""
+            if carattere == ")":
+                if len(pila) < 2:
+                    raise ValueError("WKT non valido: parentesi non bilanciate")
+                interno = pila.pop()
+                pila[-1].append(interno)
+        else:
+            token += carattere
+
+    if len(pila) != 1 or not pila[0]:
+        raise ValueError("WKT non valido: parentesi non bilanciate")
+
+    tipo = "MultiPolygon" if match.group(1).upper() == "MULTIPOLYGON" else "Polygon"
+    return {"type": tipo, "coordinates": pila[0][0]}
+
+
+def leggi_csv(percorso: str) -> Iterator[Elemento]:
+    """Legge un CSV (export QGIS/shapefile) con geometria in colonna WKT o GeoJSON"""
+    csv.field_size_limit(sys.maxsize)
+    with open(percorso, "r", encoding="utf-8-sig", newline="") as f:
+        campione = f.read(4096)
+        f.seek(0)
+        try:
+            dialetto = csv.Sniffer().sniff(campione, delimiters=",;\t")
+        except csv.Error:
+            dialetto = csv.excel
+
+        lettore = csv.DictReader(f, dialect=dialetto)
+        colonna = next((c for c in CHIAVI_WKT if c in (lettore.fieldnames or [])), None)
+        if colonna is None:
+            raise ValueError(f"Colonna geometria non trovata (attese: {', '.join(CHIAVI_WKT)})")
+
+        for indice, riga in enumerate(lettore, start=1):
+            valore = (riga.pop(colonna, None) or "").strip()
+            try:
+                if valore.startswith("{"):
+                    geometria = json.loads(valore)
+                else:
+                    geometria = parse_wkt(valore)
+            except (ValueError, IndexError):
+                geometria = None
+            yield indice, riga, geometria
+
+
+LETTORI = {
+    "geojson": leggi_geojson,
+    "kml": leggi_kml,
+    "csv": leggi_csv,
+}
+
+
+# ========== CONVERSIONE ==========
+
+def anelli_da_geometria(geometria: Optional[dict]) -> List[list]:
+    """
+    Anelli esterni [lat, lng] di un Polygon / MultiPolygon GeoJSON
+
+    I fori interni vengono ignorati: Campo salva un solo anello.
+    """
+    if not geometria or "coordinates" not in geometria:
+        raise ValueError("Geometria mancante")
+
+    tipo = geometria.get("type")
+    if tipo == "Polygon":
+        poligoni = [geometria["coordinates"]]
+    elif tipo == "MultiPolygon":
+        poligoni = geometria["coordinates"]
+    else:
+        raise ValueError(f"Geometria non supportata: {tipo}")
+
+    # GeoJSON/KML/WKT usano [lng, lat], Campo usa [lat, lng]
+    return [[[p[1], p[0]] for p in poligono[0]] for poligono in poligoni if poligono]
+
+
+def _prima_proprieta(proprieta: dict, chiavi) -> Optional[str]:
+    for chiave in chiavi:
+        valore = proprieta.get(chiave)
+        if valore not in (None, ""):
+            return str(valore).strip()
+    return None
+
+
+def nome_da_proprieta(proprieta: dict, indice: int) -> str:
+    """Nome del campo dalle proprietà, con fallback su foglio/particella catastale"""
+    nome = _prima_proprieta(proprieta, CHIAVI_NOME)
+    if nome:
+        return nome
+    foglio = _prima_proprieta(proprieta, ("foglio", "FOGLIO"))
+    particella = _prima_proprieta(proprieta, ("particella", "PARTICELLA", "mappale"))
+    if foglio or particella:
+        return f"Foglio {foglio or '-'} - Particella {particella or '-'}"
+    return f"Particella {indice}"
+
+
+def righe_da_elementi(elementi: List[Elemento], azienda_id: int, report: dict) -> List[dict]:
+    """Valida, ripara e calcola superficie e centro di un blocco di elementi"""
+    righe = []
+    for indice, proprieta, geometria in elementi:
+        nome = nome_da_proprieta(proprieta, indice)
+        try:
+            anelli = anelli_da_geometria(geometria)
+            if not anelli:
+                raise ValueError("Geometria vuota")
+        except (ValueError, TypeError, IndexError, KeyError) as e:
+            _registra_errore(report, indice, nome, str(e))
+            continue
+
+        coltura = _prima_proprieta(proprieta, CHIAVI_COLTURA)
+        for parte, anello in enumerate(anelli, start=1):
+            nome_parte = nome if len(anelli) == 1 else f"{nome} ({parte})"
+            try:
+                anello, _ = verifica_anello(anello)
+            except (ValueError, TypeError) as e:
+                _registra_errore(report, indice, nome_parte, str(e))
+                continue
+
+            superficie = area_ettari(anello)
+            if superficie <= 0:
+                _registra_errore(report, indice, nome_parte, "Superficie nulla")
+                continue
+
+            centro_lat, centro_lng = centro_poligono(anello)
+            righe.append({
+                "azienda_id": azienda_id,
+                "nome": nome_parte,
+                "superficie_ettari": superficie,
+                "coordinate_poligono": anello,
+                "centro_lat": centro_lat,
+                "centro_lng": centro_lng,
+                "coltura_attuale": coltura,
+            })
+    return righe
+
+
+def _registra_errore(report: dict, indice: int, nome: str, messaggio: str):
+    report["scartati"] += 1
+    if len(report["errori"]) < MAX_ERRORI_REPORT:
+        report["errori"].append({"elemento": indice, "nome": nome, "errore": messaggio})
+
+
+# ========== IMPORT ==========
+
+def importa_campi(
+    db: Session,
+    percorso: str,
+    azienda_id: int,
+    formato: Optional[str] = None,
+    dimensione_blocco: int = DIMENSIONE_BLOCCO,
+    progresso: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """
+    Importa i campi di un file nell'azienda indicata
+
+    Ogni blocco di `dimensione_blocco` elementi è inserito con un solo
+    INSERT multiplo e confermato in una transazione separata: un errore
+    annulla solo il blocco corrente. `progresso` riceve il report
+    parziale dopo ogni blocco.
+    """
+    formato = formato or rileva_formato(percorso)
+    if formato not in LETTORI:
+        raise ValueError(f"Formato non supportato: {formato}")
+
+    report = {"letti": 0, "importati": 0, "scartati": 0, "blocchi": 0, "errori": []}
+
+    def scrivi_blocco(elementi):
+        righe = righe_da_elementi(elementi, azienda_id, report)
+        if righe:
+            try:
+                db.execute(insert(Campo), righe)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            report["importati"] += len(righe)
+        report["blocchi"] += 1
+        if progresso:
+            progresso(report)
+
+    blocco = []
+    for elemento in LETTORI[formato](percorso):
+        report["letti"] += 1
+        blocco.append(elemento)
+        if len(blocco) >= dimensione_blocco:
+            scrivi_blocco(blocco)
+            blocco = []
+    if blocco:
+        scrivi_blocco(blocco)
+
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from models import SessionLocal, Azienda
+
+    parser = argparse.ArgumentParser(description="Import massivo dei confini dei campi")
+    parser.add_argument("percorso", help="File GeoJSON, KML o CSV con colonna WKT")
+    parser.add_argument("--azienda", type=int, required=True, help="ID dell'azienda di destinazione")
+    parser.add_argument("--formato", choices=sorted(LETTORI), help="Forza il formato (default: da estensione)")
+    parser.add_argument("--blocco", type=int, default=DIMENSIONE_BLOCCO, help="Elementi per transazione")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if not db.query(Azienda).filter(Azienda.id == args.azienda).first():
+            print(f"❌ Azienda {args.azienda} non trovata")
+            sys.exit(1)
+
+        print(f"📥 Import campi da {args.percorso}...\n")
+        risultato = importa_campi(
+            db, args.percorso, args.azienda,
+            formato=args.formato,
+            dimensione_blocco=args.blocco,
+            progresso=lambda r: print(f"  ⏳ {r['letti']} elementi letti, {r['importati']} campi importati, {r['scartati']} scartati"),
+        )
+
+        for errore in risultato["errori"][:20]:
+            print(f"  ⚠️  #{errore['elemento']} {errore['nome']}: {errore['errore']}")
+        if len(risultato["errori"]) > 20:
+            print(f"  ... e altri {risultato['scartati'] - 20} errori")
+
+        print(f"\n🎉 Import completato: {risultato['importati']} campi importati, {risultato['scartati']} scartati")
+    finally:
+        db.close()
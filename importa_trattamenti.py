@@ -0,0 +1,398 @@
+"""
+Import massivo dei trattamenti da CSV / Excel (registri dei contoterzisti)
+
+Legge il file in streaming, risolve i nomi di campi, prodotti e mezzi
+sull'elenco dell'azienda (letto una volta), calcola le quantità totali e
+inserisce ogni blocco con INSERT multipli in una sola transazione
+(trattamenti, scarichi di magazzino e contatori dei limiti d'impiego).
+
+Colonne riconosciute (intestazione, maiuscole e spazi indifferenti):
+    data, campo, prodotto, dose (per ettaro) - obbligatorie
+    avversita, operatore, mezzo, lotto, condizioni_meteo, temperatura,
+    umidita, vento, note - facoltative
+
+Uso:
+    python importa_trattamenti.py registro_2024.csv --azienda 1
+    python importa_trattamenti.py registro_2024.xlsx --azienda 1 --blocco 2000
+"""
+import csv
+import math
+import os
+import sys
+from datetime import date, datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, insert
+from sqlalchemy.orm import Session
+
+from limiti_dose import aggiorna_contatori_blocco
+from models import Campo, Prodotto, Mezzo, Trattamento, TipoMovimento
+from registro_magazzino import registra_movimenti
+
+DIMENSIONE_BLOCCO = 1000
+MAX_ERRORI_REPORT = 1000
+
+FORMATI = {
+    ".csv": "csv",
+    ".txt": "csv",
+    ".xlsx": "xlsx",
+}
+
+# Nome normalizzato dell'intestazione -> colonna di Trattamento (o chiave da risolvere)
+COLONNE = {
+    "data": "data",
+    "data_trattamento": "data",
+    "campo": "campo",
+    "appezzamento": "campo",
+    "prodotto": "prodotto",
+    "formulato": "prodotto",
+    "dose": "quantita_per_ettaro",
+    "dose_ettaro": "quantita_per_ettaro",
+    "dose_ha": "quantita_per_ettaro",
+    "quantita_per_ettaro": "quantita_per_ettaro",
+    "avversita": "avversita",
+    "avversità": "avversita",
+    "obiettivo": "avversita",
+    "operatore": "operatore",
+    "mezzo": "mezzo",
+    "attrezzatura": "mezzo",
+    "lotto": "numero_lotto",
+    "numero_lotto": "numero_lotto",
+    "condizioni_meteo": "condizioni_meteo",
+    "meteo": "condizioni_meteo",
+    "temperatura": "temperatura",
+    "umidita": "umidita",
+    "umidità": "umidita",
+    "vento": "velocita_vento",
+    "velocita_vento": "velocita_vento",
+    "note": "note",
+}
+OBBLIGATORIE = ("data", "campo", "prodotto", "quantita_per_ettaro")
+TESTO = ("avversita", "operatore", "numero_lotto", "condizioni_meteo", "note")
+NUMERI = ("temperatura", "umidita", "velocita_vento")
+FORMATI_DATA = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y")
+
+# Riga letta da un file: (numero di riga, valori per colonna normalizzata)
+Riga = Tuple[int, dict]
+
+
+def rileva_formato(percorso: str) -> str:
+    """Determina il formato dall'estensione del file"""
+    estensione = os.path.splitext(percorso)[1].lower()
+    if estensione not in FORMATI:
+        raise ValueError(f"Formato non supportato: {estensione or percorso}")
+    return FORMATI[estensione]
+
+
+def _mappa_intestazione(intestazione: List) -> List[Optional[str]]:
+    """Colonna di destinazione per ogni colonna del file (None se ignorata)"""
+    mappa = [
+        COLONNE.get(str(nome or "").strip().lower().replace(" ", "_").replace(".", ""))
+        for nome in intestazione
+    ]
+    mancanti = [c for c in OBBLIGATORIE if c not in mappa]
+    if mancanti:
+        raise ValueError(f"Colonne obbligatorie mancanti: {', '.join(mancanti)}")
+    return mappa
+
+
+def _riga(mappa: List[Optional[str]], valori) -> dict:
+    return {colonna: valore for colonna, valore in zip(mappa, valori) if colonna}
+
+
+# ========== LETTORI STREAMING ==========
+
+def leggi_csv(percorso: str) -> Iterator[Riga]:
+    """Legge un CSV separato da virgola, punto e virgola o tabulazione"""
+    with open(percorso, "r", encoding="utf-8-sig", newline="") as f:
+        campione = f.read(4096)
+        f.seek(0)
+        try:
+            dialetto = csv.Sniffer().sniff(campione, delimiters=",;\t")
+        except csv.Error:
+            dialetto = csv.excel
+
+        lettore = csv.reader(f, dialect=dialetto)
+        mappa = _mappa_intestazione(next(lettore, []))
+        for valori in lettore:
+            if any(v.strip() for v in valori):
+                yield lettore.line_num, _riga(mappa, valori)
+
+
+def leggi_xlsx(percorso: str) -> Iterator[Riga]:
+    """Legge il primo foglio di un file Excel in modalità read-only (a righe)"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Per importare file Excel installare openpyxl (pip install openpyxl)")
+
+    cartella = load_workbook(percorso, read_only=True, data_only=True)
+    try:
+        righe = cartella.worksheets[0].iter_rows(values_only=True)
+        mappa = _mappa_intestazione(list(next(righe, ())))
+        for numero, valori in enumerate(righe, start=2):
+            if any(v not in (None, "") for v in valori):
+                yield numero, _riga(mappa, valori)
+    finally:
+        cartella.close()
+
+
+LETTORI = {
+    "csv": leggi_csv,
+    "xlsx": leggi_xlsx,
+}
+
+
+# ========== CONVERSIONE ==========
+
+def _testo(valore) -> Optional[str]:
+    if valore is None:
+        return None
+    valore = str(valore).strip()
+    return valore or None
+
+
+def _numero(valore) -> Optional[float]:
+    """Numero finito da cella Excel o testo, anche con virgola decimale (NaN e infinito rifiutati)"""
+    if valore is None:
+        return None
+    if isinstance(valore, (int, float)):
+        numero = float(valore)
+    else:
+        testo = str(valore).strip().replace(" ", "")
+        if not testo:
+            return None
+        if "," in testo:
+            testo = testo.replace(".", "").replace(",", ".")
+        numero = float(testo)
+    if not math.isfinite(numero):
+        raise ValueError(f"Numero non valido: '{valore}'")
+    return numero
+
+
+def _data(valore) -> date:
+    if isinstance(valore, datetime):
+        return valore.date()
+    if isinstance(valore, date):
+        return valore
+    testo = str(valore or "").strip()
+    for formato in FORMATI_DATA:
+        try:
+            return datetime.strptime(testo, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Data non valida: '{testo}'")
+
+
+def _chiave_nome(valore) -> str:
+    return " ".join(str(valore or "").split()).lower()
+
+
+class RisolutoreNomi:
+    """
+    Risolve i nomi di campi, prodotti e mezzi in id per l'azienda
+
+    Campi, prodotti e mezzi dell'azienda sono letti una volta, al primo
+    blocco, e indicizzati con la stessa chiave usata per le celle del file
+    (_chiave_nome: spazi compressi, minuscole anche per le lettere
+    accentate), che lower() di SQLite non riproduce.
+    """
+
+    def __init__(self, db: Session, azienda_id: int):
+        self.db = db
+        self.azienda_id = azienda_id
+        self.campi: Optional[Dict[str, tuple]] = None
+        self.prodotti: Dict[str, int] = {}
+        self.mezzi: Dict[str, int] = {}
+
+    def carica(self, righe: List[Riga]):
+        if self.campi is not None:
+            return
+        self.campi = {}
+        for campo_id, nome, superficie in self.db.execute(
+            select(Campo.id, Campo.nome, Campo.superficie_ettari)
+            .where(Campo.azienda_id == self.azienda_id).order_by(Campo.id)
+        ):
+            self.campi.setdefault(_chiave_nome(nome), (campo_id, superficie))
+
+        for prodotto_id, nome in self.db.execute(
+            select(Prodotto.id, Prodotto.nome_commerciale)
+            .where(Prodotto.azienda_id == self.azienda_id).order_by(Prodotto.id)
+        ):
+            self.prodotti.setdefault(_chiave_nome(nome), prodotto_id)
+
+        # Il mezzo può essere indicato per nome o per targa
+        for mezzo_id, nome, targa in self.db.execute(
+            select(Mezzo.id, Mezzo.nome, Mezzo.targa)
+            .where(Mezzo.azienda_id == self.azienda_id).order_by(Mezzo.id)
+        ):
+            for chiave in (_chiave_nome(nome), _chiave_nome(targa)):
+                if chiave:
+                    self.mezzi.setdefault(chiave, mezzo_id)
+
+
+def righe_da_blocco(righe: List[Riga], risolutore: RisolutoreNomi, report: dict) -> List[dict]:
+    """Valida un blocco di righe e lo converte in valori per Trattamento"""
+    risolutore.carica(righe)
+    trattamenti = []
+    for numero, riga in righe:
+        try:
+            mancanti = [c for c in OBBLIGATORIE if _testo(riga.get(c)) is None]
+            if mancanti:
+                raise ValueError(f"Valori mancanti: {', '.join(mancanti)}")
+
+            campo = risolutore.campi.get(_chiave_nome(riga["campo"]))
+            if campo is None:
+                raise ValueError(f"Campo '{riga['campo']}' non trovato")
+            prodotto_id = risolutore.prodotti.get(_chiave_nome(riga["prodotto"]))
+            if prodotto_id is None:
+                raise ValueError(f"Prodotto '{riga['prodotto']}' non trovato")
+
+            dose = _numero(riga["quantita_per_ettaro"])
+            if dose <= 0:
+                raise ValueError("La dose per ettaro deve essere maggiore di zero")
+
+            campo_id, superficie = campo
+            if not math.isfinite(dose * superficie):
+                raise ValueError("Dose per ettaro fuori scala")
+            valori = {
+                "campo_id": campo_id,
+                "prodotto_id": prodotto_id,
+                "data": _data(riga["data"]),
+                "quantita_per_ettaro": dose,
+                "quantita_totale": dose * superficie,
+                # Come nel form del quaderno, un mezzo non riconosciuto viene ignorato
+                "mezzo_id": risolutore.mezzi.get(_chiave_nome(riga.get("mezzo"))),
+            }
+            for colonna in TESTO:
+                valori[colonna] = _testo(riga.get(colonna))
+            for colonna in NUMERI:
+                valori[colonna] = _numero(riga.get(colonna))
+        except (ValueError, TypeError) as e:
+            _registra_errore(report, numero, str(e))
+            continue
+        trattamenti.append(valori)
+    return trattamenti
+
+
+def _registra_errore(report: dict, numero: int, messaggio: str):
+    report["scartati"] += 1
+    if len(report["errori"]) < MAX_ERRORI_REPORT:
+        report["errori"].append({"riga": numero, "errore": messaggio})
+
+
+# ========== IMPORT ==========
+
+def scrivi_blocco(db: Session, trattamenti: List[dict]):
+    """
+    Inserisce un blocco di trattamenti con scarichi e contatori (senza commit)
+
+    Gli id generati (RETURNING, nell'ordine delle righe) collegano ogni
+    scarico di magazzino al suo trattamento.
+    """
+    ids = db.execute(
+        insert(Trattamento).returning(Trattamento.id, sort_by_parameter_order=True),
+        trattamenti,
+    ).scalars().all()
+
+    registra_movimenti(db, [
+        {
+            "prodotto_id": t["prodotto_id"],
+            "data": t["data"],
+            "tipo": TipoMovimento.TRATTAMENTO,
+            "quantita": -t["quantita_totale"],
+            "trattamento_id": trattamento_id,
+            "riferimento": t["numero_lotto"],
+        }
+        for trattamento_id, t in zip(ids, trattamenti)
+    ])
+    aggiorna_contatori_blocco(db, trattamenti)
+
+
+def importa_trattamenti(
+    db: Session,
+    percorso: str,
+    azienda_id: int,
+    formato: Optional[str] = None,
+    dimensione_blocco: int = DIMENSIONE_BLOCCO,
+    progresso: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """
+    Importa i trattamenti di un file nell'azienda indicata
+
+    Le righe non valide sono scartate e riportate con il loro numero di
+    riga; le altre sono inserite a blocchi di `dimensione_blocco`, ognuno
+    in una transazione separata. I limiti d'impiego non vengono verificati
+    (il registro descrive trattamenti già eseguiti), ma i contatori sono
+    aggiornati. `progresso` riceve il report parziale dopo ogni blocco.
+    """
+    formato = formato or rileva_formato(percorso)
+    if formato not in LETTORI:
+        raise ValueError(f"Formato non supportato: {formato}")
+
+    report = {"letti": 0, "importati": 0, "scartati": 0, "blocchi": 0, "errori": []}
+    risolutore = RisolutoreNomi(db, azienda_id)
+
+    def elabora(righe):
+        trattamenti = righe_da_blocco(righe, risolutore, report)
+        if trattamenti:
+            try:
+                scrivi_blocco(db, trattamenti)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            report["importati"] += len(trattamenti)
+        report["blocchi"] += 1
+        if progresso:
+            progresso(report)
+
+    blocco = []
+    for riga in LETTORI[formato](percorso):
+        report["letti"] += 1
+        blocco.append(riga)
+        if len(blocco) >= dimensione_blocco:
+            elabora(blocco)
+            blocco = []
+    if blocco:
+        elabora(blocco)
+
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from models import SessionLocal, Azienda
+
+    parser = argparse.ArgumentParser(description="Import massivo dei trattamenti da CSV / Excel")
+    parser.add_argument("percorso", help="File CSV o XLSX")
+    parser.add_argument("--azienda", type=int, required=True, help="ID dell'azienda di destinazione")
+    parser.add_argument("--formato", choices=sorted(LETTORI), help="Forza il formato (default: da estensione)")
+    parser.add_argument("--blocco", type=int, default=DIMENSIONE_BLOCCO, help="Righe per transazione")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if not db.query(Azienda).filter(Azienda.id == args.azienda).first():
+            print(f"❌ Azienda {args.azienda} non trovata")
+            sys.exit(1)
+
+        print(f"📥 Import trattamenti da {args.percorso}...\n")
+        risultato = importa_trattamenti(
+            db, args.percorso, args.azienda,
+            formato=args.formato,
+            dimensione_blocco=args.blocco,
+            progresso=lambda r: print(f"  ⏳ {r['letti']} righe lette, {r['importati']} trattamenti importati, {r['scartati']} scartati"),
+        )
+
+        for errore in risultato["errori"][:20]:
+            print(f"  ⚠️  Riga {errore['riga']}: {errore['errore']}")
+        if len(risultato["errori"]) > 20:
+            print(f"  ... e altri {risultato['scartati'] - 20} errori")
+
+        print(f"\n🎉 Import completato: {risultato['importati']} trattamenti importati, {risultato['scartati']} scartati")
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        db.close()
@@ -0,0 +1,317 @@
+"""
+Controllo dei limiti d'impiego dei prodotti (dose, numero di applicazioni, intervallo)
+I totali per (campo, prodotto, anno) sono mantenuti in ContatoreTrattamenti a ogni
+inserimento ed eliminazione, così il controllo al salvataggio legge una sola riga.
+
+Uso:
+    python limiti_dose.py [--azienda ID]   # ricalcola i contatori dallo storico
+"""
+from datetime import date
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, update, delete, insert, func, cast, Integer
+from sqlalchemy.orm import Session
+
+from models import Campo, Trattamento, LimiteProdotto, ContatoreTrattamenti
+
+TOLLERANZA = 1e-9
+
+
+def _insert_upsert(db: Session):
+    """insert() con ON CONFLICT e funzione di massimo scalare del dialetto in uso"""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as insert_dialetto
+        return insert_dialetto, func.greatest
+    from sqlalchemy.dialects.sqlite import insert as insert_dialetto
+    return insert_dialetto, func.max
+
+
+def _chiave(campo_id: int, prodotto_id: int, anno: int):
+    return (
+        ContatoreTrattamenti.campo_id == campo_id,
+        ContatoreTrattamenti.prodotto_id == prodotto_id,
+        ContatoreTrattamenti.anno == anno,
+    )
+
+
+def aggiorna_contatori(db: Session, trattamento: Trattamento):
+    """Aggiunge un trattamento ai contatori con un upsert atomico (senza commit)"""
+    insert_dialetto, massimo = _insert_upsert(db)
+    stmt = insert_dialetto(ContatoreTrattamenti).values(
+        campo_id=trattamento.campo_id,
+        prodotto_id=trattamento.prodotto_id,
+        anno=trattamento.data.year,
+        applicazioni=1,
+        dose_ettaro=trattamento.quantita_per_ettaro,
+        quantita_totale=trattamento.quantita_totale,
+        ultima_data=trattamento.data,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["campo_id", "prodotto_id", "anno"],
+        set_={
+            "applicazioni": ContatoreTrattamenti.applicazioni + 1,
+            "dose_ettaro": ContatoreTrattamenti.dose_ettaro + stmt.excluded.dose_ettaro,
+            "quantita_totale": ContatoreTrattamenti.quantita_totale + stmt.excluded.quantita_totale,
+            "ultima_data": massimo(
+                func.coalesce(ContatoreTrattamenti.ultima_data, stmt.excluded.ultima_data),
+                stmt.excluded.ultima_data,
+            ),
+        },
+    )
+    db.execute(stmt)
+
+
+def aggiorna_contatori_blocco(db: Session, trattamenti: List[dict]):
+    """
+    Aggiunge un blocco di trattamenti ai contatori (senza commit)
+
+    I trattamenti (dict con le colonne di Trattamento) sono prima aggregati
+    per (campo, prodotto, anno), poi scritti con un unico upsert multiplo.
+    """
+    aggregati = {}
+    for t in trattamenti:
+        chiave = (t["campo_id"], t["prodotto_id"], t["data"].year)
+        contatore = aggregati.setdefault(chiave, {
+            "campo_id": chiave[0],
+            "prodotto_id": chiave[1],
+            "anno": chiave[2],
+            "applicazioni": 0,
+            "dose_ettaro": 0.0,
+            "quantita_totale": 0.0,
+            "ultima_data": t["data"],
+        })
+        contatore["applicazioni"] += 1
+        contatore["dose_ettaro"] += t["quantita_per_ettaro"]
+        contatore["quantita_totale"] += t["quantita_totale"]
+        contatore["ultima_data"] = max(contatore["ultima_data"], t["data"])
+
+    if not aggregati:
+        return
+
+    insert_dialetto, massimo = _insert_upsert(db)
+    stmt = insert_dialetto(ContatoreTrattamenti).values(list(aggregati.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["campo_id", "prodotto_id", "anno"],
+        set_={
+            "applicazioni": ContatoreTrattamenti.applicazioni + stmt.excluded.applicazioni,
+            "dose_ettaro": ContatoreTrattamenti.dose_ettaro + stmt.excluded.dose_ettaro,
+            "quantita_totale": ContatoreTrattamenti.quantita_totale + stmt.excluded.quantita_totale,
+            "ultima_data": massimo(
+                func.coalesce(ContatoreTrattamenti.ultima_data, stmt.excluded.ultima_data),
+                stmt.excluded.ultima_data,
+            ),
+        },
+    )
+    db.execute(stmt)
+
+
+def rimuovi_da_contatori(db: Session, trattamento: Trattamento):
+    """
+    Toglie un trattamento dai contatori (senza commit)
+
+    Da chiamare prima di eliminare il trattamento. L'ultima data viene
+    ricercata nello storico solo se era quella del trattamento eliminato.
+    """
+    anno = trattamento.data.year
+    chiave = _chiave(trattamento.campo_id, trattamento.prodotto_id, anno)
+
+    contatore = db.execute(select(ContatoreTrattamenti).where(*chiave)).scalar_one_or_none()
+    if contatore is None:
+        return
+
+    if contatore.applicazioni <= 1:
+        db.delete(contatore)
+        return
+
+    valori = {
+        "applicazioni": ContatoreTrattamenti.applicazioni - 1,
+        "dose_ettaro": ContatoreTrattamenti.dose_ettaro - trattamento.quantita_per_ettaro,
+        "quantita_totale": ContatoreTrattamenti.quantita_totale - trattamento.quantita_totale,
+    }
+    if contatore.ultima_data == trattamento.data:
+        valori["ultima_data"] = db.execute(
+            select(func.max(Trattamento.data)).where(
+                Trattamento.campo_id == trattamento.campo_id,
+                Trattamento.prodotto_id == trattamento.prodotto_id,
+                Trattamento.data >= date(anno, 1, 1),
+                Trattamento.data < date(anno + 1, 1, 1),
+                Trattamento.id != trattamento.id,
+            )
+        ).scalar()
+
+    db.execute(
+        update(ContatoreTrattamenti)
+        .where(ContatoreTrattamenti.id == contatore.id)
+        .values(**valori)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def elimina_contatori_campo(db: Session, campo_id: int):
+    """Elimina i contatori di un campo (senza commit)"""
+    db.execute(
+        delete(ContatoreTrattamenti)
+        .where(ContatoreTrattamenti.campo_id == campo_id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _giorni_da_applicazione_vicina(db: Session, campo_id: int, prodotto_id: int, data: date) -> Optional[int]:
+    """Giorni dall'applicazione più vicina (prima o dopo), per i trattamenti retrodatati"""
+    filtro = (Trattamento.campo_id == campo_id, Trattamento.prodotto_id == prodotto_id)
+    prima = db.execute(select(func.max(Trattamento.data)).where(*filtro, Trattamento.data <= data)).scalar()
+    dopo = db.execute(select(func.min(Trattamento.data)).where(*filtro, Trattamento.data >= data)).scalar()
+    giorni = [abs((d - data).days) for d in (prima, dopo) if d is not None]
+    return min(giorni) if giorni else None
+
+
+def verifica_limiti(db: Session, campo_id: int, prodotto_id: int, data: date, dose_ettaro: float) -> List[str]:
+    """
+    Verifica un nuovo trattamento contro i limiti del prodotto
+
+    Legge il limite e i contatori dell'anno corrente e precedente (per
+    l'intervallo a cavallo d'anno). Restituisce la lista dei limiti
+    superati, vuota se il trattamento è conforme o il prodotto non ha limiti.
+    """
+    limite = db.execute(
+        select(LimiteProdotto).where(LimiteProdotto.prodotto_id == prodotto_id)
+    ).scalar_one_or_none()
+    if limite is None:
+        return []
+
+    contatori = {
+        c.anno: c for c in db.execute(
+            select(ContatoreTrattamenti).where(
+                ContatoreTrattamenti.campo_id == campo_id,
+                ContatoreTrattamenti.prodotto_id == prodotto_id,
+                ContatoreTrattamenti.anno.in_([data.year - 1, data.year]),
+            )
+        ).scalars()
+    }
+    corrente = contatori.get(data.year)
+    applicazioni = corrente.applicazioni if corrente else 0
+    dose_anno = corrente.dose_ettaro if corrente else 0.0
+
+    violazioni = []
+    if limite.dose_max_ettaro is not None and dose_ettaro > limite.dose_max_ettaro + TOLLERANZA:
+        violazioni.append(
+            f"Dose {dose_ettaro:g}/ha superiore al massimo per applicazione ({limite.dose_max_ettaro:g}/ha)"
+        )
+    if limite.max_applicazioni_anno is not None and applicazioni + 1 > limite.max_applicazioni_anno:
+        violazioni.append(
+            f"Applicazione n. {applicazioni + 1} nel {data.year}: massimo consentito {limite.max_applicazioni_anno}"
+        )
+    if limite.dose_max_ettaro_anno is not None and dose_anno + dose_ettaro > limite.dose_max_ettaro_anno + TOLLERANZA:
+        violazioni.append(
+            f"Dose cumulata {dose_anno + dose_ettaro:g}/ha nel {data.year} superiore al massimo annuo ({limite.dose_max_ettaro_anno:g}/ha)"
+        )
+    if limite.intervallo_minimo_giorni is not None:
+        ultime = [c.ultima_data for c in contatori.values() if c.ultima_data]
+        if ultime and data >= max(ultime):
+            giorni = (data - max(ultime)).days
+        elif ultime:
+            giorni = _giorni_da_applicazione_vicina(db, campo_id, prodotto_id, data)
+        else:
+            giorni = None
+        if giorni is not None and giorni < limite.intervallo_minimo_giorni:
+            violazioni.append(
+                f"Solo {giorni} giorni dall'applicazione più vicina: intervallo minimo {limite.intervallo_minimo_giorni} giorni"
+            )
+    return violazioni
+
+
+def _ricalcola(db: Session, filtro_contatori: list, filtro_trattamenti: list) -> int:
+    """DELETE dei contatori filtrati e INSERT ... SELECT dei trattamenti corrispondenti"""
+    db.execute(
+        delete(ContatoreTrattamenti).where(*filtro_contatori).execution_options(synchronize_session=False)
+    )
+
+    anno = cast(func.extract("year", Trattamento.data), Integer)
+    aggregato = select(
+        Trattamento.campo_id,
+        Trattamento.prodotto_id,
+        anno,
+        func.count(Trattamento.id),
+        func.sum(Trattamento.quantita_per_ettaro),
+        func.sum(Trattamento.quantita_totale),
+        func.max(Trattamento.data),
+    ).where(*filtro_trattamenti).group_by(Trattamento.campo_id, Trattamento.prodotto_id, anno)
+
+    risultato = db.execute(
+        insert(ContatoreTrattamenti).from_select(
+            ["campo_id", "prodotto_id", "anno", "applicazioni", "dose_ettaro", "quantita_totale", "ultima_data"],
+            aggregato,
+        )
+    )
+    return risultato.rowcount
+
+
+def ricalcola_contatori(db: Session, azienda_id: Optional[int] = None) -> int:
+    """
+    Ricostruisce i contatori dallo storico trattamenti (senza commit)
+
+    Un DELETE e un INSERT ... SELECT con GROUP BY per (campo, prodotto, anno).
+    Restituisce il numero di contatori creati.
+    """
+    if azienda_id is None:
+        return _ricalcola(db, [], [])
+    campi_azienda = select(Campo.id).where(Campo.azienda_id == azienda_id)
+    return _ricalcola(
+        db,
+        [ContatoreTrattamenti.campo_id.in_(campi_azienda)],
+        [Trattamento.campo_id.in_(campi_azienda)],
+    )
+
+
+def ricalcola_contatori_chiavi(db: Session, chiavi: Iterable[Tuple[int, int, int]]) -> int:
+    """
+    Ricostruisce solo i contatori di alcune chiavi (campo, prodotto, anno), senza commit
+
+    Usata dopo eliminazioni massive: ricalcola campi x prodotti x anni
+    delle chiavi indicate (un soprainsieme, comunque coerente con lo storico).
+    """
+    chiavi = list(chiavi)
+    if not chiavi:
+        return 0
+    campi, prodotti, anni = ({c[i] for c in chiavi} for i in range(3))
+    inizio, fine = date(min(anni), 1, 1), date(max(anni) + 1, 1, 1)
+    return _ricalcola(
+        db,
+        [
+            ContatoreTrattamenti.campo_id.in_(campi),
+            ContatoreTrattamenti.prodotto_id.in_(prodotti),
+            ContatoreTrattamenti.anno.in_(anni),
+        ],
+        [
+            Trattamento.campo_id.in_(campi),
+            Trattamento.prodotto_id.in_(prodotti),
+            Trattamento.data >= inizio,
+            Trattamento.data < fine,
+            cast(func.extract("year", Trattamento.data), Integer).in_(anni),
+        ],
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    from models import SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(description="Ricalcola i contatori dei trattamenti dallo storico")
+    parser.add_argument("--azienda", type=int, help="Limita il ricalcolo a un'azienda")
+    args = parser.parse_args()
+
+    print("🔢 Ricalcolo contatori trattamenti...\n")
+    init_db()
+    db = SessionLocal()
+    try:
+        numero = ricalcola_contatori(db, args.azienda)
+        db.commit()
+        print(f"🎉 Ricalcolo completato: {numero} contatori (campo, prodotto, anno)")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Errore durante il ricalcolo: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+    finally:
+        db.close()
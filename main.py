@@ -2,56 +2,93 @@
 AgriNote - Web App Gestionale Agricola
 FastAPI Backend con Jinja2 Templates
 """
-from fastapi import FastAPI, Request, Depends, HTTPException, Form, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request, Depends, HTTPException, Form, UploadFile, File, Query
+from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, StreamingResponse, Response, JSONResponse
 from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from passlib.context import CryptContext
-from jose import JWTError, jwt
+from sqlalchemy import exists, func
 from datetime import date, datetime, timedelta
 from contextlib import asynccontextmanager
+from functools import lru_cache
+import hmac
 import json
-import httpx
-import fitz  # PyMuPDF
+import logging
 import os
+import time
+import uuid
+from collections import OrderedDict
 from typing import Optional
 
 from models import (
-    Base, engine, SessionLocal, get_db,
-    User, Azienda, Campo, Prodotto, Mezzo, Trattamento, TipoProdotto, InterventoManutenzione
+    engine, SessionLocal, get_db,
+    User, Azienda, Campo, Prodotto, Mezzo, Trattamento, TipoProdotto, InterventoManutenzione,
+    TipoMovimento, LimiteProdotto
 )
+from geometria import verifica_anello, centro_poligono
+from registro_magazzino import registra_movimento
+from report import consumi_per_campo, dosi_per_coltura
+from limiti_dose import verifica_limiti, aggiorna_contatori, rimuovi_da_contatori
+from manutenzione import elimina_campi_a_blocchi
+from archivio import in_archivio, trattamenti_archiviati
+from ricerca import cerca, cerca_lotto, SORGENTI
+from sync import modifiche, carica, revisione_azienda, MAX_MODIFICHE
+from migrazioni import verifica_schema
+from registro_log import configura_log, MiddlewareIdRichiesta
+from profilazione import MiddlewareProfilazione, amministratore, elenco_profili, file_profilo
+from risorse import StaticFilesImpronta, url_statico, verifica_risorse
+from cache_http import MiddlewareCompressione, etag_dati, non_modificata, risposta_304, con_etag
+import cache_template
+from cache_template import Differito
+from metriche import MiddlewareMetriche, esporta_metriche, chiudi_processo, METEO_DURATA, METEO_CACHE, PDF_DURATA, FATTURA_DURATA
 
 # Configurazione
 try:
-    from config import SECRET_KEY, ALGORITHM, METEO_LAT, METEO_LNG
+    from config import (
+        SECRET_KEY, ALGORITHM, METEO_LAT, METEO_LNG, MIGRAZIONI_AUTOMATICHE, METEO_CACHE_SECONDI, METRICHE_TOKEN,
+        METEO_URL, METEO_TIMEOUT_SECONDI, METEO_CACHE_VOCI
+    )
 except ImportError:
     # Fallback se config.py non esiste
     SECRET_KEY = "agrinote-secret-key-change-in-production"
     ALGORITHM = "HS256"
     METEO_LAT = 45.4642
     METEO_LNG = 9.1900
+    MIGRAZIONI_AUTOMATICHE = True
+    METEO_CACHE_SECONDI = 600
+    METRICHE_TOKEN = None
+    METEO_URL = "https://api.open-meteo.com/v1/forecast"
+    METEO_TIMEOUT_SECONDI = 5.0
+    METEO_CACHE_VOCI = 1000
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+configura_log()
+log = logging.getLogger("agrinote")
 
 
 # Lifespan Events (sostituisce on_event deprecato)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: inizializza database
-    from models import Base, engine
-    Base.metadata.create_all(bind=engine)
+    # Startup: controlla la versione dello schema (migrazioni solo se in sospeso)
+    verifica_schema(engine, applica=MIGRAZIONI_AUTOMATICHE)
+    verifica_risorse()
+    cache_template.precompila(templates)
     yield
-    # Shutdown: cleanup se necessario (opzionale)
+    # Shutdown: i file delle metriche del worker non contano più tra le richieste in corso
+    chiudi_processo()
 
 
 # FastAPI App
 app = FastAPI(title="AgriNote", lifespan=lifespan)
+app.add_middleware(MiddlewareProfilazione)  # Interno: il profilo contiene solo l'app
+app.add_middleware(MiddlewareCompressione)  # Dentro le metriche: la durata comprende la compressione
+app.add_middleware(MiddlewareMetriche)
+app.add_middleware(MiddlewareIdRichiesta)  # Esterno: l'id è già nel contesto per i log delle metriche
 
 # Templates e Static Files
-templates = Jinja2Templates(directory="templates")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+templates = cache_template.configura(Jinja2Templates(directory="templates"))
+templates.env.globals["url_statico"] = url_statico  # CSS e JavaScript con l'impronta del contenuto nel nome
+app.mount("/static", StaticFilesImpronta(directory="static"), name="static")
 
 # Crea directory se non esistono
 os.makedirs("static/uploads", exist_ok=True)
@@ -59,18 +96,29 @@ os.makedirs("templates", exist_ok=True)
 
 
 # Utility Functions
+# Librerie pesanti (passlib, jose, httpx, PyMuPDF, reportlab) importate al primo uso:
+# l'avvio di un worker non paga sottosistemi che la maggior parte delle richieste non usa
+
+@lru_cache(maxsize=None)
+def pwd_context():
+    """Contesto bcrypt, creato al primo login"""
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifica password"""
-    return pwd_context.verify(plain_password, hashed_password)
+    return pwd_context().verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
     """Hash password"""
-    return pwd_context.hash(password)
+    return pwd_context().hash(password)
 
 
 def create_access_token(data: dict):
     """Crea JWT token"""
+    from jose import jwt
     to_encode = data.copy()
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
@@ -81,6 +129,7 @@ def get_current_user(request: Request, db: Session = Depends(get_db)) -> Optiona
     token = request.cookies.get("access_token")
     if not token:
         return None
+    from jose import JWTError, jwt
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -107,7 +156,7 @@ def calcola_area_poligono(coordinate: list) -> float:
     import math
     
     if len(coordinate) < 3:
-        print(f"ERRORE: Coordinate insufficienti: {len(coordinate)} punti")
+        log.warning("Coordinate insufficienti: %d punti", len(coordinate))
         return 0.0
     
     # Verifica formato coordinate
@@ -121,13 +170,13 @@ def calcola_area_poligono(coordinate: list) -> float:
                 raise ValueError(f"Formato coordinata non valido: {p}")
         
         if len(coord_validate) < 3:
-            print(f"ERRORE: Coordinate validate insufficienti: {len(coord_validate)} punti")
+            log.warning("Coordinate validate insufficienti: %d punti", len(coord_validate))
             return 0.0
         
         coordinate = coord_validate
     except (ValueError, TypeError) as e:
-        print(f"ERRORE validazione coordinate: {e}")
-        print(f"Coordinate ricevute: {coordinate}")
+        log.warning("Coordinate non valide: %s", e)
+        log.debug("Coordinate ricevute: %s", coordinate)
         return 0.0
     
     # Calcola latitudine media per conversione precisa
@@ -146,9 +195,7 @@ def calcola_area_poligono(coordinate: list) -> float:
     area_gradi2 = 0.0
     n = len(coordinate)
     
-    print(f"DEBUG calcola_area: Calcolo con {n} punti")
-    print(f"DEBUG calcola_area: Primo punto: {coordinate[0]}")
-    print(f"DEBUG calcola_area: Ultimo punto: {coordinate[-1]}")
+    log.debug("calcola_area: %d punti, primo %s, ultimo %s", n, coordinate[0], coordinate[-1])
     
     for i in range(n):
         j = (i + 1) % n
@@ -156,30 +203,27 @@ def calcola_area_poligono(coordinate: list) -> float:
         # lng_i * lat_{i+1} - lng_{i+1} * lat_i
         term = coordinate[i][1] * coordinate[j][0] - coordinate[j][1] * coordinate[i][0]
         area_gradi2 += term
-        if i < 3:  # Debug primi 3 termini
-            print(f"DEBUG: Termine {i}: lng[{i}]={coordinate[i][1]:.6f} * lat[{j}]={coordinate[j][0]:.6f} - lng[{j}]={coordinate[j][1]:.6f} * lat[{i}]={coordinate[i][0]:.6f} = {term:.10f}")
     
     area_gradi2 = abs(area_gradi2) / 2.0
     
-    print(f"DEBUG calcola_area: Area in gradi²: {area_gradi2:.12f}")
+    log.debug("calcola_area: area in gradi² %.12f", area_gradi2)
     
     # Se l'area è troppo piccola, potrebbe essere un errore
     if area_gradi2 < 1e-12:
-        print(f"WARNING: Area in gradi² troppo piccola: {area_gradi2:.15f}")
-        print(f"WARNING: Coordinate potrebbero essere errate o poligono troppo piccolo")
+        log.warning("Area in gradi² troppo piccola (%.15f): coordinate errate o poligono troppo piccolo", area_gradi2)
         return 0.0
     
     # Conversione da gradi² a metri²
     # 1 grado² = (metri_per_grado_lat * metri_per_grado_lng) metri²
     area_metri2 = area_gradi2 * metri_per_grado_lat * metri_per_grado_lng
     
-    print(f"DEBUG calcola_area: Area in metri²: {area_metri2:.2f}")
+    log.debug("calcola_area: area in metri² %.2f", area_metri2)
     
     # Conversione da metri² a ettari (1 ettaro = 10,000 m²)
     area_ettari = area_metri2 / 10000.0
     
     result = round(area_ettari, 2)
-    print(f"DEBUG calcola_area: Area finale: {result} ettari")
+    log.debug("calcola_area: %s ettari", result)
     
     return result
 
@@ -187,6 +231,7 @@ def calcola_area_poligono(coordinate: list) -> float:
 # OCR Mockup - Estrazione testo da PDF
 def analizza_fattura_pdf(file_path: str) -> dict:
     """Analizza PDF fattura e estrae informazioni prodotto"""
+    import fitz  # PyMuPDF
     doc = fitz.open(file_path)
     testo_completo = ""
     
@@ -224,7 +269,94 @@ def analizza_fattura_pdf(file_path: str) -> dict:
     }
 
 
+def trattamenti_quaderno(db: Session, azienda: Azienda) -> list:
+    """Trattamenti dell'azienda, dal più recente"""
+    # Query trattamenti con gestione errori per dati vecchi
+    try:
+        return db.query(Trattamento).join(Campo).filter(
+            Campo.azienda_id == azienda.id
+        ).order_by(Trattamento.data.desc()).all()
+    except Exception as e:
+        log.warning("Errore query trattamenti: %s", e)
+        # Fallback: query diretta e filtraggio manuale
+        tutti_trattamenti = db.query(Trattamento).all()
+        trattamenti = []
+        for tr in tutti_trattamenti:
+            try:
+                if tr.campo and tr.campo.azienda_id == azienda.id:
+                    trattamenti.append(tr)
+            except:
+                # Trattamento orfano, salta
+                pass
+        trattamenti.sort(key=lambda x: x.data, reverse=True)
+        return trattamenti
+
+
 # API Meteo (Open-Meteo - Gratuita)
+# (tipo, lat, lng arrotondate) -> (scadenza, dati), dalla meno usata di recente
+_cache_meteo = OrderedDict()
+
+
+def _chiave_meteo(tipo: str, lat: float, lng: float) -> tuple:
+    return (tipo, round(lat, 2), round(lng, 2))
+
+
+def _salva_meteo(chiave: tuple, dati: dict):
+    """Salva una risposta eliminando le voci scadute e, oltre METEO_CACHE_VOCI, le meno usate"""
+    adesso = time.monotonic()
+    # Al più METEO_CACHE_VOCI voci, e solo dopo una chiamata di rete: la scansione non pesa
+    for scaduta in [c for c, (scadenza, _) in _cache_meteo.items() if scadenza <= adesso]:
+        del _cache_meteo[scaduta]
+    _cache_meteo[chiave] = (adesso + METEO_CACHE_SECONDI, dati)
+    _cache_meteo.move_to_end(chiave)
+    while len(_cache_meteo) > METEO_CACHE_VOCI:
+        _cache_meteo.popitem(last=False)
+
+
+def secondi_validita_meteo(tipo: str, lat: float, lng: float) -> int:
+    """Secondi di validità residua della risposta in cache per quelle coordinate (0 se assente o scaduta)"""
+    in_cache = _cache_meteo.get(_chiave_meteo(tipo, lat, lng))
+    return max(0, int(in_cache[0] - time.monotonic())) if in_cache else 0
+
+
+async def richiedi_open_meteo(tipo: str, params: dict) -> Optional[dict]:
+    """
+    GET a Open-Meteo (METEO_URL) con cache in memoria per METEO_CACHE_SECONDI
+
+    Le coordinate sono arrotondate a 0,01° (circa 1 km), la risoluzione
+    delle previsioni, sia nella chiave sia nella richiesta: la risposta in
+    cache è quella delle coordinate arrotondate. La cache tiene al più
+    METEO_CACHE_VOCI coordinate. Restituisce None se la chiamata fallisce.
+    """
+    chiave = _chiave_meteo(tipo, params["latitude"], params["longitude"])
+    params = {**params, "latitude": chiave[1], "longitude": chiave[2]}
+    in_cache = _cache_meteo.get(chiave)
+    if in_cache and in_cache[0] > time.monotonic():
+        METEO_CACHE.labels(tipo, "hit").inc()
+        _cache_meteo.move_to_end(chiave)
+        return in_cache[1]
+    METEO_CACHE.labels(tipo, "miss").inc()
+
+    import httpx
+    inizio = time.perf_counter()
+    esito = "errore"
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.get(METEO_URL, params=params, timeout=METEO_TIMEOUT_SECONDI)
+        if response.status_code == 200:
+            esito = "ok"
+            dati = response.json()
+            _salva_meteo(chiave, dati)
+            return dati
+        esito = str(response.status_code)
+    except httpx.TimeoutException:
+        esito = "timeout"
+        raise
+    finally:
+        METEO_DURATA.labels(tipo, esito).observe(time.perf_counter() - inizio)
+    return None
+
+
 async def get_meteo(lat: float = None, lng: float = None) -> dict:
     """Ottiene dati meteo da Open-Meteo API"""
     if lat is None:
@@ -232,24 +364,21 @@ async def get_meteo(lat: float = None, lng: float = None) -> dict:
     if lng is None:
         lng = METEO_LNG
     try:
-        async with httpx.AsyncClient() as client:
-            url = f"https://api.open-meteo.com/v1/forecast"
-            params = {
-                "latitude": lat,
-                "longitude": lng,
-                "current": "temperature_2m,weather_code",
-                "timezone": "Europe/Rome"
+        params = {
+            "latitude": lat,
+            "longitude": lng,
+            "current": "temperature_2m,weather_code",
+            "timezone": "Europe/Rome"
+        }
+        data = await richiedi_open_meteo("attuale", params)
+        if data is not None:
+            current = data.get("current", {})
+            return {
+                "temperatura": current.get("temperature_2m", "N/A"),
+                "codice_meteo": current.get("weather_code", 0)
             }
-            response = await client.get(url, params=params, timeout=5.0)
-            if response.status_code == 200:
-                data = response.json()
-                current = data.get("current", {})
-                return {
-                    "temperatura": current.get("temperature_2m", "N/A"),
-                    "codice_meteo": current.get("weather_code", 0)
-                }
     except Exception as e:
-        print(f"Errore meteo: {e}")
+        log.warning("Errore meteo: %s", e)
     return {"temperatura": "N/A", "codice_meteo": 0}
 
 
@@ -341,17 +470,19 @@ async def dashboard(request: Request, db: Session = Depends(get_db)):
 
 
 @app.get("/api/meteo")
-async def api_meteo(lat: float, lng: float, db: Session = Depends(get_db)):
-    """API per ottenere meteo con coordinate personalizzate"""
+async def api_meteo(
+    request: Request,
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    db: Session = Depends(get_db),
+):
+    """API per ottenere meteo con coordinate personalizzate (utenti autenticati)"""
+    require_auth(request, db)
     try:
         meteo_data = await get_meteo_esteso(lat, lng)
         
-        # Debug: stampa cosa restituisce
-        print(f"DEBUG api_meteo: Keys in meteo_data: {list(meteo_data.keys())}")
-        if "previsioni_giornaliere" in meteo_data:
-            print(f"DEBUG api_meteo: previsioni_giornaliere length: {len(meteo_data['previsioni_giornaliere'])}")
-        else:
-            print("DEBUG api_meteo: previsioni_giornaliere NOT FOUND!")
+        if "previsioni_giornaliere" not in meteo_data:
+            log.debug("api_meteo: previsioni_giornaliere mancanti, chiavi %s", list(meteo_data))
             # Se non c'è, crealo dai dati raw
             if "previsioni" in meteo_data:
                 daily = meteo_data["previsioni"]
@@ -375,19 +506,20 @@ async def api_meteo(lat: float, lng: float, db: Session = Depends(get_db)):
         # Assicurati che previsioni_giornaliere sia sempre presente
         if "previsioni_giornaliere" not in meteo_data:
             meteo_data["previsioni_giornaliere"] = []
-            
-        return meteo_data
+        
+        # Il browser la riusa finché vale la copia in cache (privata: la route richiede il login)
+        validita = secondi_validita_meteo("previsioni", lat, lng)
+        cache_control = f"private, max-age={validita}" if validita else "no-store"
+        return JSONResponse(meteo_data, headers={"Cache-Control": cache_control})
     except Exception as e:
-        print(f"Errore API meteo: {e}")
-        import traceback
-        traceback.print_exc()
-        return {
+        log.exception("Errore API meteo")
+        return JSONResponse({
             "temperatura": "N/A", 
             "alert": None, 
             "consiglio": None, 
             "previsioni_giornaliere": [],
             "error": str(e)
-        }
+        }, headers={"Cache-Control": "no-store"})
 
 
 @app.get("/mappa", response_class=HTMLResponse)
@@ -399,6 +531,10 @@ async def mappa(request: Request, campo_id: Optional[int] = None, db: Session =
     if not azienda:
         raise HTTPException(status_code=404, detail="Azienda non trovata")
     
+    etag = etag_dati(request, db, user, azienda)
+    if non_modificata(request, etag):
+        return risposta_304(etag)
+    
     campi = db.query(Campo).filter(Campo.azienda_id == azienda.id).all()
     
     # Se è specificato un campo_id, carica quel campo per visualizzarlo
@@ -422,13 +558,13 @@ async def mappa(request: Request, campo_id: Optional[int] = None, db: Session =
             "coordinate_poligono": campo.coordinate_poligono
         })
     
-    return templates.TemplateResponse("mappa.html", {
+    return con_etag(templates.TemplateResponse("mappa.html", {
         "request": request,
         "user": user,
         "azienda": azienda,
         "campi": campi_data,
         "campo_selezionato": campo_selezionato
-    })
+    }), etag)
 
 
 @app.post("/api/campo/salva")
@@ -457,24 +593,28 @@ async def salva_campo(
         if not isinstance(coord_list[0], list) or len(coord_list[0]) != 2:
             raise HTTPException(status_code=400, detail="Formato coordinate non valido: atteso [[lat, lng], ...]")
         
-        # Debug logging
-        print(f"DEBUG salva_campo: Ricevute {len(coord_list)} coordinate")
-        print(f"DEBUG salva_campo: Primo punto: {coord_list[0]}")
+        # Ripara punti duplicati / punto di chiusura e scarta poligoni con lati che si intersecano
+        try:
+            coord_list, correzioni = verifica_anello(coord_list)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        for correzione in correzioni:
+            log.info("salva_campo: %s", correzione)
+        
+        log.debug("salva_campo: %d coordinate, primo punto %s", len(coord_list), coord_list[0])
         
         # Calcola superficie
         superficie = calcola_area_poligono(coord_list)
         
-        print(f"DEBUG salva_campo: Superficie calcolata: {superficie} ettari")
+        log.debug("salva_campo: superficie calcolata %s ettari", superficie)
         
         if superficie <= 0:
-            print(f"WARNING: Superficie calcolata è 0 o negativa!")
-            print(f"DEBUG: Coordinate complete: {coord_list}")
-            # Ricalcola per debug
+            log.warning("salva_campo: superficie calcolata %s, ricalcolo senza soglia", superficie)
+            log.debug("salva_campo: coordinate complete %s", coord_list)
             import math
             lat_media = sum(p[0] for p in coord_list) / len(coord_list)
-            print(f"DEBUG: Latitudine media: {lat_media}")
             
-            # Ricalcola manualmente per debug
+            # Ricalcola manualmente (senza la soglia minima di calcola_area_poligono)
             area_gradi2 = 0.0
             n = len(coord_list)
             for i in range(n):
@@ -482,18 +622,15 @@ async def salva_campo(
                 area_gradi2 += coord_list[i][1] * coord_list[j][0]
                 area_gradi2 -= coord_list[j][1] * coord_list[i][0]
             area_gradi2 = abs(area_gradi2) / 2.0
-            print(f"DEBUG: Area in gradi²: {area_gradi2}")
             
             metri_per_grado_lat = 111320.0
             metri_per_grado_lng = 111320.0 * math.cos(math.radians(lat_media))
             area_metri2 = area_gradi2 * metri_per_grado_lat * metri_per_grado_lng
-            print(f"DEBUG: Area in metri²: {area_metri2}")
             superficie = area_metri2 / 10000.0
-            print(f"DEBUG: Superficie ricalcolata: {superficie} ettari")
+            log.debug("salva_campo: superficie ricalcolata %s ettari", superficie)
         
-        # Calcola centro del poligono (centroide)
-        centro_lat = sum(p[0] for p in coord_list) / len(coord_list)
-        centro_lng = sum(p[1] for p in coord_list) / len(coord_list)
+        # Calcola centro del poligono (centroide pesato, sempre interno al campo)
+        centro_lat, centro_lng = centro_poligono(coord_list)
         
         campo = Campo(
             azienda_id=azienda.id,
@@ -508,18 +645,19 @@ async def salva_campo(
         db.commit()
         db.refresh(campo)
         
-        print(f"DEBUG salva_campo: Campo salvato con superficie: {campo.superficie_ettari} ettari")
+        log.info("Campo %s salvato (%s ettari)", campo.id, campo.superficie_ettari)
         
         return {"success": True, "campo_id": campo.id, "superficie": superficie}
+    except HTTPException:
+        db.rollback()
+        raise
     except json.JSONDecodeError as e:
         db.rollback()
-        print(f"ERRORE JSON: {str(e)}")
+        log.warning("salva_campo: coordinate non leggibili: %s", e)
         raise HTTPException(status_code=400, detail=f"Errore parsing coordinate: {str(e)}")
     except Exception as e:
         db.rollback()
-        print(f"ERRORE salvataggio campo: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Errore salvataggio campo")
         raise HTTPException(status_code=400, detail=f"Errore: {str(e)}")
 
 
@@ -548,26 +686,59 @@ async def elimina_campo(
     try:
         nome_campo = campo.nome
         
-        # Elimina prima i trattamenti associati (se cascade non funziona)
-        from models import Trattamento
-        trattamenti = db.query(Trattamento).filter(Trattamento.campo_id == campo_id).all()
-        for trattamento in trattamenti:
-            db.delete(trattamento)
-        
-        # Elimina il campo
-        db.delete(campo)
-        db.commit()
+        # Trattamenti a blocchi con commit separati (contatori ricalcolati, scarichi di magazzino conservati), poi il campo.
+        # Nel threadpool: tra un blocco e l'altro l'event loop continua a servire le altre richieste
+        await run_in_threadpool(elimina_campi_a_blocchi, db, azienda_id=azienda.id, campo_id=campo_id)
         
-        print(f"✅ Campo '{nome_campo}' (ID: {campo_id}) eliminato con successo")
-        return {"success": True, "message": f"Campo '{nome_campo}' eliminato con successo"}
+        log.info("Campo '%s' (ID: %s) eliminato", nome_campo, campo_id)
+        return {"success": True, "message": f"Campo '{nome_campo}' eliminato con successo (giacenze di magazzino invariate)"}
     except Exception as e:
         db.rollback()
-        print(f"ERRORE eliminazione campo: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Errore eliminazione campo %s", campo_id)
         raise HTTPException(status_code=400, detail=f"Errore durante l'eliminazione: {str(e)}")
 
 
+@app.post("/api/campi/importa")
+async def importa_campi_file(
+    request: Request,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """Import massivo campi da file GeoJSON / KML / CSV (WKT)"""
+    user = require_auth(request, db)
+    azienda = db.query(Azienda).filter(Azienda.user_id == user.id).first()
+
+    if not azienda:
+        raise HTTPException(status_code=404, detail="Azienda non trovata")
+
+    from importa_campi import importa_campi, rileva_formato
+    from xml.etree.ElementTree import ParseError
+    import tempfile
+
+    try:
+        formato = rileva_formato(file.filename or "")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Copia l'upload su file temporaneo a blocchi, senza caricarlo tutto in memoria
+    suffisso = os.path.splitext(file.filename)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffisso, delete=False) as tmp:
+        while True:
+            blocco = await file.read(1 << 20)
+            if not blocco:
+                break
+            tmp.write(blocco)
+        percorso_tmp = tmp.name
+
+    try:
+        # Parsing e scritture nel threadpool: l'event loop continua a servire le altre richieste
+        return await run_in_threadpool(importa_campi, db, percorso_tmp, azienda.id, formato=formato)
+    except (ValueError, ParseError) as e:
+        raise HTTPException(status_code=400, detail=f"File non valido: {str(e)}")
+    finally:
+        os.remove(percorso_tmp)
+
+
 @app.get("/magazzino", response_class=HTMLResponse)
 async def magazzino(request: Request, db: Session = Depends(get_db)):
     """Pagina magazzino prodotti"""
@@ -591,6 +762,7 @@ async def magazzino(request: Request, db: Session = Depends(get_db)):
 async def upload_fattura(
     request: Request,
     file: UploadFile = File(...),
+    quantita: Optional[float] = Form(None),
     db: Session = Depends(get_db)
 ):
     """Upload e analisi fattura PDF"""
@@ -607,7 +779,8 @@ async def upload_fattura(
         f.write(content)
     
     # Analizza PDF
-    risultato = analizza_fattura_pdf(file_path)
+    with FATTURA_DURATA.time():
+        risultato = analizza_fattura_pdf(file_path)
     
     if risultato["tipo"]:
         # Crea prodotto
@@ -615,10 +788,17 @@ async def upload_fattura(
             azienda_id=azienda.id,
             nome_commerciale=risultato["nome"],
             tipo=risultato["tipo"],
-            quantita_disponibile=0.0,  # Da inserire manualmente
+            quantita_disponibile=0.0,  # Aggiornata dal carico se la quantità è indicata
             unita_misura="kg"
         )
         db.add(prodotto)
+        
+        if quantita:
+            db.flush()
+            registra_movimento(
+                db, prodotto.id, TipoMovimento.CARICO, quantita,
+                riferimento=file.filename, note="Carico da fattura"
+            )
         db.commit()
     
     return RedirectResponse(url="/magazzino", status_code=303)
@@ -646,10 +826,98 @@ async def nuovo_prodotto(
         azienda_id=azienda.id,
         nome_commerciale=nome_commerciale,
         tipo=tipo_enum,
-        quantita_disponibile=quantita,
+        quantita_disponibile=0.0,
         unita_misura=unita
     )
     db.add(prodotto)
+    
+    # La giacenza iniziale entra nel registro come primo carico
+    if quantita:
+        db.flush()
+        registra_movimento(db, prodotto.id, TipoMovimento.CARICO, quantita, note="Carico iniziale")
+    db.commit()
+    
+    return RedirectResponse(url="/magazzino", status_code=303)
+
+
+@app.post("/magazzino/prodotto/{prodotto_id}/movimento")
+async def nuovo_movimento(
+    prodotto_id: int,
+    request: Request,
+    tipo: str = Form(...),
+    quantita: float = Form(...),
+    data: Optional[str] = Form(None),
+    riferimento: Optional[str] = Form(None),
+    note: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """Registra un carico o una rettifica di magazzino"""
+    user = require_auth(request, db)
+    azienda = db.query(Azienda).filter(Azienda.user_id == user.id).first()
+    
+    if not azienda:
+        raise HTTPException(status_code=404, detail="Azienda non trovata")
+    
+    prodotto = db.query(Prodotto).filter(
+        Prodotto.id == prodotto_id,
+        Prodotto.azienda_id == azienda.id
+    ).first()
+    
+    if not prodotto:
+        raise HTTPException(status_code=404, detail="Prodotto non trovato")
+    
+    # Gli scarichi per trattamento sono registrati solo dal quaderno
+    if tipo == TipoMovimento.CARICO.value:
+        if quantita <= 0:
+            raise HTTPException(status_code=400, detail="La quantità caricata deve essere positiva")
+        tipo_enum = TipoMovimento.CARICO
+    elif tipo == TipoMovimento.RETTIFICA.value:
+        tipo_enum = TipoMovimento.RETTIFICA
+    else:
+        raise HTTPException(status_code=400, detail="Tipo movimento non valido")
+    
+    data_obj = datetime.strptime(data, "%Y-%m-%d").date() if data else None
+    
+    registra_movimento(
+        db, prodotto.id, tipo_enum, quantita,
+        data=data_obj, riferimento=riferimento, note=note
+    )
+    db.commit()
+    
+    return RedirectResponse(url="/magazzino", status_code=303)
+
+
+@app.post("/magazzino/prodotto/{prodotto_id}/limiti")
+async def salva_limiti_prodotto(
+    prodotto_id: int,
+    request: Request,
+    dose_max_ettaro: Optional[float] = Form(None),
+    dose_max_ettaro_anno: Optional[float] = Form(None),
+    max_applicazioni_anno: Optional[int] = Form(None),
+    intervallo_minimo_giorni: Optional[int] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """Imposta i limiti d'impiego da etichetta di un prodotto"""
+    user = require_auth(request, db)
+    azienda = db.query(Azienda).filter(Azienda.user_id == user.id).first()
+    
+    if not azienda:
+        raise HTTPException(status_code=404, detail="Azienda non trovata")
+    
+    prodotto = db.query(Prodotto).filter(
+        Prodotto.id == prodotto_id,
+        Prodotto.azienda_id == azienda.id
+    ).first()
+    
+    if not prodotto:
+        raise HTTPException(status_code=404, detail="Prodotto non trovato")
+    
+    limite = prodotto.limite or LimiteProdotto(prodotto_id=prodotto.id)
+    limite.dose_max_ettaro = dose_max_ettaro
+    limite.dose_max_ettaro_anno = dose_max_ettaro_anno
+    limite.max_applicazioni_anno = max_applicazioni_anno
+    limite.intervallo_minimo_giorni = intervallo_minimo_giorni
+    db.add(limite)
     db.commit()
     
     return RedirectResponse(url="/magazzino", status_code=303)
@@ -664,44 +932,32 @@ async def quaderno(request: Request, db: Session = Depends(get_db)):
     if not azienda:
         raise HTTPException(status_code=404, detail="Azienda non trovata")
     
+    revisione = revisione_azienda(db, azienda.id)
+    etag = etag_dati(request, db, user, azienda, revisione)
+    if non_modificata(request, etag):
+        return risposta_304(etag)
+    
     campi = db.query(Campo).filter(Campo.azienda_id == azienda.id).all()
     prodotti = db.query(Prodotto).filter(Prodotto.azienda_id == azienda.id).all()
     mezzi = db.query(Mezzo).filter(Mezzo.azienda_id == azienda.id).all()
     
-    # Query trattamenti con gestione errori per dati vecchi
-    try:
-        trattamenti = db.query(Trattamento).join(Campo).filter(
-            Campo.azienda_id == azienda.id
-        ).order_by(Trattamento.data.desc()).all()
-    except Exception as e:
-        print(f"WARNING: Errore query trattamenti: {e}")
-        # Fallback: query diretta e filtraggio manuale
-        tutti_trattamenti = db.query(Trattamento).all()
-        trattamenti = []
-        for tr in tutti_trattamenti:
-            try:
-                if tr.campo and tr.campo.azienda_id == azienda.id:
-                    trattamenti.append(tr)
-            except:
-                # Trattamento orfano, salta
-                pass
-        trattamenti.sort(key=lambda x: x.data, reverse=True)
-    
-    return templates.TemplateResponse("quaderno.html", {
+    return con_etag(templates.TemplateResponse("quaderno.html", {
         "request": request,
         "user": user,
         "azienda": azienda,
         "campi": campi,
         "prodotti": prodotti,
         "mezzi": mezzi,
-        "trattamenti": trattamenti,
+        # Letti solo se la tabella non è nella cache dei frammenti
+        "trattamenti": Differito(lambda: trattamenti_quaderno(db, azienda)),
+        "revisione": revisione,
         "oggi": date.today()
-    })
+    }), etag)
 
 
 @app.get("/quaderno/export/pdf")
-async def export_quaderno_pdf(request: Request, db: Session = Depends(get_db)):
-    """Esporta quaderno di campagna in PDF"""
+async def export_quaderno_pdf(request: Request, anno: Optional[int] = None, db: Session = Depends(get_db)):
+    """Esporta quaderno di campagna in PDF (di una stagione, anche archiviata, con ?anno=)"""
     user = require_auth(request, db)
     azienda = db.query(Azienda).filter(Azienda.user_id == user.id).first()
     
@@ -710,11 +966,17 @@ async def export_quaderno_pdf(request: Request, db: Session = Depends(get_db)):
     
     # Query trattamenti
     try:
-        trattamenti = db.query(Trattamento).join(Campo).filter(
-            Campo.azienda_id == azienda.id
-        ).order_by(Trattamento.data.asc()).all()  # Ordine cronologico per PDF
+        query = db.query(Trattamento).join(Campo).filter(Campo.azienda_id == azienda.id)
+        if anno is not None:
+            query = query.filter(Trattamento.data >= date(anno, 1, 1), Trattamento.data < date(anno + 1, 1, 1))
+        trattamenti = query.order_by(Trattamento.data.asc(), Trattamento.id).all()  # Ordine cronologico per PDF
+        
+        # Stagione archiviata (o tutte le stagioni): si aggiungono i trattamenti spostati nell'archivio
+        if in_archivio(db, anno):
+            trattamenti = trattamenti_archiviati(db, azienda.id, anno) + trattamenti
+            trattamenti.sort(key=lambda t: (t.data, t.id))
     except Exception as e:
-        print(f"WARNING: Errore query trattamenti: {e}")
+        log.warning("Errore query trattamenti: %s", e)
         trattamenti = []
     
     # Genera PDF
@@ -724,26 +986,59 @@ async def export_quaderno_pdf(request: Request, db: Session = Depends(get_db)):
     output_dir = "static/exports"
     os.makedirs(output_dir, exist_ok=True)
     
-    filename = f"quaderno_campagna_{azienda.id}_{date.today().strftime('%Y%m%d')}.pdf"
-    output_path = os.path.join(output_dir, filename)
+    filename = f"quaderno_campagna_{azienda.id}_{anno or date.today().strftime('%Y%m%d')}.pdf"
+    # File proprio della richiesta: due export contemporanei della stessa stagione non si sovrascrivono
+    output_path = os.path.join(output_dir, f"{uuid.uuid4().hex}.pdf")
     
     try:
-        genera_quaderno_pdf(azienda, trattamenti, output_path)
+        with PDF_DURATA.time():
+            genera_quaderno_pdf(azienda, trattamenti, output_path)
         
-        # Restituisci file PDF
+        # Restituisci file PDF (eliminato dopo l'invio)
         from fastapi.responses import FileResponse
         return FileResponse(
             output_path,
             media_type="application/pdf",
-            filename=filename
+            filename=filename,
+            background=BackgroundTask(os.remove, output_path)
         )
     except Exception as e:
-        print(f"Errore generazione PDF: {e}")
-        import traceback
-        traceback.print_exc()
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        log.exception("Errore generazione PDF")
         raise HTTPException(status_code=500, detail=f"Errore generazione PDF: {str(e)}")
 
 
+@app.get("/quaderno/export/{formato}")
+async def export_quaderno_dati(
+    formato: str,
+    request: Request,
+    anno: Optional[int] = None,
+    campo_id: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """Esporta i trattamenti in CSV o NDJSON, in streaming"""
+    user = require_auth(request, db)
+    azienda = db.query(Azienda).filter(Azienda.user_id == user.id).first()
+    
+    if not azienda:
+        raise HTTPException(status_code=404, detail="Azienda non trovata")
+    
+    from esporta_quaderno import FORMATI, righe_quaderno
+    
+    if formato not in FORMATI:
+        raise HTTPException(status_code=404, detail=f"Formato non supportato, usare: pdf, {', '.join(FORMATI)}")
+    
+    generatore, media_type, estensione = FORMATI[formato]
+    filename = f"quaderno_campagna_{azienda.id}_{anno or date.today().strftime('%Y%m%d')}.{estensione}"
+    
+    return StreamingResponse(
+        generatore(righe_quaderno(azienda.id, anno, campo_id)),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
 @app.post("/quaderno/trattamento/nuovo")
 async def nuovo_trattamento(
     request: Request,
@@ -760,6 +1055,7 @@ async def nuovo_trattamento(
     velocita_vento: Optional[float] = Form(None),
     note: Optional[str] = Form(None),
     numero_lotto: Optional[str] = Form(None),
+    ignora_limiti: bool = Form(False),
     db: Session = Depends(get_db)
 ):
     """Crea nuovo trattamento"""
@@ -778,6 +1074,15 @@ async def nuovo_trattamento(
     if not campo:
         raise HTTPException(status_code=404, detail="Campo non trovato")
     
+    # Verifica prodotto appartiene all'azienda
+    prodotto = db.query(Prodotto).filter(
+        Prodotto.id == prodotto_id,
+        Prodotto.azienda_id == azienda.id
+    ).first()
+    
+    if not prodotto:
+        raise HTTPException(status_code=404, detail="Prodotto non trovato")
+    
     # Verifica mezzo appartiene all'azienda (se specificato)
     if mezzo_id:
         mezzo = db.query(Mezzo).filter(
@@ -793,6 +1098,14 @@ async def nuovo_trattamento(
     # Parsing data
     data_obj = datetime.strptime(data, "%Y-%m-%d").date()
     
+    # Verifica limiti d'impiego del prodotto (dose, applicazioni, intervallo)
+    violazioni = verifica_limiti(db, campo.id, prodotto.id, data_obj, quantita_per_ettaro)
+    if violazioni and not ignora_limiti:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Limiti d'impiego di {prodotto.nome_commerciale} superati: " + "; ".join(violazioni)
+        )
+    
     trattamento = Trattamento(
         campo_id=campo_id,
         data=data_obj,
@@ -810,6 +1123,14 @@ async def nuovo_trattamento(
         numero_lotto=numero_lotto
     )
     db.add(trattamento)
+    db.flush()
+    aggiorna_contatori(db, trattamento)
+    
+    # Scarico di magazzino nella stessa transazione del trattamento
+    registra_movimento(
+        db, prodotto_id, TipoMovimento.TRATTAMENTO, -quantita_totale,
+        data=data_obj, trattamento_id=trattamento.id, riferimento=numero_lotto
+    )
     db.commit()
     
     return RedirectResponse(url="/quaderno", status_code=303)
@@ -830,40 +1151,81 @@ async def elimina_trattamento(
     
     try:
         # Verifica che il trattamento appartenga a un campo dell'azienda
-        # Usa outerjoin per gestire anche trattamenti orfani
+        # I trattamenti orfani (campo eliminato) sono gestiti sotto
         trattamento = db.query(Trattamento).join(Campo, Trattamento.campo_id == Campo.id).filter(
             Trattamento.id == trattamento_id,
             Campo.azienda_id == azienda.id
         ).first()
         
-        # Se non trovato con join, prova a cercare direttamente (per gestire dati vecchi)
+        # Se non trovato con join, cerca solo tra gli orfani (dati vecchi senza campo valido):
+        # i trattamenti con il campo di un'altra azienda restano 404
         if not trattamento:
             trattamento = db.query(Trattamento).filter(
-                Trattamento.id == trattamento_id
+                Trattamento.id == trattamento_id,
+                ~exists().where(Campo.id == Trattamento.campo_id)
             ).first()
             
-            # Se esiste ma non ha campo valido, eliminalo comunque (dato orfano)
             if trattamento:
-                print(f"WARNING: Trattamento {trattamento_id} trovato ma senza campo valido - eliminazione forzata")
+                log.warning("Trattamento %s senza campo valido: eliminazione forzata", trattamento_id)
             else:
                 raise HTTPException(status_code=404, detail="Trattamento non trovato")
         
-        # Elimina il trattamento
+        # Giacenza invariata, come per le eliminazioni a blocchi: lo scarico resta nel registro,
+        # scollegato dal trattamento. Una correzione di magazzino è una rettifica esplicita
+        rimuovi_da_contatori(db, trattamento)
         db.delete(trattamento)
         db.commit()
         
-        print(f"✅ Trattamento ID {trattamento_id} eliminato con successo")
-        return {"success": True, "message": "Trattamento eliminato con successo"}
+        log.info("Trattamento %s eliminato", trattamento_id)
+        return {"success": True, "message": "Trattamento eliminato con successo (giacenze di magazzino invariate)"}
     except HTTPException:
         raise
     except Exception as e:
         db.rollback()
-        print(f"ERRORE eliminazione trattamento: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Errore eliminazione trattamento %s", trattamento_id)
         raise HTTPException(status_code=400, detail=f"Errore durante l'eliminazione: {str(e)}")
 
 
+@app.post("/api/trattamenti/importa")
+async def importa_trattamenti_file(
+    request: Request,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """Import massivo trattamenti da file CSV / XLSX (registri contoterzisti)"""
+    user = require_auth(request, db)
+    azienda = db.query(Azienda).filter(Azienda.user_id == user.id).first()
+
+    if not azienda:
+        raise HTTPException(status_code=404, detail="Azienda non trovata")
+
+    from importa_trattamenti import importa_trattamenti, rileva_formato
+    import tempfile
+
+    try:
+        formato = rileva_formato(file.filename or "")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Copia l'upload su file temporaneo a blocchi, senza caricarlo tutto in memoria
+    suffisso = os.path.splitext(file.filename)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffisso, delete=False) as tmp:
+        while True:
+            blocco = await file.read(1 << 20)
+            if not blocco:
+                break
+            tmp.write(blocco)
+        percorso_tmp = tmp.name
+
+    try:
+        # Lettura del file e scritture a blocchi nel threadpool: l'event loop resta libero
+        return await run_in_threadpool(importa_trattamenti, db, percorso_tmp, azienda.id, formato=formato)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"File non valido: {str(e)}")
+    finally:
+        os.remove(percorso_tmp)
+
+
 @app.get("/api/campo/{campo_id}/ettari")
 async def get_ettari_campo(
     campo_id: int,
@@ -882,7 +1244,115 @@ async def get_ettari_campo(
     if not campo:
         raise HTTPException(status_code=404, detail="Campo non trovato")
     
-    return {"ettari": campo.superficie_ettari}
+    etag = etag_dati(request, db, user, azienda)
+    if non_modificata(request, etag):
+        return risposta_304(etag)
+    return con_etag(JSONResponse({"ettari": campo.superficie_ettari}), etag)
+
+
+# ========== REPORT ==========
+
+@app.get("/api/report/consumi")
+async def report_consumi(request: Request, anno: Optional[int] = None, db: Session = Depends(get_db)):
+    """Totale kg/L di ogni prodotto per campo e stagione"""
+    user = require_auth(request, db)
+    azienda = db.query(Azienda).filter(Azienda.user_id == user.id).first()
+    
+    if not azienda:
+        raise HTTPException(status_code=404, detail="Azienda non trovata")
+    
+    return {"anno": anno, "righe": consumi_per_campo(db, azienda.id, anno)}
+
+
+@app.get("/api/report/dosi")
+async def report_dosi(request: Request, anno: Optional[int] = None, db: Session = Depends(get_db)):
+    """Dose per ettaro di ogni prodotto per coltura e stagione"""
+    user = require_auth(request, db)
+    azienda = db.query(Azienda).filter(Azienda.user_id == user.id).first()
+    
+    if not azienda:
+        raise HTTPException(status_code=404, detail="Azienda non trovata")
+    
+    return {"anno": anno, "righe": dosi_per_coltura(db, azienda.id, anno)}
+
+
+# ========== RICERCA ==========
+
+@app.get("/api/ricerca")
+async def ricerca(
+    request: Request,
+    q: str,
+    tipo: Optional[str] = None,
+    limite: int = 20,
+    db: Session = Depends(get_db)
+):
+    """Ricerca full-text in trattamenti, prodotti e interventi dell'azienda"""
+    user = require_auth(request, db)
+    azienda = db.query(Azienda).filter(Azienda.user_id == user.id).first()
+    
+    if not azienda:
+        raise HTTPException(status_code=404, detail="Azienda non trovata")
+    if tipo is not None and tipo not in SORGENTI:
+        raise HTTPException(status_code=400, detail=f"Tipo non valido, usare: {', '.join(SORGENTI)}")
+    
+    limite = max(1, min(limite, 100))
+    return {"q": q, "risultati": cerca(db, azienda.id, q, tipo, limite)}
+
+
+@app.get("/api/ricerca/lotto")
+async def ricerca_lotto(request: Request, numero: str, db: Session = Depends(get_db)):
+    """Richiamo lotto: campi e date in cui è stato applicato un lotto"""
+    user = require_auth(request, db)
+    azienda = db.query(Azienda).filter(Azienda.user_id == user.id).first()
+    
+    if not azienda:
+        raise HTTPException(status_code=404, detail="Azienda non trovata")
+    
+    trattamenti = cerca_lotto(db, azienda.id, numero)
+    return {
+        "numero_lotto": numero,
+        "campi": len({t["campo_id"] for t in trattamenti}),
+        "trattamenti": trattamenti,
+    }
+
+
+# ========== SINCRONIZZAZIONE OFFLINE ==========
+
+@app.get("/api/sync")
+async def sync_scarica(
+    request: Request,
+    cursore: int = 0,
+    limite: int = MAX_MODIFICHE,
+    db: Session = Depends(get_db)
+):
+    """Modifiche ed eliminazioni successive al cursore del dispositivo"""
+    user = require_auth(request, db)
+    azienda = db.query(Azienda).filter(Azienda.user_id == user.id).first()
+    
+    if not azienda:
+        raise HTTPException(status_code=404, detail="Azienda non trovata")
+    
+    return modifiche(db, azienda.id, cursore, max(1, min(limite, MAX_MODIFICHE)))
+
+
+@app.post("/api/sync")
+async def sync_carica(request: Request, db: Session = Depends(get_db)):
+    """Riceve trattamenti e interventi creati offline (JSON con id_client per record)"""
+    user = require_auth(request, db)
+    azienda = db.query(Azienda).filter(Azienda.user_id == user.id).first()
+    
+    if not azienda:
+        raise HTTPException(status_code=404, detail="Azienda non trovata")
+    
+    try:
+        pacchetto = await request.json()
+        if not isinstance(pacchetto, dict):
+            raise ValueError("Atteso un oggetto JSON")
+        risultato = carica(db, azienda.id, pacchetto)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Caricamento non valido: {str(e)}")
+    
+    return risultato
 
 
 # ========== GESTIONE AZIENDA ==========
@@ -946,15 +1416,19 @@ async def mezzi_page(request: Request, db: Session = Depends(get_db)):
     if not azienda:
         raise HTTPException(status_code=404, detail="Azienda non trovata")
     
-    mezzi = db.query(Mezzo).filter(Mezzo.azienda_id == azienda.id).all()
+    revisione = revisione_azienda(db, azienda.id)
+    etag = etag_dati(request, db, user, azienda, revisione)
+    if non_modificata(request, etag):
+        return risposta_304(etag)
     
-    return templates.TemplateResponse("mezzi.html", {
+    return con_etag(templates.TemplateResponse("mezzi.html", {
         "request": request,
         "user": user,
         "azienda": azienda,
-        "mezzi": mezzi,
+        "mezzi": Differito(lambda: db.query(Mezzo).filter(Mezzo.azienda_id == azienda.id).all()),
+        "revisione": revisione,
         "oggi": date.today()
-    })
+    }), etag)
 
 
 @app.post("/mezzi/nuovo")
@@ -1052,18 +1526,22 @@ async def libretto_mezzo(request: Request, mezzo_id: int, db: Session = Depends(
     if not mezzo:
         raise HTTPException(status_code=404, detail="Mezzo non trovato")
     
+    etag = etag_dati(request, db, user, azienda)
+    if non_modificata(request, etag):
+        return risposta_304(etag)
+    
     interventi = db.query(InterventoManutenzione).filter(
         InterventoManutenzione.mezzo_id == mezzo_id
     ).order_by(InterventoManutenzione.data_intervento.desc()).all()
     
-    return templates.TemplateResponse("libretto_mezzo.html", {
+    return con_etag(templates.TemplateResponse("libretto_mezzo.html", {
         "request": request,
         "user": user,
         "azienda": azienda,
         "mezzo": mezzo,
         "interventi": interventi,
         "oggi": date.today()
-    })
+    }), etag)
 
 
 @app.post("/mezzi/{mezzo_id}/intervento/nuovo")
@@ -1115,6 +1593,48 @@ async def nuovo_intervento(
     return RedirectResponse(url=f"/mezzi/{mezzo_id}/libretto", status_code=303)
 
 
+# ========== METRICHE ==========
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    """Metriche in formato Prometheus (con METRICHE_TOKEN serve Authorization: Bearer)"""
+    if METRICHE_TOKEN and not hmac.compare_digest(
+        request.headers.get("authorization", ""), f"Bearer {METRICHE_TOKEN}"
+    ):
+        raise HTTPException(status_code=401, detail="Token non valido")
+    corpo, content_type = esporta_metriche()
+    return Response(content=corpo, headers={"Content-Type": content_type})
+
+
+# ========== PROFILI ==========
+
+@app.get("/admin/profili", response_class=HTMLResponse)
+async def admin_profili(request: Request, db: Session = Depends(get_db)):
+    """Profili delle richieste salvati (solo amministratori)"""
+    user = require_auth(request, db)
+    if not amministratore(user.username):
+        raise HTTPException(status_code=403, detail="Riservato agli amministratori")
+
+    return templates.TemplateResponse("admin_profili.html", {
+        "request": request,
+        "user": user,
+        "profili": elenco_profili()
+    })
+
+
+@app.get("/admin/profili/{nome}")
+async def scarica_profilo(request: Request, nome: str, db: Session = Depends(get_db)):
+    """Scarica un profilo (.pstats o stack compressi .txt)"""
+    user = require_auth(request, db)
+    if not amministratore(user.username):
+        raise HTTPException(status_code=403, detail="Riservato agli amministratori")
+
+    percorso = file_profilo(nome)
+    if not percorso:
+        raise HTTPException(status_code=404, detail="Profilo non trovato")
+    return FileResponse(percorso, media_type="application/octet-stream", filename=os.path.basename(percorso))
+
+
 # ========== ALERT METEO ==========
 
 async def get_meteo_esteso(lat: float = None, lng: float = None) -> dict:
@@ -1124,69 +1644,64 @@ async def get_meteo_esteso(lat: float = None, lng: float = None) -> dict:
     if lng is None:
         lng = METEO_LNG
     try:
-        async with httpx.AsyncClient() as client:
-            url = "https://api.open-meteo.com/v1/forecast"
-            params = {
-                "latitude": lat,
-                "longitude": lng,
-                "daily": "weather_code,temperature_2m_max,temperature_2m_min,precipitation_sum",
-                "forecast_days": 7,
-                "timezone": "Europe/Rome"
+        params = {
+            "latitude": lat,
+            "longitude": lng,
+            "daily": "weather_code,temperature_2m_max,temperature_2m_min,precipitation_sum",
+            "forecast_days": 7,
+            "timezone": "Europe/Rome"
+        }
+        data = await richiedi_open_meteo("previsioni", params)
+        if data is not None:
+            daily = data.get("daily", {})
+            
+            # Prepara previsioni giornaliere
+            previsioni_giornaliere = []
+            dates = daily.get("time", [])
+            temps_max = daily.get("temperature_2m_max", [])
+            temps_min = daily.get("temperature_2m_min", [])
+            precip = daily.get("precipitation_sum", [])
+            weather_codes = daily.get("weather_code", [])
+            
+            for i in range(min(7, len(dates))):
+                previsioni_giornaliere.append({
+                    "data": dates[i] if i < len(dates) else "",
+                    "temp_max": temps_max[i] if i < len(temps_max) else None,
+                    "temp_min": temps_min[i] if i < len(temps_min) else None,
+                    "precipitazioni": precip[i] if i < len(precip) else 0,
+                    "codice_meteo": weather_codes[i] if i < len(weather_codes) else 0
+                })
+            
+            # Analizza condizioni per alert
+            alert = None
+            consiglio = None
+            
+            # Controlla pioggia prevista (oggi e domani)
+            if len(precip) > 0 and precip[0] > 5:
+                alert = "Pioggia prevista"
+                consiglio = "Evitare trattamenti fitosanitari nei prossimi giorni"
+            elif len(precip) > 0 and precip[0] > 0:
+                alert = "Possibile pioggia"
+                consiglio = "Verificare condizioni meteo prima di trattamenti"
+            
+            # Controlla temperatura
+            if len(temps_max) > 0:
+                temp_max = temps_max[0]
+                if temp_max > 30:
+                    if not alert:
+                        alert = "Temperature elevate"
+                    consiglio = "Evitare trattamenti nelle ore più calde"
+            
+            return {
+                "temperatura": temps_max[0] if len(temps_max) > 0 else "N/A",
+                "precipitazioni": precip,
+                "alert": alert,
+                "consiglio": consiglio,
+                "previsioni": daily,
+                "previsioni_giornaliere": previsioni_giornaliere
             }
-            response = await client.get(url, params=params, timeout=5.0)
-            if response.status_code == 200:
-                data = response.json()
-                daily = data.get("daily", {})
-                
-                # Prepara previsioni giornaliere
-                previsioni_giornaliere = []
-                dates = daily.get("time", [])
-                temps_max = daily.get("temperature_2m_max", [])
-                temps_min = daily.get("temperature_2m_min", [])
-                precip = daily.get("precipitation_sum", [])
-                weather_codes = daily.get("weather_code", [])
-                
-                for i in range(min(7, len(dates))):
-                    previsioni_giornaliere.append({
-                        "data": dates[i] if i < len(dates) else "",
-                        "temp_max": temps_max[i] if i < len(temps_max) else None,
-                        "temp_min": temps_min[i] if i < len(temps_min) else None,
-                        "precipitazioni": precip[i] if i < len(precip) else 0,
-                        "codice_meteo": weather_codes[i] if i < len(weather_codes) else 0
-                    })
-                
-                # Analizza condizioni per alert
-                alert = None
-                consiglio = None
-                
-                # Controlla pioggia prevista (oggi e domani)
-                if len(precip) > 0 and precip[0] > 5:
-                    alert = "Pioggia prevista"
-                    consiglio = "Evitare trattamenti fitosanitari nei prossimi giorni"
-                elif len(precip) > 0 and precip[0] > 0:
-                    alert = "Possibile pioggia"
-                    consiglio = "Verificare condizioni meteo prima di trattamenti"
-                
-                # Controlla temperatura
-                if len(temps_max) > 0:
-                    temp_max = temps_max[0]
-                    if temp_max > 30:
-                        if not alert:
-                            alert = "Temperature elevate"
-                        consiglio = "Evitare trattamenti nelle ore più calde"
-                
-                return {
-                    "temperatura": temps_max[0] if len(temps_max) > 0 else "N/A",
-                    "precipitazioni": precip,
-                    "alert": alert,
-                    "consiglio": consiglio,
-                    "previsioni": daily,
-                    "previsioni_giornaliere": previsioni_giornaliere
-                }
     except Exception as e:
-        print(f"Errore meteo: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Errore meteo")
     
     # Fallback: restituisci sempre una struttura valida
     return {
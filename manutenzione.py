@@ -0,0 +1,282 @@
+"""
+Eliminazioni massive a blocchi (campi, trattamenti) per la manutenzione del database
+
+Le righe sono eliminate a blocchi di DIMENSIONE_BLOCCO, ognuno nella
+propria transazione: i lock restano brevi (le altre scritture, compresi
+i trigger di ricerca e sincronizzazione, non restano in attesa per tutta
+l'operazione) e un'interruzione non perde il lavoro già fatto. Per
+riprendere basta rilanciare lo stesso comando, che riparte dai trattamenti
+rimasti.
+
+Per ogni blocco vengono ricalcolati i soli contatori d'impiego toccati.
+Le giacenze non cambiano: il prodotto è stato usato davvero, quindi gli
+scarichi restano nel registro di magazzino, scollegati dal trattamento
+eliminato (come per l'archivio). Le eliminazioni a cascata
+(trattamenti di un campo, interventi di un mezzo) sono anche nel database,
+così nessuno script lascia righe orfane.
+
+Uso:
+    python manutenzione.py trattamenti --azienda 1 --prima-del 2019-01-01 --archivio vecchi.jsonl
+    python manutenzione.py campi --campo 12
+    python manutenzione.py campi --force          # tutti i campi e i trattamenti
+"""
+import json
+import os
+import time
+from datetime import date
+from typing import Callable, List, Optional
+
+from sqlalchemy import select, delete, text, inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from archivio import elimina_archivio_campo
+from limiti_dose import ricalcola_contatori_chiavi, elimina_contatori_campo
+from models import Campo, Trattamento
+
+DIMENSIONE_BLOCCO = 1000
+
+# Eliminazioni a cascata: (tabella figlia, colonna, tabella padre, azione ON DELETE)
+CASCATE = [
+    ("trattamenti", "campo_id", "campi", "CASCADE"),
+    ("contatori_trattamenti", "campo_id", "campi", "CASCADE"),
+    ("interventi_manutenzione", "mezzo_id", "mezzi", "CASCADE"),
+    ("trattamenti", "mezzo_id", "mezzi", "SET NULL"),
+    ("movimenti_magazzino", "trattamento_id", "trattamenti", "SET NULL"),
+]
+
+
+# ========== CASCATE NEL DATABASE ==========
+
+def _ddl_sqlite() -> List[str]:
+    """
+    Trigger BEFORE DELETE sulle tabelle padre
+
+    SQLite applica ON DELETE solo con PRAGMA foreign_keys attivo, e le
+    tabelle esistenti non si possono modificare con ALTER TABLE: i trigger
+    funzionano in ogni caso. Essendo BEFORE, i trigger di sincronizzazione
+    delle righe figlie trovano ancora il padre (e quindi l'azienda).
+    """
+    per_padre = {}
+    for figlia, colonna, padre, azione in CASCATE:
+        if azione == "CASCADE":
+            istruzione = f"DELETE FROM {figlia} WHERE {colonna} = OLD.id"
+        else:
+            istruzione = f"UPDATE {figlia} SET {colonna} = NULL WHERE {colonna} = OLD.id"
+        per_padre.setdefault(padre, []).append(istruzione)
+
+    ddl = []
+    for padre, istruzioni in per_padre.items():
+        ddl += [
+            f"DROP TRIGGER IF EXISTS cascata_{padre}_bd",
+            f"CREATE TRIGGER cascata_{padre}_bd BEFORE DELETE ON {padre} "
+            f"BEGIN {'; '.join(istruzioni)}; END",
+        ]
+    return ddl
+
+
+def _ddl_postgres(conn: Connection) -> List[str]:
+    """
+    Vincoli di chiave esterna ricreati con ON DELETE
+
+    NOT VALID evita di riscandire le tabelle esistenti: il vincolo vale
+    comunque per tutte le modifiche successive.
+    """
+    ispettore = inspect(conn)
+    ddl = []
+    for figlia, colonna, padre, azione in CASCATE:
+        vincoli = [
+            fk for fk in ispettore.get_foreign_keys(figlia)
+            if fk["constrained_columns"] == [colonna] and fk["referred_table"] == padre
+        ]
+        if any((fk.get("options") or {}).get("ondelete", "").upper() == azione for fk in vincoli):
+            continue
+        ddl += [f"ALTER TABLE {figlia} DROP CONSTRAINT {fk['name']}" for fk in vincoli]
+        ddl.append(
+            f"ALTER TABLE {figlia} ADD CONSTRAINT {figlia}_{colonna}_fkey "
+            f"FOREIGN KEY ({colonna}) REFERENCES {padre} (id) ON DELETE {azione} NOT VALID"
+        )
+    return ddl
+
+
+def inizializza_cascate(conn: Connection):
+    """Installa le eliminazioni a cascata (idempotente, eseguita dalle migrazioni)"""
+    postgres = conn.dialect.name == "postgresql"
+    for istruzione in (_ddl_postgres(conn) if postgres else _ddl_sqlite()):
+        conn.execute(text(istruzione))
+
+
+# ========== ELIMINAZIONE A BLOCCHI ==========
+
+def _filtro_trattamenti(azienda_id: Optional[int], campo_id: Optional[int], prima_del: Optional[date]) -> list:
+    filtro = []
+    if azienda_id is not None:
+        filtro.append(Trattamento.campo_id.in_(select(Campo.id).where(Campo.azienda_id == azienda_id)))
+    if campo_id is not None:
+        filtro.append(Trattamento.campo_id == campo_id)
+    if prima_del is not None:
+        filtro.append(Trattamento.data < prima_del)
+    return filtro
+
+
+def _archivia(db: Session, ids: List[int], archivio: str):
+    """Aggiunge i trattamenti del blocco al file NDJSON, su disco prima del commit dell'eliminazione"""
+    righe = db.execute(select(Trattamento.__table__).where(Trattamento.id.in_(ids))).mappings()
+    with open(archivio, "a", encoding="utf-8") as file:
+        for riga in righe:
+            file.write(json.dumps(dict(riga), default=str, ensure_ascii=False) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def elimina_trattamenti_a_blocchi(
+    db: Session,
+    azienda_id: Optional[int] = None,
+    campo_id: Optional[int] = None,
+    prima_del: Optional[date] = None,
+    dimensione_blocco: int = DIMENSIONE_BLOCCO,
+    progresso: Optional[Callable[[int, int], None]] = None,
+    archivio: Optional[str] = None,
+    pausa: float = 0,
+) -> dict:
+    """
+    Elimina i trattamenti filtrati un blocco alla volta, con un commit per blocco
+
+    Per ogni blocco: eventuale copia nell'archivio NDJSON, eliminazione e
+    ricalcolo dei contatori delle chiavi toccate. Gli scarichi di magazzino
+    restano, con trattamento_id a NULL (cascata nel database).
+    `progresso(eliminati, blocchi)` è chiamata dopo ogni commit; `pausa`
+    (secondi) lascia spazio alle altre scritture tra un blocco e l'altro.
+    Se interrotta, una nuova chiamata con gli stessi filtri riprende da dove
+    si era fermata (l'archivio può ripetere l'ultimo blocco non confermato).
+    """
+    filtro = _filtro_trattamenti(azienda_id, campo_id, prima_del)
+    report = {"eliminati": 0, "blocchi": 0}
+
+    while True:
+        blocco = db.execute(
+            select(Trattamento.id, Trattamento.campo_id, Trattamento.prodotto_id, Trattamento.data)
+            .where(*filtro)
+            .order_by(Trattamento.id)
+            .limit(dimensione_blocco)
+        ).all()
+        if not blocco:
+            break
+        ids = [riga.id for riga in blocco]
+
+        try:
+            if archivio:
+                _archivia(db, ids, archivio)
+            db.execute(
+                delete(Trattamento).where(Trattamento.id.in_(ids)).execution_options(synchronize_session=False)
+            )
+            ricalcola_contatori_chiavi(db, {(r.campo_id, r.prodotto_id, r.data.year) for r in blocco})
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        report["eliminati"] += len(ids)
+        report["blocchi"] += 1
+        if progresso:
+            progresso(report["eliminati"], report["blocchi"])
+        if len(blocco) < dimensione_blocco:
+            break
+        if pausa:
+            time.sleep(pausa)
+
+    return report
+
+
+def elimina_campi_a_blocchi(
+    db: Session,
+    azienda_id: Optional[int] = None,
+    campo_id: Optional[int] = None,
+    dimensione_blocco: int = DIMENSIONE_BLOCCO,
+    progresso: Optional[Callable[[int, int], None]] = None,
+    archivio: Optional[str] = None,
+    pausa: float = 0,
+) -> dict:
+    """
+    Elimina i campi filtrati: prima i loro trattamenti a blocchi, poi il campo
+
+    Il campo è eliminato solo quando non ha più trattamenti, in una
+    transazione breve; contatori, trattamenti archiviati e riepiloghi
+    sono eliminati con lui.
+    """
+    query = select(Campo.id).order_by(Campo.id)
+    if azienda_id is not None:
+        query = query.where(Campo.azienda_id == azienda_id)
+    if campo_id is not None:
+        query = query.where(Campo.id == campo_id)
+
+    report = {"campi": 0, "eliminati": 0, "blocchi": 0}
+    for id_campo in db.execute(query).scalars().all():
+        parziale = elimina_trattamenti_a_blocchi(
+            db, campo_id=id_campo, dimensione_blocco=dimensione_blocco,
+            progresso=progresso, archivio=archivio, pausa=pausa,
+        )
+        report["eliminati"] += parziale["eliminati"]
+        report["blocchi"] += parziale["blocchi"]
+        try:
+            elimina_contatori_campo(db, id_campo)
+            elimina_archivio_campo(db, id_campo)
+            db.execute(delete(Campo).where(Campo.id == id_campo).execution_options(synchronize_session=False))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        report["campi"] += 1
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from models import SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(description="Eliminazioni massive a blocchi, riprendibili")
+    parser.add_argument("oggetto", choices=["trattamenti", "campi"], help="Cosa eliminare")
+    parser.add_argument("--azienda", type=int, help="Solo un'azienda")
+    parser.add_argument("--campo", type=int, help="Solo un campo")
+    parser.add_argument("--prima-del", type=date.fromisoformat, help="Solo trattamenti precedenti (AAAA-MM-GG)")
+    parser.add_argument("--blocco", type=int, default=DIMENSIONE_BLOCCO, help="Righe per transazione")
+    parser.add_argument("--archivio", help="File NDJSON in cui copiare i trattamenti eliminati")
+    parser.add_argument("--pausa", type=float, default=0, help="Secondi di pausa tra i blocchi")
+    parser.add_argument("--force", action="store_true", help="Non chiedere conferma")
+    args = parser.parse_args()
+
+    if args.oggetto == "campi" and args.prima_del:
+        parser.error("--prima-del vale solo per i trattamenti")
+
+    if not args.force:
+        conferma = input(f"⚠️  ATTENZIONE: eliminazione di {args.oggetto} con i filtri indicati. Continuare? (s/n): ")
+        if conferma.lower() != 's':
+            print("❌ Operazione annullata")
+            exit(0)
+
+    init_db()
+    inizio = time.perf_counter()
+
+    def stampa_progresso(eliminati: int, blocchi: int):
+        print(f"  🗑️  {eliminati} trattamenti eliminati ({blocchi} blocchi, {time.perf_counter() - inizio:.1f}s)")
+
+    db = SessionLocal()
+    try:
+        if args.oggetto == "trattamenti":
+            report = elimina_trattamenti_a_blocchi(
+                db, args.azienda, args.campo, args.prima_del,
+                args.blocco, stampa_progresso, args.archivio, args.pausa,
+            )
+        else:
+            report = elimina_campi_a_blocchi(
+                db, args.azienda, args.campo, args.blocco, stampa_progresso, args.archivio, args.pausa,
+            )
+    except KeyboardInterrupt:
+        print("\n⏸️  Interrotto: i blocchi confermati restano eliminati, rilanciare per continuare")
+        raise SystemExit(1)
+    finally:
+        db.close()
+
+    if "campi" in report:
+        print(f"✅ Eliminati {report['campi']} campi")
+    print(f"✅ Eliminati {report['eliminati']} trattamenti in {report['blocchi']} blocchi")
@@ -0,0 +1,155 @@
+"""
+Metriche dell'applicazione in formato Prometheus (endpoint /metrics)
+
+Il middleware registra per ogni route (il percorso con i parametri, es.
+/api/campo/{campo_id}/elimina, così il numero di serie resta limitato):
+richieste per stato, istogramma delle durate e richieste in corso. Le
+altre metriche misurano le chiamate a Open-Meteo (durata ed esito della
+cache), la generazione del PDF del quaderno e l'analisi delle fatture.
+
+Con più worker (uvicorn --workers, gunicorn) ogni processo ha i propri
+contatori: impostando PROMETHEUS_MULTIPROC_DIR su una cartella vuota
+condivisa, i valori vengono scritti su file e /metrics li somma tutti.
+La cartella va svuotata a ogni riavvio del servizio.
+
+Lo stesso middleware conta le query SQL di ogni richiesta (eventi
+sull'engine in models.py): numero e tempo sul database arrivano al
+browser nell'header Server-Timing (visibile negli strumenti per
+sviluppatori, scheda Rete) e le richieste con più di SQL_MAX_QUERY query
+vengono segnalate nel log, per scoprire i problemi N+1.
+"""
+import logging
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+)
+
+from models import StatisticheSQL, statistiche_sql
+
+try:
+    from config import SQL_MAX_QUERY
+except ImportError:
+    SQL_MAX_QUERY = 50
+
+log_sql = logging.getLogger("agrinote.sql")
+
+MULTIPROCESSO = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Da pochi millisecondi (API, pagine) a decine di secondi (PDF, import)
+BUCKET_DURATA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+RICHIESTE = Counter(
+    "agrinote_http_requests_total", "Richieste HTTP completate", ["method", "route", "status"]
+)
+DURATA_RICHIESTE = Histogram(
+    "agrinote_http_request_duration_seconds", "Durata delle richieste HTTP (fino all'ultimo byte)",
+    ["method", "route"], buckets=BUCKET_DURATA,
+)
+IN_CORSO = Gauge(
+    "agrinote_http_requests_in_progress", "Richieste HTTP in corso", ["method"], multiprocess_mode="livesum"
+)
+QUERY_RICHIESTA = Histogram(
+    "agrinote_db_queries_per_request", "Query SQL eseguite per richiesta",
+    ["route"], buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+
+METEO_DURATA = Histogram(
+    "agrinote_meteo_request_duration_seconds", "Durata delle chiamate a Open-Meteo",
+    ["tipo", "esito"], buckets=BUCKET_DURATA,
+)
+METEO_CACHE = Counter(
+    "agrinote_meteo_cache_total", "Letture della cache meteo (hit / miss)", ["tipo", "esito"]
+)
+FRAMMENTI_CACHE = Counter(
+    "agrinote_frammenti_cache_total", "Frammenti di template serviti dalla cache (hit / miss)", ["frammento", "esito"]
+)
+PDF_DURATA = Histogram(
+    "agrinote_pdf_quaderno_duration_seconds", "Durata della generazione del PDF del quaderno",
+    buckets=BUCKET_DURATA,
+)
+FATTURA_DURATA = Histogram(
+    "agrinote_analisi_fattura_duration_seconds", "Durata dell'analisi di una fattura PDF",
+    buckets=BUCKET_DURATA,
+)
+
+
+def _route(scope) -> str:
+    """Percorso della route (FastAPI lo mette nello scope), non l'URL con gli id"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if scope["path"].startswith("/static/"):
+        return "/static"
+    return "sconosciuta"
+
+
+class MiddlewareMetriche:
+    """
+    Middleware ASGI per le metriche HTTP e le query SQL per richiesta
+
+    ASGI puro (non BaseHTTPMiddleware): non interferisce con le risposte in
+    streaming e la durata comprende l'invio dell'intero corpo.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metodo = scope["method"]
+        stato = [500]  # Se l'app solleva un'eccezione prima di rispondere
+        inizio = time.perf_counter()
+        sql = StatisticheSQL(route=lambda: _route(scope))
+        token = statistiche_sql.set(sql)
+
+        async def invia(messaggio):
+            if messaggio["type"] == "http.response.start":
+                stato[0] = messaggio["status"]
+                # Tempi fino all'invio delle intestazioni (per lo streaming, il corpo segue)
+                server_timing = (
+                    f'db;desc="{sql.query} query";dur={sql.secondi * 1000:.1f}, '
+                    f"app;dur={(time.perf_counter() - inizio) * 1000:.1f}"
+                )
+                messaggio["headers"] = list(messaggio.get("headers", [])) + [
+                    (b"server-timing", server_timing.encode("latin-1"))
+                ]
+            await send(messaggio)
+
+        IN_CORSO.labels(metodo).inc()
+        try:
+            await self.app(scope, receive, invia)
+        finally:
+            statistiche_sql.reset(token)
+            IN_CORSO.labels(metodo).dec()
+            route = _route(scope)
+            DURATA_RICHIESTE.labels(metodo, route).observe(time.perf_counter() - inizio)
+            RICHIESTE.labels(metodo, route, str(stato[0])).inc()
+            QUERY_RICHIESTA.labels(route).observe(sql.query)
+            if sql.query > SQL_MAX_QUERY:
+                log_sql.warning(
+                    "%s %s: %d query (%.1f ms sul database), possibile N+1",
+                    metodo, route, sql.query, sql.secondi * 1000,
+                )
+
+
+def chiudi_processo():
+    """Da chiamare alla chiusura del worker: toglie le sue richieste in corso dalla somma"""
+    if MULTIPROCESSO:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def esporta_metriche():
+    """(corpo, content type) per /metrics, sommando i worker in modalità multiprocesso"""
+    if MULTIPROCESSO:
+        from prometheus_client import multiprocess
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+    else:
+        registro = REGISTRY
+    return generate_latest(registro), CONTENT_TYPE_LATEST
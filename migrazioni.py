@@ -0,0 +1,369 @@
+"""
+Migrazioni dello schema con versione
+
+La versione applicata è registrata nella tabella schema_versione (una riga
+per migrazione). All'avvio basta leggere l'ultima riga per sapere se lo
+schema è aggiornato, senza ispezionare le tabelle.
+
+Le migrazioni in sospeso sono applicate in ordine in un'unica transazione
+(su SQLite e PostgreSQL anche il DDL è transazionale: o tutte o nessuna).
+Gli indici su tabelle esistenti sono creati dopo, fuori dalla transazione:
+su PostgreSQL con CREATE INDEX CONCURRENTLY, senza bloccare le scritture.
+
+Per aggiungere una migrazione: scrivere una funzione che riceve la
+connessione e appenderla a MIGRAZIONI con il numero di versione successivo.
+Non modificare le migrazioni già rilasciate.
+
+Uso:
+    python migrazioni.py            # applica le migrazioni in sospeso
+    python migrazioni.py --stato    # mostra la versione del database
+"""
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import Boolean, Column, DateTime, Integer, MetaData, String, Table, cast, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+metadata_versioni = MetaData()
+schema_versione = Table(
+    "schema_versione",
+    metadata_versioni,
+    Column("versione", Integer, primary_key=True),
+    Column("descrizione", String, nullable=False),
+    Column("applicata_il", DateTime, nullable=False),
+    Column("indici_creati", Boolean, nullable=False, default=False),
+)
+
+
+class Indice(NamedTuple):
+    nome: str
+    tabella: str
+    colonne: Tuple[str, ...]
+    unico: bool = False
+
+
+class Migrazione(NamedTuple):
+    versione: int
+    descrizione: str
+    applica: Optional[Callable[[Connection], None]] = None
+    indici: Tuple[Indice, ...] = ()
+
+
+# ========== UTILITÀ PER LE MIGRAZIONI ==========
+
+def aggiungi_colonne(conn: Connection, tabella: str, colonne: List[Tuple[str, str]]):
+    """ALTER TABLE ADD COLUMN per le sole colonne mancanti (una lettura dello schema per tabella)"""
+    esistenti = {c["name"] for c in inspect(conn).get_columns(tabella)}
+    for nome, tipo in colonne:
+        if nome not in esistenti:
+            conn.execute(text(f"ALTER TABLE {tabella} ADD COLUMN {nome} {tipo}"))
+            print(f"  ✅ {tabella}.{nome}")
+
+
+def crea_tabelle(conn: Connection, *nomi: str):
+    """Crea le tabelle dei modelli indicati se mancano"""
+    from models import Base
+    Base.metadata.create_all(conn, tables=[Base.metadata.tables[n] for n in nomi])
+
+
+def ricrea_tabella_sqlite(conn: Connection, tabella: str):
+    """
+    Ricrea una tabella SQLite con la definizione attuale del modello
+
+    SQLite non modifica con ALTER TABLE vincoli e chiave primaria: la
+    tabella nuova riceve le righe, prende il posto della vecchia e ne
+    ritrova indici e trigger. Le righe sono copiate tutte in una volta.
+    """
+    from sqlalchemy.schema import CreateTable
+    from models import Base
+
+    modello = Base.metadata.tables[tabella]
+    nuova = f"{tabella}_nuova"
+    ddl = str(CreateTable(modello).compile(dialect=conn.dialect)).replace(
+        f"CREATE TABLE {tabella} ", f"CREATE TABLE {nuova} ", 1
+    )
+    dipendenti = conn.execute(text(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = :tabella AND type IN ('index', 'trigger') AND sql IS NOT NULL"
+    ), {"tabella": tabella}).scalars().all()
+    colonne = ", ".join(c.name for c in modello.columns)
+
+    conn.exec_driver_sql(ddl)
+    conn.exec_driver_sql(f"INSERT INTO {nuova} ({colonne}) SELECT {colonne} FROM {tabella}")
+    conn.exec_driver_sql(f"DROP TABLE {tabella}")
+    # I trigger di altre tabelle citano la vecchia tabella: senza modalità legacy il RENAME li rifiuta
+    conn.exec_driver_sql("PRAGMA legacy_alter_table = ON")
+    conn.exec_driver_sql(f"ALTER TABLE {nuova} RENAME TO {tabella}")
+    conn.exec_driver_sql("PRAGMA legacy_alter_table = OFF")
+    for istruzione in dipendenti:
+        conn.exec_driver_sql(istruzione)
+
+
+# ========== MIGRAZIONI ==========
+
+def _v1_mezzi_campi(conn: Connection):
+    aggiungi_colonne(conn, "mezzi", [
+        ("tipo_mezzo", "VARCHAR"), ("marca", "VARCHAR"), ("modello", "VARCHAR"), ("anno_acquisto", "INTEGER"),
+    ])
+    aggiungi_colonne(conn, "campi", [("centro_lat", "FLOAT"), ("centro_lng", "FLOAT")])
+    crea_tabelle(conn, "interventi_manutenzione")
+
+
+def _v2_quaderno(conn: Connection):
+    aggiungi_colonne(conn, "aziende", [
+        ("codice_fiscale", "VARCHAR"), ("comune", "VARCHAR"), ("provincia", "VARCHAR"), ("cap", "VARCHAR"),
+        ("telefono", "VARCHAR"), ("email", "VARCHAR"), ("numero_registro_imprese", "VARCHAR"),
+    ])
+    aggiungi_colonne(conn, "trattamenti", [
+        ("mezzo_id", "INTEGER"), ("condizioni_meteo", "VARCHAR"), ("temperatura", "REAL"), ("umidita", "REAL"),
+        ("velocita_vento", "REAL"), ("note", "TEXT"), ("numero_lotto", "VARCHAR"),
+    ])
+
+
+def _v3_magazzino_limiti(conn: Connection):
+    from registro_magazzino import inizializza_giacenze
+    crea_tabelle(conn, "movimenti_magazzino", "limiti_prodotti", "contatori_trattamenti")
+    # Saldi inseriti a mano prima del registro: diventano la giacenza iniziale
+    inizializza_giacenze(conn)
+
+
+def _v4_ricerca(conn: Connection):
+    from ricerca import inizializza_ricerca
+    inizializza_ricerca(conn)
+
+
+def _v5_sync(conn: Connection):
+    from sync import inizializza_sync
+    for tabella in ("campi", "prodotti", "mezzi", "trattamenti", "interventi_manutenzione"):
+        aggiungi_colonne(conn, tabella, [("revisione", "INTEGER NOT NULL DEFAULT 0")])
+    for tabella in ("trattamenti", "interventi_manutenzione"):
+        aggiungi_colonne(conn, tabella, [("id_client", "VARCHAR")])
+    crea_tabelle(conn, "sync_stato", "sync_eliminazioni")
+    inizializza_sync(conn)
+
+
+def _v6_cascate(conn: Connection):
+    from manutenzione import inizializza_cascate
+    inizializza_cascate(conn)
+
+
+def _v7_archivio(conn: Connection):
+    crea_tabelle(conn, "trattamenti_archivio", "riepiloghi_archivio", "stagioni_archiviate")
+
+
+def _v9_id_trattamenti(conn: Connection):
+    aggiungi_colonne(conn, "trattamenti_archivio", [("id_client", "VARCHAR")])
+    if conn.dialect.name == "postgresql":
+        return  # Le sequenze SERIAL non riassegnano gli id
+
+    definizione = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'trattamenti'")).scalar()
+    if "AUTOINCREMENT" not in definizione.upper():
+        ricrea_tabella_sqlite(conn, "trattamenti")
+
+    ultimo_id = text(
+        "SELECT max(coalesce((SELECT max(id) FROM trattamenti), 0), coalesce((SELECT max(id) FROM trattamenti_archivio), 0))"
+    )
+    # Id dell'archivio già riassegnati a trattamenti vivi: l'archiviato prende un id nuovo (nessuno lo riferisce)
+    massimo = conn.execute(ultimo_id).scalar()
+    conn.execute(text(
+        "UPDATE trattamenti_archivio SET id = id + :massimo WHERE id IN (SELECT id FROM trattamenti)"
+    ), {"massimo": massimo})
+
+    # I prossimi trattamenti partono dopo tutti gli id usati, archivio compreso
+    ultimo = conn.execute(ultimo_id).scalar()
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'trattamenti'"))
+    conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('trattamenti', :ultimo)"), {"ultimo": ultimo})
+
+
+def _v10_revisioni_aziende(conn: Connection):
+    from sync import inizializza_sync
+    inizializza_sync(conn)
+
+
+MIGRAZIONI = [
+    Migrazione(1, "Dettagli mezzi, centro campi, interventi di manutenzione", _v1_mezzi_campi),
+    Migrazione(2, "Campi del quaderno di campagna completo", _v2_quaderno),
+    Migrazione(3, "Registro magazzino e limiti d'impiego", _v3_magazzino_limiti, (
+        Indice("ix_trattamenti_campo_data", "trattamenti", ("campo_id", "data")),
+        Indice("ix_trattamenti_prodotto_id", "trattamenti", ("prodotto_id",)),
+    )),
+    Migrazione(4, "Ricerca full-text e richiamo lotti", _v4_ricerca, (
+        Indice("ix_trattamenti_numero_lotto", "trattamenti", ("numero_lotto",)),
+    )),
+    Migrazione(5, "Sincronizzazione dispositivi offline", _v5_sync, tuple(
+        Indice(f"ix_{t}_revisione", t, ("revisione",))
+        for t in ("campi", "prodotti", "mezzi", "trattamenti", "interventi_manutenzione")
+    ) + (
+        Indice("ix_trattamenti_id_client", "trattamenti", ("id_client",), unico=True),
+        Indice("ix_interventi_manutenzione_id_client", "interventi_manutenzione", ("id_client",), unico=True),
+    )),
+    Migrazione(6, "Eliminazioni a cascata nel database", _v6_cascate, (
+        Indice("ix_trattamenti_mezzo_id", "trattamenti", ("mezzo_id",)),
+        Indice("ix_interventi_manutenzione_mezzo_id", "interventi_manutenzione", ("mezzo_id",)),
+    )),
+    Migrazione(7, "Archivio delle stagioni chiuse", _v7_archivio),
+    Migrazione(8, "Richiamo lotti senza distinzione maiuscole/minuscole", None, (
+        Indice("ix_trattamenti_lotto_minuscolo", "trattamenti", ("lower(numero_lotto)",)),
+        Indice("ix_trattamenti_archivio_lotto_minuscolo", "trattamenti_archivio", ("lower(numero_lotto)",)),
+    )),
+    Migrazione(9, "Id dei trattamenti non riassegnati dopo l'archiviazione", _v9_id_trattamenti, (
+        Indice("ix_trattamenti_archivio_id_client", "trattamenti_archivio", ("id_client",)),
+    )),
+    Migrazione(10, "Revisione dei dati per azienda", _v10_revisioni_aziende),
+]
+ULTIMA_VERSIONE = MIGRAZIONI[-1].versione
+CHIAVE_LOCK = 7414520  # Chiave dell'advisory lock PostgreSQL delle migrazioni
+
+
+# ========== ESECUZIONE ==========
+
+def versione_corrente(engine: Engine) -> Tuple[Optional[int], bool]:
+    """
+    (ultima versione, indici completati) con una sola query di aggregazione
+
+    Gli indici sono completati solo se lo sono per tutte le versioni: una
+    migrazione precedente con indici_creati falso (creazione interrotta)
+    conta anche se l'ultima riga è a posto. Il minimo del booleano
+    convertito in intero vale su SQLite e PostgreSQL. Restituisce
+    (None, False) se la tabella delle versioni non esiste, (0, True) se è
+    vuota.
+    """
+    try:
+        with engine.connect() as conn:
+            versione, indici_creati = conn.execute(
+                select(
+                    func.max(schema_versione.c.versione),
+                    func.min(cast(schema_versione.c.indici_creati, Integer)),
+                )
+            ).one()
+    except (OperationalError, ProgrammingError):
+        return None, False
+    if versione is None:
+        return 0, True
+    return versione, bool(indici_creati)
+
+
+def _crea_indice(engine: Engine, indice: Indice):
+    """CREATE INDEX fuori transazione (CONCURRENTLY su PostgreSQL)"""
+    unico = "UNIQUE " if indice.unico else ""
+    colonne = ", ".join(indice.colonne)
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            # Un CONCURRENTLY interrotto lascia un indice non valido: va ricreato
+            valido = conn.execute(text(
+                "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :nome"
+            ), {"nome": indice.nome}).scalar()
+            if valido is False:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {indice.nome}"))
+            conn.execute(text(
+                f"CREATE {unico}INDEX CONCURRENTLY IF NOT EXISTS {indice.nome} ON {indice.tabella} ({colonne})"
+            ))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE {unico}INDEX IF NOT EXISTS {indice.nome} ON {indice.tabella} ({colonne})"))
+
+
+def _blocca_migrazioni(conn: Connection):
+    """
+    Apre la transazione delle migrazioni con un lock esclusivo
+
+    Con più worker all'avvio uno solo applica le migrazioni; gli altri
+    attendono e poi trovano lo schema aggiornato. Su SQLite il BEGIN
+    esplicito serve anche a includere il DDL nella transazione (il driver
+    lo eseguirebbe altrimenti in autocommit).
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:chiave)"), {"chiave": CHIAVE_LOCK})
+    else:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def aggiorna_schema(engine: Engine) -> int:
+    """
+    Applica le migrazioni in sospeso e restituisce il numero di migrazioni applicate
+
+    Su un database vuoto crea lo schema completo dai modelli; su un
+    database precedente alle versioni (creato con migrate_db.py) applica
+    tutte le migrazioni, che saltano le colonne già presenti.
+    """
+    from models import Base
+
+    with engine.begin() as conn:
+        _blocca_migrazioni(conn)
+        metadata_versioni.create_all(conn)
+        applicata = conn.execute(select(schema_versione.c.versione).order_by(schema_versione.c.versione.desc())).scalar() or 0
+        in_sospeso = [m for m in MIGRAZIONI if m.versione > applicata]
+
+        if in_sospeso:
+            if applicata == 0:
+                # Tabelle mancanti create dai modelli (tutte, su un database vuoto)
+                Base.metadata.create_all(conn)
+            for migrazione in in_sospeso:
+                print(f"🔄 Migrazione {migrazione.versione}: {migrazione.descrizione}")
+                if migrazione.applica:
+                    migrazione.applica(conn)
+                conn.execute(schema_versione.insert().values(
+                    versione=migrazione.versione,
+                    descrizione=migrazione.descrizione,
+                    applicata_il=datetime.utcnow(),
+                    indici_creati=not migrazione.indici,
+                ))
+
+        da_indicizzare = set(conn.execute(
+            select(schema_versione.c.versione).where(schema_versione.c.indici_creati.is_(False))
+        ).scalars())
+
+    # Indici dopo il commit: la transazione DDL resta breve e le tabelle grandi non restano bloccate
+    for migrazione in MIGRAZIONI:
+        if migrazione.versione not in da_indicizzare:
+            continue
+        for indice in migrazione.indici:
+            print(f"  📇 Indice {indice.nome}")
+            _crea_indice(engine, indice)
+        with engine.begin() as conn:
+            conn.execute(
+                schema_versione.update()
+                .where(schema_versione.c.versione == migrazione.versione)
+                .values(indici_creati=True)
+            )
+
+    return len(in_sospeso)
+
+
+def verifica_schema(engine: Engine, applica: bool = True):
+    """
+    Controllo all'avvio: una query sulla versione, migrazioni solo se servono
+
+    Con `applica` False (database grandi in produzione) lo schema non
+    aggiornato blocca l'avvio invece di migrare durante il deploy.
+    """
+    versione, indici_creati = versione_corrente(engine)
+    if versione == ULTIMA_VERSIONE and indici_creati:
+        return
+    if not applica:
+        raise RuntimeError(
+            f"Schema database alla versione {versione or 0}, richiesta {ULTIMA_VERSIONE}: "
+            f"eseguire python migrazioni.py"
+        )
+    aggiorna_schema(engine)
+
+
+if __name__ == "__main__":
+    import argparse
+    from models import engine
+
+    parser = argparse.ArgumentParser(description="Migrazioni dello schema del database")
+    parser.add_argument("--stato", action="store_true", help="Mostra la versione senza migrare")
+    args = parser.parse_args()
+
+    versione, indici_creati = versione_corrente(engine)
+    print(f"📋 Versione schema: {versione or 0} (ultima disponibile: {ULTIMA_VERSIONE})")
+    if versione and not indici_creati:
+        print("⚠️  Indici dell'ultima migrazione non completati")
+
+    if not args.stato:
+        numero = aggiorna_schema(engine)
+        if numero:
+            print(f"\n🎉 Applicate {numero} migrazioni, schema alla versione {ULTIMA_VERSIONE}")
+        else:
+            print("\n✅ Schema già aggiornato")
@@ -1,12 +1,16 @@
 """
 Modelli SQLAlchemy per AgriNote
-Database: SQLite
+Database: SQLite (default) o PostgreSQL tramite DATABASE_URL
 """
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, ForeignKey, Enum, JSON, Text
+from sqlalchemy import create_engine, event, Boolean, Column, Integer, String, Float, Date, DateTime, ForeignKey, Enum, JSON, Text, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 from enum import Enum as PyEnum
-from datetime import date
+from datetime import date, datetime
+from contextvars import ContextVar
+from typing import Optional
+import logging
+import time
 
 Base = declarative_base()
 
@@ -16,6 +20,12 @@ class TipoProdotto(PyEnum):
     CONCIME = "Concime"
 
 
+class TipoMovimento(PyEnum):
+    CARICO = "Carico"  # Carico da fattura / acquisto
+    TRATTAMENTO = "Trattamento"  # Scarico per trattamento registrato
+    RETTIFICA = "Rettifica"  # Rettifica manuale (inventario, giacenza iniziale)
+
+
 class User(Base):
     __tablename__ = "users"
     
@@ -62,10 +72,11 @@ class Campo(Base):
     centro_lat = Column(Float, nullable=True)  # Latitudine centro campo
     centro_lng = Column(Float, nullable=True)  # Longitudine centro campo
     coltura_attuale = Column(String, nullable=True)
+    revisione = Column(Integer, nullable=False, default=0, server_default="0", index=True)  # Revisione di sincronizzazione (assegnata da trigger)
     
     # Relazioni
     azienda = relationship("Azienda", back_populates="campi")
-    trattamenti = relationship("Trattamento", back_populates="campo", cascade="all, delete-orphan")
+    trattamenti = relationship("Trattamento", back_populates="campo", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Prodotto(Base):
@@ -75,12 +86,64 @@ class Prodotto(Base):
     azienda_id = Column(Integer, ForeignKey("aziende.id"), nullable=False)
     nome_commerciale = Column(String, nullable=False)
     tipo = Column(Enum(TipoProdotto), nullable=False)
-    quantita_disponibile = Column(Float, nullable=False)
+    quantita_disponibile = Column(Float, nullable=False)  # Saldo corrente, aggiornato a ogni movimento
     unita_misura = Column(String, nullable=False)  # "kg" o "L"
+    revisione = Column(Integer, nullable=False, default=0, server_default="0", index=True)  # Revisione di sincronizzazione (assegnata da trigger)
     
     # Relazioni
     azienda = relationship("Azienda", back_populates="prodotti")
     trattamenti = relationship("Trattamento", back_populates="prodotto")
+    movimenti = relationship("MovimentoMagazzino", back_populates="prodotto", cascade="all, delete-orphan")
+    limite = relationship("LimiteProdotto", back_populates="prodotto", uselist=False, cascade="all, delete-orphan")
+
+
+class LimiteProdotto(Base):
+    """Limiti d'impiego da etichetta per un fitofarmaco (valori nulli = nessun limite)"""
+    __tablename__ = "limiti_prodotti"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    prodotto_id = Column(Integer, ForeignKey("prodotti.id"), nullable=False, unique=True)
+    dose_max_ettaro = Column(Float, nullable=True)  # Dose massima per singola applicazione (per ettaro)
+    dose_max_ettaro_anno = Column(Float, nullable=True)  # Dose cumulata massima per ettaro nell'anno
+    max_applicazioni_anno = Column(Integer, nullable=True)  # Numero massimo di applicazioni per campo nell'anno
+    intervallo_minimo_giorni = Column(Integer, nullable=True)  # Giorni minimi tra due applicazioni sullo stesso campo
+    
+    # Relazioni
+    prodotto = relationship("Prodotto", back_populates="limite")
+
+
+class ContatoreTrattamenti(Base):
+    """Totali progressivi per (campo, prodotto, anno), aggiornati a ogni trattamento"""
+    __tablename__ = "contatori_trattamenti"
+    __table_args__ = (
+        UniqueConstraint("campo_id", "prodotto_id", "anno", name="uq_contatori_campo_prodotto_anno"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    campo_id = Column(Integer, ForeignKey("campi.id", ondelete="CASCADE"), nullable=False)
+    prodotto_id = Column(Integer, ForeignKey("prodotti.id"), nullable=False)
+    anno = Column(Integer, nullable=False)
+    applicazioni = Column(Integer, nullable=False, default=0)
+    dose_ettaro = Column(Float, nullable=False, default=0.0)  # Somma delle dosi per ettaro
+    quantita_totale = Column(Float, nullable=False, default=0.0)
+    ultima_data = Column(Date, nullable=True)
+
+
+class MovimentoMagazzino(Base):
+    __tablename__ = "movimenti_magazzino"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    prodotto_id = Column(Integer, ForeignKey("prodotti.id"), nullable=False, index=True)
+    data = Column(Date, nullable=False)
+    tipo = Column(Enum(TipoMovimento), nullable=False)
+    quantita = Column(Float, nullable=False)  # Positiva per i carichi, negativa per gli scarichi
+    trattamento_id = Column(Integer, ForeignKey("trattamenti.id", ondelete="SET NULL"), nullable=True, index=True)
+    riferimento = Column(String, nullable=True)  # Es: numero o file fattura
+    note = Column(Text, nullable=True)
+    creato_il = Column(DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Relazioni
+    prodotto = relationship("Prodotto", back_populates="movimenti")
 
 
 class Mezzo(Base):
@@ -96,17 +159,18 @@ class Mezzo(Base):
     marca = Column(String, nullable=True)
     modello = Column(String, nullable=True)
     anno_acquisto = Column(Integer, nullable=True)
+    revisione = Column(Integer, nullable=False, default=0, server_default="0", index=True)  # Revisione di sincronizzazione (assegnata da trigger)
     
     # Relazioni
     azienda = relationship("Azienda", back_populates="mezzi")
-    interventi = relationship("InterventoManutenzione", back_populates="mezzo", cascade="all, delete-orphan")
+    interventi = relationship("InterventoManutenzione", back_populates="mezzo", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class InterventoManutenzione(Base):
     __tablename__ = "interventi_manutenzione"
     
     id = Column(Integer, primary_key=True, index=True)
-    mezzo_id = Column(Integer, ForeignKey("mezzi.id"), nullable=False)
+    mezzo_id = Column(Integer, ForeignKey("mezzi.id", ondelete="CASCADE"), nullable=False, index=True)
     data_intervento = Column(Date, nullable=False)
     tipo_intervento = Column(String, nullable=False)  # Es: "Revisione", "Tagliando", "Riparazione"
     descrizione = Column(Text, nullable=True)
@@ -114,6 +178,8 @@ class InterventoManutenzione(Base):
     officina = Column(String, nullable=True)
     prossima_scadenza = Column(Date, nullable=True)
     note = Column(Text, nullable=True)
+    revisione = Column(Integer, nullable=False, default=0, server_default="0", index=True)  # Revisione di sincronizzazione (assegnata da trigger)
+    id_client = Column(String, nullable=True, unique=True, index=True)  # UUID assegnato dal dispositivo offline che ha creato il record
     
     # Relazioni
     mezzo = relationship("Mezzo", back_populates="interventi")
@@ -121,22 +187,30 @@ class InterventoManutenzione(Base):
 
 class Trattamento(Base):
     __tablename__ = "trattamenti"
+    __table_args__ = (
+        # Report e quaderno filtrano per campo e intervallo di date
+        Index("ix_trattamenti_campo_data", "campo_id", "data"),
+        # Su SQLite gli id dei trattamenti archiviati non vengono riassegnati
+        {"sqlite_autoincrement": True},
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    campo_id = Column(Integer, ForeignKey("campi.id"), nullable=False)
+    campo_id = Column(Integer, ForeignKey("campi.id", ondelete="CASCADE"), nullable=False)
     data = Column(Date, nullable=False)
-    prodotto_id = Column(Integer, ForeignKey("prodotti.id"), nullable=False)
+    prodotto_id = Column(Integer, ForeignKey("prodotti.id"), nullable=False, index=True)
     avversita = Column(String, nullable=True)  # Avversità o obiettivo trattamento
     quantita_per_ettaro = Column(Float, nullable=False)
     quantita_totale = Column(Float, nullable=False)  # Calcolata: dose * ettari
     operatore = Column(String, nullable=True)  # Nome operatore
-    mezzo_id = Column(Integer, ForeignKey("mezzi.id"), nullable=True)  # Mezzo utilizzato
+    mezzo_id = Column(Integer, ForeignKey("mezzi.id", ondelete="SET NULL"), nullable=True, index=True)  # Mezzo utilizzato
     condizioni_meteo = Column(String, nullable=True)  # Condizioni meteo durante trattamento
     temperatura = Column(Float, nullable=True)  # Temperatura (°C)
     umidita = Column(Float, nullable=True)  # Umidità relativa (%)
     velocita_vento = Column(Float, nullable=True)  # Velocità vento (km/h)
     note = Column(Text, nullable=True)  # Note aggiuntive
-    numero_lotto = Column(String, nullable=True)  # Numero lotto prodotto (se disponibile)
+    numero_lotto = Column(String, nullable=True, index=True)  # Numero lotto prodotto (se disponibile)
+    revisione = Column(Integer, nullable=False, default=0, server_default="0", index=True)  # Revisione di sincronizzazione (assegnata da trigger)
+    id_client = Column(String, nullable=True, unique=True, index=True)  # UUID assegnato dal dispositivo offline che ha creato il record
     
     # Relazioni
     campo = relationship("Campo", back_populates="trattamenti")
@@ -144,15 +218,177 @@ class Trattamento(Base):
     mezzo = relationship("Mezzo")
 
 
+class TrattamentoArchiviato(Base):
+    """
+    Trattamento di una stagione chiusa, spostato dalla tabella trattamenti
+
+    Stesse colonne e stesso id del trattamento originale, id_client
+    compreso (i caricamenti ripetuti dei dispositivi restano deduplicati).
+    Senza chiavi esterne né trigger: è un archivio a sola lettura.
+    """
+    __tablename__ = "trattamenti_archivio"
+    __table_args__ = (
+        Index("ix_trattamenti_archivio_campo_data", "campo_id", "data"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    campo_id = Column(Integer, nullable=False)
+    data = Column(Date, nullable=False)
+    prodotto_id = Column(Integer, nullable=False)
+    avversita = Column(String, nullable=True)
+    quantita_per_ettaro = Column(Float, nullable=False)
+    quantita_totale = Column(Float, nullable=False)
+    operatore = Column(String, nullable=True)
+    mezzo_id = Column(Integer, nullable=True)
+    condizioni_meteo = Column(String, nullable=True)
+    temperatura = Column(Float, nullable=True)
+    umidita = Column(Float, nullable=True)
+    velocita_vento = Column(Float, nullable=True)
+    note = Column(Text, nullable=True)
+    numero_lotto = Column(String, nullable=True, index=True)
+    id_client = Column(String, nullable=True, index=True)
+    archiviato_il = Column(DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Relazioni (sola lettura, per il PDF del quaderno)
+    campo = relationship("Campo", primaryjoin="foreign(TrattamentoArchiviato.campo_id) == Campo.id", viewonly=True)
+    prodotto = relationship("Prodotto", primaryjoin="foreign(TrattamentoArchiviato.prodotto_id) == Prodotto.id", viewonly=True)
+    mezzo = relationship("Mezzo", primaryjoin="foreign(TrattamentoArchiviato.mezzo_id) == Mezzo.id", viewonly=True)
+
+
+class RiepilogoArchivio(Base):
+    """Riepilogo dei trattamenti archiviati per (campo, prodotto, anno), per i report"""
+    __tablename__ = "riepiloghi_archivio"
+    __table_args__ = (
+        UniqueConstraint("campo_id", "prodotto_id", "anno", name="uq_riepilogo_archivio"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    campo_id = Column(Integer, nullable=False)
+    prodotto_id = Column(Integer, nullable=False)
+    anno = Column(Integer, nullable=False, index=True)
+    applicazioni = Column(Integer, nullable=False, default=0)
+    quantita_totale = Column(Float, nullable=False, default=0.0)
+    dose_min = Column(Float, nullable=True)
+    dose_max = Column(Float, nullable=True)
+    ultima_data = Column(Date, nullable=True)
+
+
+class StagioneArchiviata(Base):
+    """Anno spostato (o in corso di spostamento) nell'archivio"""
+    __tablename__ = "stagioni_archiviate"
+    
+    anno = Column(Integer, primary_key=True)
+    completata = Column(Boolean, nullable=False, default=False)
+    trattamenti = Column(Integer, nullable=False, default=0)
+    archiviata_il = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class StatoSync(Base):
+    """Contatore globale delle revisioni di sincronizzazione (una sola riga)"""
+    __tablename__ = "sync_stato"
+    
+    id = Column(Integer, primary_key=True)
+    revisione = Column(Integer, nullable=False, default=0)
+
+
+class RevisioneAzienda(Base):
+    """Ultima revisione di sincronizzazione dei dati di un'azienda (aggiornata dai trigger)"""
+    __tablename__ = "sync_revisioni_aziende"
+    
+    azienda_id = Column(Integer, primary_key=True, autoincrement=False)
+    revisione = Column(Integer, nullable=False, default=0)
+
+
+class EliminazioneSync(Base):
+    """Record eliminato, per comunicare l'eliminazione ai dispositivi offline"""
+    __tablename__ = "sync_eliminazioni"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    tabella = Column(String, nullable=False)
+    riga_id = Column(Integer, nullable=False)
+    azienda_id = Column(Integer, nullable=True, index=True)
+    revisione = Column(Integer, nullable=False, index=True)
+
+
 # Setup database
-DATABASE_URL = "sqlite:///./agrinote.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+try:
+    from config import DATABASE_URL, SQL_LENTA_MS
+except ImportError:
+    DATABASE_URL = "sqlite:///./agrinote.db"
+    SQL_LENTA_MS = 200
+
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+if DATABASE_URL.startswith("sqlite"):
+    @event.listens_for(engine, "connect")
+    def _imposta_sqlite(connessione, _record):
+        # WAL: letture (e backup, vedi backup.py) senza bloccare le scritture
+        connessione.execute("PRAGMA journal_mode=WAL")
+
+
+# ========== STATISTICHE SQL PER RICHIESTA ==========
+
+class StatisticheSQL:
+    """Query e tempo sul database di una richiesta (impostate dal middleware in metriche.py)"""
+    __slots__ = ("query", "secondi", "route")
+    
+    def __init__(self, route=None):
+        self.query = 0
+        self.secondi = 0.0
+        self.route = route  # Funzione che restituisce la route, nota solo dopo il routing
+
+
+# Oggetto della richiesta in corso: il contesto viene copiato nei thread degli endpoint sincroni
+statistiche_sql: ContextVar[Optional[StatisticheSQL]] = ContextVar("statistiche_sql", default=None)
+log_sql = logging.getLogger("agrinote.sql")
+
+
+def _forma_parametri(parametri, executemany: bool) -> str:
+    """Forma dei parametri per il log (nomi e numero di righe, mai i valori)"""
+    if executemany:
+        return f"{len(parametri)} righe x {_forma_parametri(parametri[0], False) if parametri else '()'}"
+    if isinstance(parametri, dict):
+        return "{" + ", ".join(parametri) + "}"
+    return f"({len(parametri or ())} parametri)"
+
+
+# L'inizio è salvato nel contesto dell'esecuzione, che dura una sola istruzione:
+# un'istruzione che fallisce (senza after_cursor_execute) non lascia nulla sulla connessione
+@event.listens_for(engine, "before_cursor_execute")
+def _inizio_query(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._inizio_query = time.perf_counter()
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _fine_query(conn, cursor, statement, parameters, context, executemany):
+    inizio = getattr(context, "_inizio_query", None)
+    if inizio is None:
+        return
+    durata = time.perf_counter() - inizio
+    statistiche = statistiche_sql.get()
+    if statistiche is not None:
+        statistiche.query += 1
+        statistiche.secondi += durata
+    if durata * 1000 >= SQL_LENTA_MS:
+        log_sql.warning(
+            "Query lenta: %.1f ms, route %s, parametri %s\n%s",
+            durata * 1000,
+            statistiche.route() if statistiche is not None and statistiche.route else "-",
+            _forma_parametri(parameters, executemany),
+            statement,
+        )
+
+
 def init_db():
-    """Crea tutte le tabelle nel database"""
-    Base.metadata.create_all(bind=engine)
+    """Crea o aggiorna lo schema del database (migrazioni con versione)"""
+    from migrazioni import aggiorna_schema
+    aggiorna_schema(engine)
 
 
 def get_db():
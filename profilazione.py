@@ -0,0 +1,298 @@
+"""
+Profilazione su richiesta delle singole richieste in produzione
+
+Un amministratore (username in AMMINISTRATORI) aggiunge ?profila=cprofile
+(o l'header X-Profila: cprofile) a una richiesta lenta, ad esempio
+/quaderno/export/pdf?profila=cprofile: la richiesta viene eseguita sotto
+profilatore e il profilo salvato in PROFILI_DIR, senza ridistribuire
+l'app. Le richieste senza il flag non attivano nulla: il middleware
+controlla solo la query string e gli header.
+
+Due modalità:
+- cprofile: profilatore deterministico (tutte le chiamate, con i tempi),
+  salvato in formato pstats (python -m pstats, snakeviz)
+- campioni: ogni CAMPIONAMENTO_SECONDI viene letto lo stack del thread
+  che esegue la richiesta; salvato come stack compressi ("a;b;c 12"),
+  da aprire con speedscope o flamegraph.pl. Pesa meno sulla richiesta.
+
+cProfile e il campionatore guardano il thread dell'event loop: il lavoro
+spostato nel threadpool (import, eliminazioni a blocchi, route sincrone)
+non compare, e le richieste servite nello stesso momento dal worker
+finiscono nello stesso profilo. Con yappi installato la modalità cprofile
+usa yappi: tutti i thread, con ogni chiamata etichettata dal contesto
+della richiesta (copiato anche nel threadpool), e nel profilo restano
+solo le chiamate della richiesta profilata. Negli altri casi il profilo
+registra quante richieste erano in corso insieme ed è segnato come
+contaminato se ce n'erano.
+
+Si profila una richiesta alla volta per worker; la cartella conserva gli
+ultimi PROFILI_CONSERVA profili (pagina /admin/profili).
+"""
+import cProfile
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from http.cookies import SimpleCookie
+from typing import List, Optional
+from urllib.parse import parse_qs
+
+try:
+    from config import AMMINISTRATORI, PROFILI_DIR, PROFILI_CONSERVA, SECRET_KEY, ALGORITHM
+except ImportError:
+    AMMINISTRATORI = set()
+    PROFILI_DIR = "profili"
+    PROFILI_CONSERVA = 50
+    SECRET_KEY = "agrinote-secret-key-change-in-production"
+    ALGORITHM = "HS256"
+
+try:
+    import yappi  # Opzionale: pip install yappi
+except ImportError:
+    yappi = None
+
+log = logging.getLogger("agrinote.profilazione")
+
+MODALITA = {"cprofile": ".pstats", "campioni": ".txt"}
+CAMPIONAMENTO_SECONDI = 0.005
+
+# Nomi dei profili: <data>-<ora>-<id>, senza percorsi (usati anche negli URL di download)
+NOME_VALIDO = re.compile(r"^\d{8}-\d{6}-[0-9a-f]{8}$")
+
+_in_corso = threading.Lock()
+
+# Etichetta yappi delle chiamate: 1 nel contesto della richiesta profilata
+_richiesta_profilata: ContextVar[int] = ContextVar("richiesta_profilata", default=0)
+
+
+def amministratore(username: Optional[str]) -> bool:
+    return bool(username) and username in AMMINISTRATORI
+
+
+def _utente(scope) -> Optional[str]:
+    """Username dal cookie di sessione (stesso JWT di get_current_user, senza database)"""
+    from jose import JWTError, jwt
+
+    cookie = SimpleCookie()
+    for nome, valore in scope["headers"]:
+        if nome == b"cookie":
+            cookie.load(valore.decode("latin-1"))
+    if "access_token" not in cookie:
+        return None
+    try:
+        return jwt.decode(cookie["access_token"].value, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
+
+def _modalita_richiesta(scope) -> Optional[str]:
+    """Modalità chiesta con ?profila= o X-Profila (None se la richiesta non la chiede)"""
+    for nome, valore in scope["headers"]:
+        if nome == b"x-profila":
+            return valore.decode("latin-1").strip().lower() or "cprofile"
+    if b"profila=" in scope["query_string"]:
+        valori = parse_qs(scope["query_string"].decode("latin-1")).get("profila")
+        if valori:
+            return valori[0].strip().lower()
+    return None
+
+
+class Campionatore(threading.Thread):
+    """Legge periodicamente lo stack di un thread e conta gli stack compressi"""
+
+    def __init__(self, thread_id: int, intervallo: float = CAMPIONAMENTO_SECONDI):
+        super().__init__(name="agrinote-campionatore", daemon=True)
+        self.thread_id = thread_id
+        self.intervallo = intervallo
+        self.stack = Counter()
+        self._fine = threading.Event()
+
+    def run(self):
+        while not self._fine.wait(self.intervallo):
+            frame = sys._current_frames().get(self.thread_id)
+            righe = []
+            while frame is not None:
+                codice = frame.f_code
+                righe.append(f"{os.path.basename(codice.co_filename)}:{codice.co_name}:{codice.co_firstlineno}")
+                frame = frame.f_back
+            if righe:
+                self.stack[";".join(reversed(righe))] += 1
+
+    def ferma(self):
+        self._fine.set()
+        self.join()
+
+    def salva(self, percorso: str):
+        with open(percorso, "w", encoding="utf-8") as file:
+            for stack, conteggio in self.stack.most_common():
+                file.write(f"{stack} {conteggio}\n")
+
+
+class ProfiloYappi:
+    """Modalità cprofile con yappi: tutti i thread, solo le chiamate della richiesta profilata"""
+
+    def enable(self):
+        yappi.clear_stats()
+        yappi.set_clock_type("wall")  # Come cProfile: i tempi comprendono le attese
+        yappi.set_tag_callback(_richiesta_profilata.get)
+        yappi.start(builtins=False, profile_threads=True)
+
+    def disable(self):
+        yappi.stop()
+
+    def dump_stats(self, percorso: str):
+        yappi.get_func_stats(filter={"tag": 1}).save(percorso, type="pstat")
+        yappi.clear_stats()
+
+
+# ========== CARTELLA DEI PROFILI ==========
+
+def elenco_profili(cartella: str = PROFILI_DIR) -> List[dict]:
+    """Metadati dei profili salvati, dal più recente"""
+    if not os.path.isdir(cartella):
+        return []
+    profili = []
+    for nome_file in sorted(os.listdir(cartella), reverse=True):
+        nome, estensione = os.path.splitext(nome_file)
+        if estensione != ".json" or not NOME_VALIDO.match(nome):
+            continue
+        try:
+            with open(os.path.join(cartella, nome_file), encoding="utf-8") as file:
+                profili.append(json.load(file))
+        except (OSError, ValueError):
+            continue
+    return profili
+
+
+def file_profilo(nome: str, cartella: str = PROFILI_DIR) -> Optional[str]:
+    """Percorso del file di un profilo (None se il nome non è valido o il file non esiste)"""
+    if not NOME_VALIDO.match(nome):
+        return None
+    for estensione in MODALITA.values():
+        percorso = os.path.join(cartella, nome + estensione)
+        if os.path.exists(percorso):
+            return percorso
+    return None
+
+
+def ruota_profili(cartella: str = PROFILI_DIR, conserva: int = PROFILI_CONSERVA):
+    """Elimina i profili oltre gli ultimi `conserva` (profilo e metadati)"""
+    for profilo in elenco_profili(cartella)[conserva:]:
+        for estensione in (".json", *MODALITA.values()):
+            percorso = os.path.join(cartella, profilo["nome"] + estensione)
+            if os.path.exists(percorso):
+                os.remove(percorso)
+
+
+class MiddlewareProfilazione:
+    """
+    Middleware ASGI che profila le richieste con ?profila= / X-Profila di un amministratore
+
+    Va aggiunto per primo (il più interno): il profilo contiene l'app e
+    non gli altri middleware. La risposta riporta il nome del profilo
+    nell'header X-Profilo.
+    """
+
+    def __init__(self, app, cartella: str = PROFILI_DIR, conserva: int = PROFILI_CONSERVA):
+        self.app = app
+        self.cartella = cartella
+        self.conserva = conserva
+        # Richieste HTTP in corso nel worker e, durante un profilo, quelle servite insieme
+        # (solo dal thread dell'event loop: nessun lock)
+        self._attive = 0
+        self._concorrenti = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not AMMINISTRATORI:
+            await self.app(scope, receive, send)
+            return
+        self._attive += 1
+        if self._concorrenti is not None:
+            self._concorrenti += 1
+        try:
+            await self._richiesta(scope, receive, send)
+        finally:
+            self._attive -= 1
+
+    async def _richiesta(self, scope, receive, send):
+        modalita = _modalita_richiesta(scope)
+        if modalita is None:
+            await self.app(scope, receive, send)
+            return
+
+        utente = _utente(scope)
+        if modalita not in MODALITA or not amministratore(utente):
+            await self.app(scope, receive, send)
+            return
+        if not _in_corso.acquire(blocking=False):
+            log.info("Profilazione già in corso, %s eseguita senza profilo", scope["path"])
+            await self.app(scope, receive, send)
+            return
+
+        nome = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+        async def invia(messaggio):
+            if messaggio["type"] == "http.response.start":
+                messaggio["headers"] = list(messaggio.get("headers", [])) + [(b"x-profilo", nome.encode())]
+            await send(messaggio)
+
+        try:
+            if modalita == "cprofile":
+                profilatore = ProfiloYappi() if yappi is not None else cProfile.Profile()
+                separato = yappi is not None
+            else:
+                profilatore = Campionatore(threading.get_ident())
+                separato = False
+            # Richieste già in corso, più quelle che arrivano durante il profilo (contate in __call__)
+            self._concorrenti = self._attive - 1
+            etichetta = _richiesta_profilata.set(1)
+            inizio = time.perf_counter()
+            if modalita == "cprofile":
+                profilatore.enable()
+            else:
+                profilatore.start()
+            try:
+                await self.app(scope, receive, invia)
+            finally:
+                if modalita == "cprofile":
+                    profilatore.disable()
+                else:
+                    profilatore.ferma()
+                durata = time.perf_counter() - inizio
+                _richiesta_profilata.reset(etichetta)
+                concorrenti, self._concorrenti = self._concorrenti, None
+
+            os.makedirs(self.cartella, exist_ok=True)
+            percorso = os.path.join(self.cartella, nome + MODALITA[modalita])
+            if modalita == "cprofile":
+                profilatore.dump_stats(percorso)
+            else:
+                profilatore.salva(percorso)
+            with open(os.path.join(self.cartella, nome + ".json"), "w", encoding="utf-8") as file:
+                json.dump({
+                    "nome": nome,
+                    "file": os.path.basename(percorso),
+                    "modalita": modalita,
+                    "profilatore": "yappi" if separato else modalita,
+                    "metodo": scope["method"],
+                    "percorso": scope["path"],
+                    "utente": utente,
+                    "ora": datetime.now().isoformat(timespec="seconds"),
+                    "durata_ms": round(durata * 1000, 1),
+                    "richieste_concorrenti": concorrenti,
+                    "contaminato": concorrenti > 0 and not separato,
+                }, file)
+            ruota_profili(self.cartella, self.conserva)
+            log.info(
+                "Profilo %s salvato: %s %s (%.0f ms, %d richieste concorrenti)",
+                nome, scope["method"], scope["path"], durata * 1000, concorrenti,
+            )
+        finally:
+            _in_corso.release()
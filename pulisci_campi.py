@@ -1,45 +1,40 @@
 """
 Script per pulire tutti i campi esistenti e ricreare il database
 Utile per risolvere problemi con campi vecchi senza colonne centro
-"""
-from sqlalchemy import create_engine, text
-from models import DATABASE_URL, Base, Campo, Trattamento
-from sqlalchemy.orm import sessionmaker
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+I trattamenti sono eliminati a blocchi (vedi manutenzione.py): se lo
+script viene interrotto, rilanciarlo riprende da dove si era fermato.
+"""
+from sqlalchemy import select, func
+from models import SessionLocal, Campo
+from manutenzione import elimina_campi_a_blocchi
 
 def pulisci_campi():
     """Elimina tutti i campi e i trattamenti associati"""
     db = SessionLocal()
     
     try:
-        # Conta campi prima
-        num_campi = db.query(Campo).count()
+        # Conta campi prima (i campi sono pochi, i trattamenti si contano mentre vengono eliminati)
+        num_campi = db.execute(select(func.count(Campo.id))).scalar()
         print(f"📊 Trovati {num_campi} campi da eliminare")
         
         if num_campi == 0:
             print("✅ Nessun campo da eliminare")
             return
         
-        # Elimina tutti i trattamenti (cascade dovrebbe farlo automaticamente, ma meglio essere espliciti)
-        num_trattamenti = db.query(Trattamento).count()
-        print(f"📊 Trovati {num_trattamenti} trattamenti da eliminare")
-        
-        # Elimina trattamenti
-        db.query(Trattamento).delete()
-        print(f"✅ Eliminati {num_trattamenti} trattamenti")
+        # Trattamenti a blocchi (contatori ricalcolati, scarichi di magazzino conservati), poi i campi
+        report = elimina_campi_a_blocchi(
+            db,
+            progresso=lambda eliminati, blocchi: print(f"  🗑️  {eliminati} trattamenti eliminati"),
+        )
+        print(f"✅ Eliminati {report['eliminati']} trattamenti")
+        print(f"✅ Eliminati {report['campi']} campi")
         
-        # Elimina campi
-        db.query(Campo).delete()
-        print(f"✅ Eliminati {num_campi} campi")
-        
-        db.commit()
         print("\n🎉 Pulizia completata! Ora puoi ricreare i campi.")
         
     except Exception as e:
-        db.rollback()
         print(f"❌ Errore durante la pulizia: {e}")
+        print("   I blocchi già eliminati restano confermati: rilanciare per completare")
         raise
     finally:
         db.close()
@@ -59,4 +54,3 @@ if __name__ == "__main__":
         print("⚠️  Modalità --force: eliminazione automatica")
     
     pulisci_campi()
-
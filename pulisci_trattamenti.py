@@ -1,37 +1,34 @@
 """
 Script per pulire tutti i trattamenti esistenti
 Utile per risolvere problemi con trattamenti vecchi
-"""
-from sqlalchemy import create_engine
-from models import DATABASE_URL, Trattamento
-from sqlalchemy.orm import sessionmaker
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+I trattamenti sono eliminati a blocchi (vedi manutenzione.py): se lo
+script viene interrotto, rilanciarlo riprende da dove si era fermato.
+"""
+from models import SessionLocal
+from manutenzione import elimina_trattamenti_a_blocchi
 
 def pulisci_trattamenti():
     """Elimina tutti i trattamenti"""
     db = SessionLocal()
     
     try:
-        # Conta trattamenti prima
-        num_trattamenti = db.query(Trattamento).count()
-        print(f"📊 Trovati {num_trattamenti} trattamenti da eliminare")
+        # Blocchi con commit separati: contatori ricalcolati blocco per blocco (gli scarichi di magazzino restano)
+        report = elimina_trattamenti_a_blocchi(
+            db,
+            progresso=lambda eliminati, blocchi: print(f"  🗑️  {eliminati} trattamenti eliminati"),
+        )
         
-        if num_trattamenti == 0:
+        if report["eliminati"] == 0:
             print("✅ Nessun trattamento da eliminare")
             return
         
-        # Elimina trattamenti
-        db.query(Trattamento).delete()
-        print(f"✅ Eliminati {num_trattamenti} trattamenti")
-        
-        db.commit()
+        print(f"✅ Eliminati {report['eliminati']} trattamenti")
         print("\n🎉 Pulizia completata! Ora puoi ricreare i trattamenti.")
         
     except Exception as e:
-        db.rollback()
         print(f"❌ Errore durante la pulizia: {e}")
+        print("   I blocchi già eliminati restano confermati: rilanciare per completare")
         import traceback
         traceback.print_exc()
         raise
@@ -53,4 +50,3 @@ if __name__ == "__main__":
         print("⚠️  Modalità --force: eliminazione automatica")
     
     pulisci_trattamenti()
-
@@ -0,0 +1,162 @@
+"""
+Log strutturati dell'applicazione
+
+Livelli standard di logging, uscita JSON (una riga per evento, per le
+pipeline di raccolta) o testo leggibile in sviluppo, e id della richiesta
+in ogni riga per ritrovare tutti gli eventi di una stessa richiesta.
+
+I record passano da una coda: il thread della richiesta (o l'event loop)
+accoda soltanto, formattazione e scrittura su stdout avvengono in un
+thread separato (QueueListener). I messaggi usano gli argomenti di
+logging (log.debug("area %s", valore)) e non le f-string: se il livello
+è disabilitato il messaggio non viene mai costruito.
+
+Configurazione: LOG_LIVELLO (DEBUG, INFO, WARNING...) e LOG_FORMATO
+(json o testo).
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+try:
+    from config import LOG_LIVELLO, LOG_FORMATO
+except ImportError:
+    LOG_LIVELLO = "INFO"
+    LOG_FORMATO = "testo"
+
+id_richiesta: ContextVar[Optional[str]] = ContextVar("id_richiesta", default=None)
+
+# Attributi standard di LogRecord: gli altri (passati con extra=) finiscono nel JSON
+_ATTRIBUTI_RECORD = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "id_richiesta"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class FiltroIdRichiesta(logging.Filter):
+    """Aggiunge l'id della richiesta al record (eseguito nel thread che produce il log)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.id_richiesta = id_richiesta.get()
+        return True
+
+
+class GestoreCoda(logging.handlers.QueueHandler):
+    """
+    QueueHandler che non formatta nel thread chiamante
+
+    Il QueueHandler standard costruisce il messaggio prima di accodarlo
+    (serve quando la coda attraversa processi); qui coda e listener sono
+    nello stesso processo, quindi anche la formattazione va al listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class FormatterJSON(logging.Formatter):
+    """Una riga JSON per record: ora, livello, logger, messaggio, id richiesta, extra ed eccezione"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        evento = {
+            "ora": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "livello": record.levelname,
+            "logger": record.name,
+            "messaggio": record.getMessage(),
+        }
+        if getattr(record, "id_richiesta", None):
+            evento["id_richiesta"] = record.id_richiesta
+        for chiave, valore in vars(record).items():
+            if chiave not in _ATTRIBUTI_RECORD:
+                evento[chiave] = valore
+        if record.exc_info:
+            evento["eccezione"] = self.formatException(record.exc_info)
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+class FormatterTesto(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s [%(id_richiesta)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if getattr(record, "id_richiesta", None) is None:
+            record.id_richiesta = "-"
+        return super().format(record)
+
+
+def configura_log(livello: str = LOG_LIVELLO, formato: str = LOG_FORMATO):
+    """
+    Installa coda e listener sul logger radice (idempotente)
+
+    Anche i log di uvicorn e delle librerie passano dalla stessa coda.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    uscita = logging.StreamHandler()
+    uscita.setFormatter(FormatterJSON() if formato == "json" else FormatterTesto())
+
+    coda = queue.SimpleQueue()
+    gestore = GestoreCoda(coda)
+    gestore.addFilter(FiltroIdRichiesta())
+
+    # DEBUG solo per i logger dell'app ("agrinote.*"): le librerie restano da INFO in su
+    livello = logging.getLevelName(livello.upper())
+    radice = logging.getLogger()
+    radice.handlers = [gestore]
+    radice.setLevel(max(livello, logging.INFO))
+    logging.getLogger("agrinote").setLevel(livello)
+    for nome in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logging.getLogger(nome).handlers = []
+        logging.getLogger(nome).propagate = True
+
+    _listener = logging.handlers.QueueListener(coda, uscita, respect_handler_level=True)
+    _listener.start()
+    atexit.register(chiudi_log)
+
+
+def chiudi_log():
+    """Svuota la coda e ferma il listener (alla chiusura del processo)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class MiddlewareIdRichiesta:
+    """
+    Middleware ASGI: id della richiesta nel contesto dei log e nell'header X-Request-ID
+
+    Se il proxy davanti all'app manda già X-Request-ID viene riusato, così
+    i log del proxy e dell'app si possono collegare.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        ricevuto = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")[:64]
+        identificativo = ricevuto or uuid.uuid4().hex
+        token = id_richiesta.set(identificativo)
+
+        async def invia(messaggio):
+            if messaggio["type"] == "http.response.start":
+                messaggio["headers"] = list(messaggio.get("headers", [])) + [
+                    (b"x-request-id", identificativo.encode("latin-1"))
+                ]
+            await send(messaggio)
+
+        try:
+            await self.app(scope, receive, invia)
+        finally:
+            id_richiesta.reset(token)
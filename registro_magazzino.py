@@ -0,0 +1,183 @@
+"""
+Registro movimenti di magazzino
+Ogni variazione di giacenza è un MovimentoMagazzino; Prodotto.quantita_disponibile
+è il saldo corrente, aggiornato nella stessa transazione del movimento.
+
+Uso:
+    python registro_magazzino.py [--azienda ID]   # ricostruisce i saldi dal registro
+"""
+from collections import defaultdict
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy import select, update, insert, func, exists
+from sqlalchemy.orm import Session
+
+from models import Prodotto, MovimentoMagazzino, TipoMovimento
+
+NOTA_GIACENZA_INIZIALE = "Giacenza iniziale"
+
+
+def _aggiorna_saldo(db: Session, prodotto_id: int, delta: float):
+    """Aggiorna il saldo con un UPDATE atomico (quantita = quantita + delta)"""
+    db.execute(
+        update(Prodotto)
+        .where(Prodotto.id == prodotto_id)
+        .values(quantita_disponibile=Prodotto.quantita_disponibile + delta)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def registra_movimento(
+    db: Session,
+    prodotto_id: int,
+    tipo: TipoMovimento,
+    quantita: float,
+    data: Optional[date] = None,
+    trattamento_id: Optional[int] = None,
+    riferimento: Optional[str] = None,
+    note: Optional[str] = None,
+) -> MovimentoMagazzino:
+    """
+    Registra un movimento e aggiorna il saldo del prodotto
+
+    `quantita` è con segno: positiva per i carichi, negativa per gli
+    scarichi. Non esegue il commit: movimento e saldo vengono confermati
+    insieme alla transazione del chiamante.
+    """
+    movimento = MovimentoMagazzino(
+        prodotto_id=prodotto_id,
+        data=data or date.today(),
+        tipo=tipo,
+        quantita=quantita,
+        trattamento_id=trattamento_id,
+        riferimento=riferimento,
+        note=note,
+    )
+    db.add(movimento)
+    _aggiorna_saldo(db, prodotto_id, quantita)
+    return movimento
+
+
+def registra_movimenti(db: Session, movimenti: List[dict]):
+    """
+    Registra un blocco di movimenti con un INSERT multiplo
+
+    I saldi sono aggiornati con un UPDATE per prodotto sulla somma del
+    blocco. Ogni movimento è un dict con le colonne di MovimentoMagazzino.
+    Non esegue il commit.
+    """
+    if not movimenti:
+        return
+
+    totali = defaultdict(float)
+    for movimento in movimenti:
+        totali[movimento["prodotto_id"]] += movimento["quantita"]
+
+    db.execute(insert(MovimentoMagazzino), movimenti)
+    for prodotto_id, totale in totali.items():
+        _aggiorna_saldo(db, prodotto_id, totale)
+
+
+def inizializza_giacenze(db: Session, azienda_id: Optional[int] = None) -> int:
+    """
+    Crea la rettifica di giacenza iniziale dei prodotti che non ce l'hanno
+
+    Serve per i prodotti creati prima del registro, il cui saldo era
+    inserito a mano: la giacenza iniziale è il saldo meno i movimenti già
+    registrati (per esempio gli scarichi dei trattamenti fatti dopo la
+    migrazione), così ricostruisci_giacenze ritrova il saldo corrente.
+    Accetta anche una Connection (migrazioni). Restituisce il numero di
+    rettifiche create.
+    """
+    registrati = (
+        select(func.coalesce(func.sum(MovimentoMagazzino.quantita), 0.0))
+        .where(MovimentoMagazzino.prodotto_id == Prodotto.id)
+        .scalar_subquery()
+    )
+    query = select(Prodotto.id, func.coalesce(Prodotto.quantita_disponibile, 0.0) - registrati).where(
+        ~exists().where(
+            MovimentoMagazzino.prodotto_id == Prodotto.id,
+            MovimentoMagazzino.tipo == TipoMovimento.RETTIFICA,
+            MovimentoMagazzino.note == NOTA_GIACENZA_INIZIALE,
+        ),
+    )
+    if azienda_id is not None:
+        query = query.where(Prodotto.azienda_id == azienda_id)
+
+    oggi = date.today()
+    righe = [
+        {
+            "prodotto_id": prodotto_id,
+            "data": oggi,
+            "tipo": TipoMovimento.RETTIFICA,
+            "quantita": quantita,
+            "note": NOTA_GIACENZA_INIZIALE,
+        }
+        for prodotto_id, quantita in db.execute(query).all()
+        if abs(quantita) > 1e-9
+    ]
+    if righe:
+        db.execute(insert(MovimentoMagazzino), righe)
+    return len(righe)
+
+
+def ricostruisci_giacenze(db: Session, azienda_id: Optional[int] = None) -> list:
+    """
+    Ricalcola i saldi dei prodotti dalla somma dei movimenti
+
+    Un solo UPDATE con subquery aggregata sul registro (indicizzato per
+    prodotto). Restituisce i prodotti il cui saldo non corrispondeva,
+    come tuple (id, nome, saldo_precedente, saldo_registro).
+    """
+    somma = (
+        select(func.coalesce(func.sum(MovimentoMagazzino.quantita), 0.0))
+        .where(MovimentoMagazzino.prodotto_id == Prodotto.id)
+        .scalar_subquery()
+    )
+
+    query = select(Prodotto.id, Prodotto.nome_commerciale, Prodotto.quantita_disponibile, somma)
+    if azienda_id is not None:
+        query = query.where(Prodotto.azienda_id == azienda_id)
+    differenze = [
+        tuple(riga) for riga in db.execute(query).all()
+        if abs(riga[2] - riga[3]) > 1e-9
+    ]
+
+    aggiornamento = update(Prodotto).values(quantita_disponibile=somma)
+    if azienda_id is not None:
+        aggiornamento = aggiornamento.where(Prodotto.azienda_id == azienda_id)
+    db.execute(aggiornamento.execution_options(synchronize_session=False))
+    return differenze
+
+
+if __name__ == "__main__":
+    import argparse
+    from models import SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(description="Ricostruisce i saldi di magazzino dal registro movimenti")
+    parser.add_argument("--azienda", type=int, help="Limita la ricostruzione a un'azienda")
+    args = parser.parse_args()
+
+    print("📦 Ricostruzione giacenze dal registro movimenti...\n")
+    init_db()
+    db = SessionLocal()
+    try:
+        iniziali = inizializza_giacenze(db, args.azienda)
+        if iniziali:
+            print(f"  ✅ Create {iniziali} rettifiche di giacenza iniziale")
+
+        differenze = ricostruisci_giacenze(db, args.azienda)
+        db.commit()
+
+        for prodotto_id, nome, prima, dopo in differenze:
+            print(f"  ⚠️  {nome} (ID: {prodotto_id}): {prima:.2f} → {dopo:.2f}")
+        print(f"\n🎉 Ricostruzione completata: {len(differenze)} saldi corretti")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Errore durante la ricostruzione: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,189 @@
+"""
+Report stagionali sui consumi di prodotti
+Le aggregazioni sono calcolate in SQL (GROUP BY) senza caricare oggetti ORM,
+unendo i trattamenti vivi ai riepiloghi delle stagioni archiviate;
+i risultati sono tenuti in cache per azienda e revisione dei dati
+dell'azienda (sync_revisioni_aziende, aggiornata dai trigger): una
+modifica fatta da un altro worker o da uno script cambia la revisione e
+il report viene ricalcolato.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import select, func, cast, union_all, Integer
+from sqlalchemy.orm import Session
+
+from models import Trattamento, Campo, Prodotto, RiepilogoArchivio
+from sync import revisione_azienda
+
+MAX_VOCI_CACHE = 256
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _da_cache(nome: str, db: Session, azienda_id: int, anno: Optional[int], calcola):
+    """
+    Restituisce il report dalla cache o lo calcola (cache LRU limitata)
+
+    La revisione è letta prima del calcolo: con una modifica concorrente
+    il report salvato è al più più nuovo della sua chiave, e la richiesta
+    seguente (con la revisione nuova) lo ricalcola.
+    """
+    chiave = (nome, azienda_id, anno, revisione_azienda(db, azienda_id))
+    with _lock:
+        if chiave in _cache:
+            _cache.move_to_end(chiave)
+            return _cache[chiave]
+
+    risultato = calcola()
+
+    with _lock:
+        _cache[chiave] = risultato
+        while len(_cache) > MAX_VOCI_CACHE:
+            _cache.popitem(last=False)
+    return risultato
+
+
+def _anno():
+    return func.extract("year", Trattamento.data)
+
+
+def _filtro_anno(query, anno: Optional[int]):
+    """Filtra per stagione con un intervallo di date (sfrutta l'indice su data)"""
+    if anno is None:
+        return query
+    return query.where(Trattamento.data >= date(anno, 1, 1), Trattamento.data < date(anno + 1, 1, 1))
+
+
+def _per_campo_prodotto(azienda_id: int, anno: Optional[int]):
+    """
+    Aggregato per (anno, campo, prodotto) dei trattamenti e dei riepiloghi archiviati
+
+    Le stagioni archiviate non sono più in trattamenti: i loro totali
+    arrivano da riepiloghi_archivio, una riga per (campo, prodotto, anno).
+    """
+    campi_azienda = select(Campo.id).where(Campo.azienda_id == azienda_id)
+    anno_col = cast(_anno(), Integer)
+    vivi = _filtro_anno(
+        select(
+            anno_col.label("anno"),
+            Trattamento.campo_id,
+            Trattamento.prodotto_id,
+            func.count(Trattamento.id).label("trattamenti"),
+            func.sum(Trattamento.quantita_totale).label("quantita_totale"),
+            func.min(Trattamento.quantita_per_ettaro).label("dose_min"),
+            func.max(Trattamento.quantita_per_ettaro).label("dose_max"),
+        )
+        .where(Trattamento.campo_id.in_(campi_azienda))
+        .group_by(anno_col, Trattamento.campo_id, Trattamento.prodotto_id),
+        anno,
+    )
+    archiviati = select(
+        RiepilogoArchivio.anno,
+        RiepilogoArchivio.campo_id,
+        RiepilogoArchivio.prodotto_id,
+        RiepilogoArchivio.applicazioni,
+        RiepilogoArchivio.quantita_totale,
+        RiepilogoArchivio.dose_min,
+        RiepilogoArchivio.dose_max,
+    ).where(RiepilogoArchivio.campo_id.in_(campi_azienda))
+    if anno is not None:
+        archiviati = archiviati.where(RiepilogoArchivio.anno == anno)
+    return union_all(vivi, archiviati).subquery()
+
+
+def consumi_per_campo(db: Session, azienda_id: int, anno: Optional[int] = None) -> list:
+    """Quantità totale di ogni prodotto per campo e stagione (anno solare)"""
+
+    def calcola():
+        aggregato = _per_campo_prodotto(azienda_id, anno)
+        query = (
+            select(
+                aggregato.c.anno,
+                Campo.id.label("campo_id"),
+                Campo.nome.label("campo"),
+                Prodotto.id.label("prodotto_id"),
+                Prodotto.nome_commerciale.label("prodotto"),
+                Prodotto.unita_misura.label("unita_misura"),
+                func.sum(aggregato.c.trattamenti).label("trattamenti"),
+                func.sum(aggregato.c.quantita_totale).label("quantita_totale"),
+            )
+            .select_from(aggregato)
+            .join(Campo, aggregato.c.campo_id == Campo.id)
+            .join(Prodotto, aggregato.c.prodotto_id == Prodotto.id)
+            .group_by(aggregato.c.anno, Campo.id, Campo.nome, Prodotto.id, Prodotto.nome_commerciale, Prodotto.unita_misura)
+            .order_by(aggregato.c.anno.desc(), Campo.nome, Prodotto.nome_commerciale)
+        )
+
+        return [
+            {
+                "anno": int(r.anno),
+                "campo_id": r.campo_id,
+                "campo": r.campo,
+                "prodotto_id": r.prodotto_id,
+                "prodotto": r.prodotto,
+                "unita_misura": r.unita_misura,
+                "trattamenti": r.trattamenti,
+                "quantita_totale": round(r.quantita_totale or 0.0, 2),
+            }
+            for r in db.execute(query)
+        ]
+
+    return _da_cache("consumi_per_campo", db, azienda_id, anno, calcola)
+
+
+def dosi_per_coltura(db: Session, azienda_id: int, anno: Optional[int] = None) -> list:
+    """
+    Dose per ettaro di ogni prodotto per coltura e stagione
+
+    La dose media è pesata sulla superficie trattata
+    (quantità totale / ettari trattati). La coltura è quella attuale
+    del campo (Campo.coltura_attuale).
+    """
+
+    def calcola():
+        aggregato = _per_campo_prodotto(azienda_id, anno)
+        coltura = func.coalesce(Campo.coltura_attuale, "Non specificata").label("coltura")
+        query = (
+            select(
+                aggregato.c.anno,
+                coltura,
+                Prodotto.id.label("prodotto_id"),
+                Prodotto.nome_commerciale.label("prodotto"),
+                Prodotto.unita_misura.label("unita_misura"),
+                func.sum(aggregato.c.trattamenti).label("trattamenti"),
+                func.sum(aggregato.c.trattamenti * Campo.superficie_ettari).label("ettari_trattati"),
+                func.sum(aggregato.c.quantita_totale).label("quantita_totale"),
+                func.min(aggregato.c.dose_min).label("dose_min"),
+                func.max(aggregato.c.dose_max).label("dose_max"),
+            )
+            .select_from(aggregato)
+            .join(Campo, aggregato.c.campo_id == Campo.id)
+            .join(Prodotto, aggregato.c.prodotto_id == Prodotto.id)
+            .group_by(aggregato.c.anno, coltura, Prodotto.id, Prodotto.nome_commerciale, Prodotto.unita_misura)
+            .order_by(aggregato.c.anno.desc(), coltura, Prodotto.nome_commerciale)
+        )
+
+        righe = []
+        for r in db.execute(query):
+            ettari = r.ettari_trattati or 0.0
+            quantita = r.quantita_totale or 0.0
+            righe.append({
+                "anno": int(r.anno),
+                "coltura": r.coltura,
+                "prodotto_id": r.prodotto_id,
+                "prodotto": r.prodotto,
+                "unita_misura": r.unita_misura,
+                "trattamenti": r.trattamenti,
+                "ettari_trattati": round(ettari, 2),
+                "quantita_totale": round(quantita, 2),
+                "dose_media_ettaro": round(quantita / ettari, 3) if ettari else None,
+                "dose_min": r.dose_min,
+                "dose_max": r.dose_max,
+            })
+        return righe
+
+    return _da_cache("dosi_per_coltura", db, azienda_id, anno, calcola)
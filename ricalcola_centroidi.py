@@ -0,0 +1,85 @@
+"""
+Script per ricalcolare centro_lat / centro_lng dei campi esistenti
+I campi salvati prima del centroide pesato usavano la media dei vertici,
+che per i campi concavi può cadere fuori dal poligono.
+
+Uso:
+    python ricalcola_centroidi.py [--azienda ID] [--blocco N]
+"""
+from sqlalchemy import select, update
+
+from geometria import normalizza_anello, autointersezioni, centro_poligono
+from models import SessionLocal, Campo
+
+DIMENSIONE_BLOCCO = 500
+
+
+def ricalcola_centroidi(azienda_id: int = None, dimensione_blocco: int = DIMENSIONE_BLOCCO) -> dict:
+    """Ricalcola i centri dei campi a blocchi, un commit per blocco"""
+    db = SessionLocal()
+    report = {"aggiornati": 0, "senza_poligono": 0, "non_validi": []}
+
+    try:
+        ultimo_id = 0
+        while True:
+            query = select(Campo.id, Campo.nome, Campo.coordinate_poligono).where(
+                Campo.id > ultimo_id
+            ).order_by(Campo.id).limit(dimensione_blocco)
+            if azienda_id is not None:
+                query = query.where(Campo.azienda_id == azienda_id)
+
+            righe = db.execute(query).all()
+            if not righe:
+                break
+            ultimo_id = righe[-1].id
+
+            aggiornamenti = []
+            for riga in righe:
+                try:
+                    anello = normalizza_anello(riga.coordinate_poligono or [])
+                except (ValueError, TypeError):
+                    report["senza_poligono"] += 1
+                    continue
+
+                # I poligoni con lati incrociati vengono aggiornati comunque, ma segnalati
+                if autointersezioni(anello):
+                    report["non_validi"].append((riga.id, riga.nome))
+
+                centro_lat, centro_lng = centro_poligono(anello)
+                aggiornamenti.append({"id": riga.id, "centro_lat": centro_lat, "centro_lng": centro_lng})
+
+            if aggiornamenti:
+                db.execute(update(Campo), aggiornamenti)
+                db.commit()
+                report["aggiornati"] += len(aggiornamenti)
+            print(f"  ⏳ {report['aggiornati']} campi aggiornati")
+
+        return report
+
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Errore durante il ricalcolo: {e}")
+        import traceback
+        traceback.print_exc()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ricalcola i centri dei campi esistenti")
+    parser.add_argument("--azienda", type=int, help="Limita il ricalcolo a un'azienda")
+    parser.add_argument("--blocco", type=int, default=DIMENSIONE_BLOCCO, help="Campi per transazione")
+    args = parser.parse_args()
+
+    print("📐 Avvio ricalcolo centroidi campi...\n")
+    risultato = ricalcola_centroidi(args.azienda, args.blocco)
+
+    if risultato["senza_poligono"]:
+        print(f"⚠️  {risultato['senza_poligono']} campi senza poligono valido, non modificati")
+    for campo_id, nome in risultato["non_validi"]:
+        print(f"⚠️  Campo '{nome}' (ID: {campo_id}): i lati del poligono si intersecano, ridisegnarlo dalla mappa")
+
+    print(f"\n🎉 Ricalcolo completato: {risultato['aggiornati']} campi aggiornati")
@@ -0,0 +1,332 @@
+"""
+Ricerca full-text su trattamenti, prodotti e interventi di manutenzione
+SQLite: tabella virtuale FTS5. PostgreSQL: tabella con colonna tsvector e indice GIN.
+L'indice è mantenuto da trigger sul database (creati dalle migrazioni), quindi resta allineato anche con
+gli inserimenti massivi e le eliminazioni fatte dagli script.
+
+Uso:
+    python ricerca.py   # ricostruisce l'indice da zero
+"""
+import re
+from typing import List, Optional
+
+from sqlalchemy import func, select, text, union_all
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from models import Campo, Prodotto, Trattamento, TrattamentoArchiviato
+
+# Ogni documento ha id = id_riga * 10 + codice del tipo, così l'eliminazione
+# dall'indice è una ricerca per chiave primaria
+SORGENTI = {
+    "trattamento": {
+        "codice": 1,
+        "tabella": "trattamenti",
+        "azienda": "(SELECT azienda_id FROM campi WHERE id = {r}.campo_id)",
+        "titolo": (
+            "COALESCE((SELECT nome_commerciale FROM prodotti WHERE id = {r}.prodotto_id), '')"
+            " || ' - ' || COALESCE((SELECT nome FROM campi WHERE id = {r}.campo_id), '')"
+        ),
+        "testo": (
+            "COALESCE({r}.avversita, '') || ' ' || COALESCE({r}.numero_lotto, '')"
+            " || ' ' || COALESCE({r}.operatore, '') || ' ' || COALESCE({r}.note, '')"
+        ),
+        "colonne": "campo_id, prodotto_id, avversita, numero_lotto, operatore, note",
+    },
+    "intervento": {
+        "codice": 2,
+        "tabella": "interventi_manutenzione",
+        "azienda": "(SELECT azienda_id FROM mezzi WHERE id = {r}.mezzo_id)",
+        "titolo": (
+            "{r}.tipo_intervento || ' - '"
+            " || COALESCE((SELECT nome FROM mezzi WHERE id = {r}.mezzo_id), '')"
+        ),
+        "testo": (
+            "COALESCE({r}.descrizione, '') || ' ' || COALESCE({r}.officina, '')"
+            " || ' ' || COALESCE({r}.note, '')"
+        ),
+        "colonne": "mezzo_id, tipo_intervento, descrizione, officina, note",
+    },
+    "prodotto": {
+        "codice": 3,
+        "tabella": "prodotti",
+        "azienda": "{r}.azienda_id",
+        "titolo": "{r}.nome_commerciale",
+        "testo": "{r}.tipo || ' ' || {r}.unita_misura",
+        "colonne": "azienda_id, nome_commerciale, tipo, unita_misura",
+    },
+}
+TIPI_PER_CODICE = {s["codice"]: tipo for tipo, s in SORGENTI.items()}
+
+# Gli UPDATE di altre colonne (giacenze, revisioni di sincronizzazione)
+# non toccano il testo indicizzato e non aggiornano l'indice
+
+# Rinominare un campo, un prodotto o un mezzo cambia il titolo dei documenti collegati
+DIPENDENZE = [
+    # (tabella modificata, colonne, tipo documento, colonna di collegamento)
+    ("campi", "nome", "trattamento", "campo_id"),
+    ("prodotti", "nome_commerciale", "trattamento", "prodotto_id"),
+    ("mezzi", "nome", "intervento", "mezzo_id"),
+]
+
+
+def _select_documento(tipo: str, riga: str, azienda: str = "{}") -> str:
+    """SELECT (id, azienda, titolo, testo) di un documento a partire dall'alias riga"""
+    s = SORGENTI[tipo]
+    return (
+        f"SELECT {riga}.id * 10 + {s['codice']}, {azienda.format(s['azienda'].format(r=riga))}, "
+        f"{s['titolo'].format(r=riga)}, {s['testo'].format(r=riga)}"
+    )
+
+
+def _colonne(sorgente: dict) -> str:
+    """Clausola OF dei trigger di UPDATE, se la sorgente limita le colonne"""
+    return f" OF {sorgente['colonne']}" if "colonne" in sorgente else ""
+
+
+def _documenti_collegati(tipo: str, collegamento: str, azienda: str = "{}") -> str:
+    """Documenti di un tipo collegati alla riga NEW (es. i trattamenti di un campo)"""
+    tabella = SORGENTI[tipo]["tabella"]
+    return f"{_select_documento(tipo, 'r', azienda)} FROM {tabella} r WHERE r.{collegamento} = NEW.id"
+
+
+# ========== SQLITE (FTS5) ==========
+
+# La colonna azienda contiene il token "a<id>", filtrato con una query di colonna
+AZIENDA_SQLITE = "'a' || {}"
+
+
+def _inserisci_sqlite(select_sql: str) -> str:
+    return f"INSERT INTO ricerca_fts (rowid, azienda, titolo, testo) {select_sql}"
+
+
+def _ddl_sqlite() -> List[str]:
+    ddl = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS ricerca_fts USING fts5("
+        "azienda, titolo, testo, tokenize = 'unicode61 remove_diacritics 2')"
+    ]
+    for tipo, s in SORGENTI.items():
+        tabella, codice = s["tabella"], s["codice"]
+        inserisci = _inserisci_sqlite(_select_documento(tipo, "NEW", AZIENDA_SQLITE))
+        elimina = f"DELETE FROM ricerca_fts WHERE rowid = OLD.id * 10 + {codice}"
+        ddl += [
+            f"DROP TRIGGER IF EXISTS ricerca_{tabella}_ai",
+            f"DROP TRIGGER IF EXISTS ricerca_{tabella}_ad",
+            f"DROP TRIGGER IF EXISTS ricerca_{tabella}_au",
+            f"CREATE TRIGGER ricerca_{tabella}_ai AFTER INSERT ON {tabella} "
+            f"BEGIN {inserisci}; END",
+            f"CREATE TRIGGER ricerca_{tabella}_ad AFTER DELETE ON {tabella} "
+            f"BEGIN {elimina}; END",
+            f"CREATE TRIGGER ricerca_{tabella}_au AFTER UPDATE{_colonne(s)} ON {tabella} "
+            f"BEGIN {elimina}; {inserisci}; END",
+        ]
+    for tabella, colonna, tipo, collegamento in DIPENDENZE:
+        s = SORGENTI[tipo]
+        ddl.append(f"DROP TRIGGER IF EXISTS ricerca_{tabella}_{tipo}_au")
+        ddl.append(
+            f"CREATE TRIGGER ricerca_{tabella}_{tipo}_au AFTER UPDATE OF {colonna} ON {tabella} BEGIN "
+            f"DELETE FROM ricerca_fts WHERE rowid IN "
+            f"(SELECT id * 10 + {s['codice']} FROM {s['tabella']} WHERE {collegamento} = NEW.id); "
+            f"{_inserisci_sqlite(_documenti_collegati(tipo, collegamento, AZIENDA_SQLITE))}; END"
+        )
+    return ddl
+
+
+# ========== POSTGRESQL (tsvector) ==========
+
+def _inserisci_postgres(select_sql: str) -> str:
+    return f"INSERT INTO ricerca_documenti (id, azienda_id, titolo, testo) {select_sql}"
+
+
+def _ddl_postgres() -> List[str]:
+    ddl = [
+        "CREATE TABLE IF NOT EXISTS ricerca_documenti ("
+        "id BIGINT PRIMARY KEY, azienda_id INTEGER, titolo TEXT NOT NULL DEFAULT '', testo TEXT NOT NULL DEFAULT '', "
+        "documento tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('italian', titolo), 'A') || setweight(to_tsvector('italian', testo), 'B')"
+        ") STORED)",
+        "CREATE INDEX IF NOT EXISTS ix_ricerca_documenti_documento ON ricerca_documenti USING GIN (documento)",
+        "CREATE INDEX IF NOT EXISTS ix_ricerca_documenti_azienda ON ricerca_documenti (azienda_id)",
+    ]
+    for tipo, s in SORGENTI.items():
+        tabella, codice = s["tabella"], s["codice"]
+        ddl += [
+            f"CREATE OR REPLACE FUNCTION ricerca_{tabella}() RETURNS trigger AS $$ BEGIN "
+            f"IF TG_OP IN ('UPDATE', 'DELETE') THEN DELETE FROM ricerca_documenti WHERE id = OLD.id * 10 + {codice}; END IF; "
+            f"IF TG_OP IN ('INSERT', 'UPDATE') THEN {_inserisci_postgres(_select_documento(tipo, 'NEW'))}; RETURN NEW; END IF; "
+            f"RETURN OLD; END $$ LANGUAGE plpgsql",
+            f"DROP TRIGGER IF EXISTS ricerca_{tabella} ON {tabella}",
+            f"CREATE TRIGGER ricerca_{tabella} AFTER INSERT OR UPDATE{_colonne(s)} OR DELETE ON {tabella} "
+            f"FOR EACH ROW EXECUTE FUNCTION ricerca_{tabella}()",
+        ]
+    for tabella, colonna, tipo, collegamento in DIPENDENZE:
+        s = SORGENTI[tipo]
+        funzione = f"ricerca_{tabella}_{tipo}"
+        ddl += [
+            f"CREATE OR REPLACE FUNCTION {funzione}() RETURNS trigger AS $$ BEGIN "
+            f"DELETE FROM ricerca_documenti WHERE id IN "
+            f"(SELECT id * 10 + {s['codice']} FROM {s['tabella']} WHERE {collegamento} = NEW.id); "
+            f"{_inserisci_postgres(_documenti_collegati(tipo, collegamento))}; "
+            f"RETURN NEW; END $$ LANGUAGE plpgsql",
+            f"DROP TRIGGER IF EXISTS {funzione} ON {tabella}",
+            f"CREATE TRIGGER {funzione} AFTER UPDATE OF {colonna} ON {tabella} "
+            f"FOR EACH ROW EXECUTE FUNCTION {funzione}()",
+        ]
+    return ddl
+
+
+# ========== GESTIONE INDICE ==========
+
+def _postgres(conn) -> bool:
+    return conn.dialect.name == "postgresql"
+
+
+def _indice_esiste(conn: Connection) -> bool:
+    if _postgres(conn):
+        return conn.execute(text("SELECT to_regclass('ricerca_documenti') IS NOT NULL")).scalar()
+    return conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ricerca_fts'"
+    )).first() is not None
+
+
+def ricostruisci_indice(conn: Connection):
+    """Svuota e ripopola l'indice da tutte le tabelle sorgente"""
+    if _postgres(conn):
+        conn.execute(text("TRUNCATE ricerca_documenti"))
+        inserisci, azienda = _inserisci_postgres, "{}"
+    else:
+        conn.execute(text("DELETE FROM ricerca_fts"))
+        inserisci, azienda = _inserisci_sqlite, AZIENDA_SQLITE
+
+    for tipo, s in SORGENTI.items():
+        conn.execute(text(inserisci(f"{_select_documento(tipo, 'r', azienda)} FROM {s['tabella']} r")))
+
+    if not _postgres(conn):
+        conn.execute(text("INSERT INTO ricerca_fts (ricerca_fts) VALUES ('optimize')"))
+
+
+def inizializza_ricerca(conn: Connection):
+    """
+    Crea indice e trigger (idempotente, eseguita dalle migrazioni)
+
+    Alla prima creazione l'indice viene popolato con i dati esistenti.
+    """
+    nuovo = not _indice_esiste(conn)
+    for istruzione in (_ddl_postgres() if _postgres(conn) else _ddl_sqlite()):
+        conn.execute(text(istruzione))
+    if nuovo:
+        ricostruisci_indice(conn)
+
+
+# ========== RICERCA ==========
+
+def _token(query: str) -> List[str]:
+    """Parole della ricerca, senza caratteri speciali della sintassi FTS"""
+    return re.findall(r"\w+", query.lower())[:10]
+
+
+def cerca(db: Session, azienda_id: int, query: str, tipo: Optional[str] = None, limite: int = 20) -> List[dict]:
+    """
+    Ricerca ordinata per rilevanza nei documenti dell'azienda
+
+    Ogni parola è cercata come prefisso ("peron" trova "peronospora") e
+    devono comparire tutte. Il titolo (prodotto, campo, mezzo) pesa più del testo.
+    """
+    parole = _token(query)
+    if not parole:
+        return []
+
+    codice = SORGENTI[tipo]["codice"] if tipo else None
+    if _postgres(db.get_bind()):
+        sql = (
+            "SELECT id, titolo, ts_headline('italian', testo, q, 'MaxWords=15, MinWords=5') AS estratto "
+            "FROM ricerca_documenti, to_tsquery('italian', :q) AS q "
+            "WHERE azienda_id = :azienda AND documento @@ q "
+            + ("AND id % 10 = :codice " if codice else "")
+            + "ORDER BY ts_rank(documento, q) DESC LIMIT :limite"
+        )
+        parametri = {"q": " & ".join(f"{p}:*" for p in parole)}
+    else:
+        sql = (
+            "SELECT rowid AS id, titolo, snippet(ricerca_fts, 2, '', '', '…', 12) AS estratto "
+            "FROM ricerca_fts WHERE ricerca_fts MATCH :q "
+            + ("AND rowid % 10 = :codice " if codice else "")
+            + "ORDER BY bm25(ricerca_fts, 0.0, 5.0, 1.0) LIMIT :limite"
+        )
+        termini = " ".join(f'"{p}"*' for p in parole)
+        parametri = {"q": f'azienda : "a{int(azienda_id)}" AND {{titolo testo}} : ({termini})'}
+
+    parametri.update({"azienda": azienda_id, "codice": codice, "limite": limite})
+    risultati = []
+    for riga in db.execute(text(sql), parametri):
+        tipo_doc = TIPI_PER_CODICE.get(riga.id % 10)
+        risultati.append({
+            "tipo": tipo_doc,
+            "id": riga.id // 10,
+            "titolo": riga.titolo,
+            "estratto": riga.estratto,
+        })
+    return risultati
+
+
+def cerca_lotto(db: Session, azienda_id: int, numero_lotto: str) -> List[dict]:
+    """
+    Richiamo di un lotto: tutti i trattamenti dell'azienda con quel numero di lotto
+
+    Ricerca esatta senza distinzione tra maiuscole e minuscole, sugli
+    indici di lower(numero_lotto) dei trattamenti e dell'archivio, con
+    campo, superficie e prodotto per la comunicazione del richiamo.
+    """
+    numero = numero_lotto.strip()
+    if not numero:
+        return []
+
+    def query_lotto(modello):
+        return (
+            select(
+                modello.id,
+                modello.data,
+                modello.numero_lotto,
+                modello.quantita_totale,
+                Campo.id.label("campo_id"),
+                Campo.nome.label("campo"),
+                Campo.superficie_ettari,
+                Prodotto.nome_commerciale.label("prodotto"),
+                Prodotto.unita_misura,
+            )
+            .join(Campo, modello.campo_id == Campo.id)
+            .join(Prodotto, modello.prodotto_id == Prodotto.id)
+            .where(
+                Campo.azienda_id == azienda_id,
+                # lower() su entrambi i lati (in SQLite solo ASCII): usa l'indice su lower(numero_lotto)
+                func.lower(modello.numero_lotto) == func.lower(numero),
+            )
+        )
+
+    # Anche le stagioni archiviate: un richiamo può riguardare lotti usati anni prima
+    unione = union_all(query_lotto(Trattamento), query_lotto(TrattamentoArchiviato)).subquery()
+    query = select(unione).order_by(unione.c.data.desc())
+    return [
+        {
+            "trattamento_id": r.id,
+            "data": r.data.isoformat(),
+            "numero_lotto": r.numero_lotto,
+            "campo_id": r.campo_id,
+            "campo": r.campo,
+            "superficie_ettari": r.superficie_ettari,
+            "prodotto": r.prodotto,
+            "quantita_totale": r.quantita_totale,
+            "unita_misura": r.unita_misura,
+        }
+        for r in db.execute(query)
+    ]
+
+
+if __name__ == "__main__":
+    from models import engine, init_db
+
+    print("🔎 Ricostruzione indice di ricerca...\n")
+    init_db()
+    with engine.begin() as conn:
+        ricostruisci_indice(conn)
+    print("🎉 Indice di ricerca ricostruito!")
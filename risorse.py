@@ -0,0 +1,214 @@
+"""
+Risorse statiche: CSS Tailwind precompilato, Leaflet in locale e URL con impronta
+
+Le pagine non dipendono da CDN: il CSS è generato una volta con la CLI di
+Tailwind dalle classi usate nei template (static/src/app.css ->
+static/css/app.css, solo le regole usate) e Leaflet è copiato in
+static/vendor/leaflet. I file generati sono nel repository: il deploy non
+richiede rete né Node, e l'avvio si ferma se ne manca uno. Le tavolette in campo scaricano un foglio di stile
+già pronto invece dello script che compila il CSS nel browser a ogni
+pagina, e l'app funziona anche su una rete aziendale senza Internet (le
+tessere della mappa restano online).
+
+I template indicano i file con url_statico("css/app.css"), che aggiunge al
+nome l'impronta del contenuto (/static/css/app.3f2a9c1b0d.css). Con
+l'impronta giusta il file è servito con Cache-Control immutable per un
+anno: un file modificato ha un altro nome, quindi il browser non lo
+richiede più finché non cambia.
+
+Uso:
+    python risorse.py              # scarica Leaflet e genera il CSS
+    python risorse.py --css        # solo il CSS (dopo aver modificato i template)
+    python risorse.py --stato      # file presenti e impronte
+"""
+import base64
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+from typing import Optional
+
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+CARTELLA = "static"
+
+# File generati da questo script e inclusi nel repository (verificati all'avvio)
+CSS = "css/app.css"
+LEAFLET_CSS = "vendor/leaflet/leaflet.css"
+LEAFLET_JS = "vendor/leaflet/leaflet.js"
+
+TAILWIND_VERSIONE = "3.4.17"
+TAILWIND_CONFIG = "tailwind.config.js"
+TAILWIND_SORGENTE = "static/src/app.css"
+
+LEAFLET_VERSIONE = "1.9.4"
+LEAFLET_URL = f"https://unpkg.com/leaflet@{LEAFLET_VERSIONE}/dist/"
+# File della distribuzione -> hash SRI pubblicato su leafletjs.com (None: immagini, non verificate)
+LEAFLET_FILE = {
+    "leaflet.css": "sha256-p4NxAoJBhIIN+hmNHrzRCf9tD/miZyoHS5obTRR9BMY=",
+    "leaflet.js": "sha256-20nQCchB9co0qIjJZRGuk2/Z9VM+kNiyxNV1lvTlZBo=",
+    "images/layers.png": None,
+    "images/layers-2x.png": None,
+    "images/marker-icon.png": None,
+    "images/marker-icon-2x.png": None,
+    "images/marker-shadow.png": None,
+}
+
+IMMUTABILE = "public, max-age=31536000, immutable"
+RICONVALIDA = "no-cache"
+
+# nome.<impronta>.estensione
+CON_IMPRONTA = re.compile(r"^(?P<base>.+)\.(?P<impronta>[0-9a-f]{10})(?P<estensione>\.[A-Za-z0-9]+)$")
+
+_impronte = {}  # percorso -> (mtime_ns, dimensione, impronta)
+
+
+# ========== IMPRONTE ==========
+
+def _percorso_sicuro(percorso: str) -> Optional[str]:
+    """Percorso su disco dentro CARTELLA, None se esce dalla cartella"""
+    normalizzato = os.path.normpath(percorso)
+    if os.path.isabs(normalizzato) or normalizzato.startswith(".."):
+        return None
+    return os.path.join(CARTELLA, normalizzato)
+
+
+def impronta(percorso: str) -> Optional[str]:
+    """Primi 10 caratteri dello SHA-256 del file (relativo a static/), None se non esiste"""
+    completo = _percorso_sicuro(percorso)
+    try:
+        stato = os.stat(completo) if completo else None
+    except OSError:
+        return None
+    if stato is None:
+        return None
+    # Ricalcolata solo se il file cambia (un os.stat per pagina, nessuna lettura)
+    in_cache = _impronte.get(percorso)
+    if in_cache and in_cache[:2] == (stato.st_mtime_ns, stato.st_size):
+        return in_cache[2]
+    with open(completo, "rb") as file:
+        valore = hashlib.sha256(file.read()).hexdigest()[:10]
+    _impronte[percorso] = (stato.st_mtime_ns, stato.st_size, valore)
+    return valore
+
+
+def disponibile(percorso: str) -> bool:
+    return impronta(percorso) is not None
+
+
+def url_statico(percorso: str) -> str:
+    """URL del file con l'impronta nel nome (senza, se il file non esiste)"""
+    valore = impronta(percorso)
+    if valore is None:
+        return f"/{CARTELLA}/{percorso}"
+    base, estensione = os.path.splitext(percorso)
+    return f"/{CARTELLA}/{base}.{valore}{estensione}"
+
+
+class StaticFilesImpronta(StaticFiles):
+    """
+    StaticFiles che riconosce i nomi con impronta
+
+    Con l'impronta corrente: file originale e cache immutabile. Con
+    un'impronta superata (pagina in cache da prima di un aggiornamento) il
+    contenuto attuale senza cache lunga, invece di un 404. Gli altri file
+    (upload, immagini di Leaflet) vengono riconvalidati con ETag.
+    """
+
+    async def get_response(self, path: str, scope) -> Response:
+        immutabile = False
+        corrispondenza = CON_IMPRONTA.match(path)
+        if corrispondenza:
+            originale = corrispondenza["base"] + corrispondenza["estensione"]
+            attuale = impronta(originale)
+            if attuale == corrispondenza["impronta"]:
+                path, immutabile = originale, True
+            elif attuale and not os.path.exists(os.path.join(self.directory, path)):
+                path = originale
+        risposta = await super().get_response(path, scope)
+        if risposta.status_code in (200, 304):
+            risposta.headers["Cache-Control"] = IMMUTABILE if immutabile else RICONVALIDA
+        return risposta
+
+
+def mancanti() -> list:
+    """Risorse da generare con python risorse.py"""
+    return [p for p in (CSS, LEAFLET_CSS, LEAFLET_JS) if not disponibile(p)]
+
+
+def verifica_risorse():
+    """Controllo all'avvio: senza CSS e Leaflet le pagine non avrebbero stile né mappa"""
+    if mancanti():
+        raise RuntimeError(
+            f"Risorse statiche mancanti ({', '.join(mancanti())}): eseguire python risorse.py"
+        )
+
+
+# ========== GENERAZIONE ==========
+
+def scarica_leaflet(destinazione: str = os.path.join(CARTELLA, "vendor", "leaflet")):
+    """Copia in locale la distribuzione di Leaflet, verificando CSS e JavaScript con l'hash SRI"""
+    import httpx
+
+    for nome, sri in LEAFLET_FILE.items():
+        risposta = httpx.get(LEAFLET_URL + nome, follow_redirects=True, timeout=30)
+        risposta.raise_for_status()
+        if sri:
+            calcolato = "sha256-" + base64.b64encode(hashlib.sha256(risposta.content).digest()).decode()
+            if calcolato != sri:
+                raise ValueError(f"{nome}: hash {calcolato} diverso da quello pubblicato {sri}")
+        percorso = os.path.join(destinazione, nome)
+        os.makedirs(os.path.dirname(percorso), exist_ok=True)
+        with open(percorso + ".tmp", "wb") as file:
+            file.write(risposta.content)
+        os.replace(percorso + ".tmp", percorso)
+        print(f"  📥 {nome} ({len(risposta.content)} byte)")
+
+
+def genera_css(destinazione: str = os.path.join(CARTELLA, CSS)):
+    """
+    CSS con le sole classi usate nei template (CLI di Tailwind, minificato)
+
+    Usa l'eseguibile tailwindcss se è nel PATH (la versione standalone non
+    richiede Node), altrimenti npx.
+    """
+    eseguibile = shutil.which("tailwindcss")
+    if eseguibile:
+        comando = [eseguibile]
+    elif shutil.which("npx"):
+        comando = ["npx", "--yes", f"tailwindcss@{TAILWIND_VERSIONE}"]
+    else:
+        raise RuntimeError(
+            "Serve la CLI di Tailwind: eseguibile standalone tailwindcss nel PATH "
+            "(https://github.com/tailwindlabs/tailwindcss/releases) oppure Node.js con npx"
+        )
+    os.makedirs(os.path.dirname(destinazione), exist_ok=True)
+    subprocess.run(
+        [*comando, "-c", TAILWIND_CONFIG, "-i", TAILWIND_SORGENTE, "-o", destinazione, "--minify"],
+        check=True,
+    )
+    print(f"  🎨 {destinazione} ({os.path.getsize(destinazione)} byte)")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Genera le risorse statiche (CSS Tailwind, Leaflet)")
+    parser.add_argument("--css", action="store_true", help="Solo il CSS")
+    parser.add_argument("--stato", action="store_true", help="Mostra le risorse e le impronte")
+    args = parser.parse_args()
+
+    if args.stato:
+        for percorso in (CSS, LEAFLET_CSS, LEAFLET_JS):
+            valore = impronta(percorso)
+            print(f"{'✅' if valore else '❌'} {percorso}" + (f" -> {url_statico(percorso)}" if valore else " (mancante)"))
+        raise SystemExit(1 if mancanti() else 0)
+
+    if not args.css:
+        print(f"🗺️  Leaflet {LEAFLET_VERSIONE}...")
+        scarica_leaflet()
+    print(f"🎨 CSS Tailwind {TAILWIND_VERSIONE}...")
+    genera_css()
+    print("✅ Risorse statiche generate")
@@ -1,23 +1,34 @@
 """
 Script di seed per popolare il database con dati di prova
+
+    python seed.py             # dati dimostrativi: 1 azienda, 3 campi, 2 trattamenti
+    python seed.py --massivo --aziende 20 --trattamenti 5000000 --stagioni 10 --seme 42
+
+Con --massivo genera un database sintetico di grandi dimensioni per le
+misure di prestazione (vedi seed_massivo).
 """
+import math
+import random
+import time
+from collections import defaultdict
+from sqlalchemy import insert, select, func, text
 from sqlalchemy.orm import Session
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
+from typing import Callable, List, Optional
 from models import (
-    engine, SessionLocal,
-    User, Azienda, Campo, Prodotto, Mezzo, Trattamento, TipoProdotto
+    SessionLocal, init_db,
+    User, Azienda, Campo, Prodotto, Mezzo, Trattamento, TipoProdotto, TipoMovimento,
+    InterventoManutenzione, LimiteProdotto, MovimentoMagazzino
 )
+from geometria import area_ettari, centro_poligono
+from registro_magazzino import registra_movimento, inizializza_giacenze, ricostruisci_giacenze
+from limiti_dose import aggiorna_contatori, ricalcola_contatori
+from ricerca import ricostruisci_indice
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
-def init_db():
-    """Inizializza il database"""
-    from models import Base
-    Base.metadata.create_all(bind=engine)
-
-
 def seed_data():
     """Popola il database con dati di prova"""
     db = SessionLocal()
@@ -121,6 +132,8 @@ def seed_data():
                 **prodotto_data
             )
             db.add(prodotto)
+        db.flush()
+        inizializza_giacenze(db, azienda.id)  # Giacenze iniziali nel registro movimenti
         db.commit()
         print(f"✅ Creati {len(prodotti_data)} prodotti")
         
@@ -196,6 +209,12 @@ def seed_data():
                     operatore=tr_data["operatore"]
                 )
                 db.add(trattamento)
+                db.flush()
+                aggiorna_contatori(db, trattamento)
+                registra_movimento(
+                    db, trattamento.prodotto_id, TipoMovimento.TRATTAMENTO, -quantita_totale,
+                    data=trattamento.data, trattamento_id=trattamento.id
+                )
             db.commit()
             print(f"✅ Creati {len(trattamenti_data)} trattamenti")
         
@@ -212,9 +231,491 @@ def seed_data():
         db.close()
 
 
+# ========== DATI MASSIVI ==========
+
+# Area di generazione dei campi (pianura padana)
+AREA_LAT = (44.8, 45.6)
+AREA_LNG = (8.6, 12.2)
+
+COLTURE = ["Mais", "Grano", "Soia", "Orzo", "Riso", "Girasole", "Erba medica", "Pomodoro", "Vite", "Pero"]
+FITOFARMACI = [
+    "Roundup", "Fungicida X", "Ossicloruro di rame", "Zolfo bagnabile", "Deltametrina", "Mancozeb",
+    "Tebuconazolo", "Glifosate 360", "Clorantraniliprole", "Azoxystrobin", "Spinosad", "Metribuzin",
+]
+CONCIMI = ["Urea 46%", "NPK 20-10-10", "Nitrato ammonico 27%", "Solfato potassico", "Perfosfato 19%", "Letame pellettato"]
+AVVERSITA = [
+    "Erbe infestanti", "Peronospora", "Oidio", "Piralide", "Diabrotica", "Afidi", "Septoria",
+    "Ruggine", "Botrite", "Ticchiolatura", "Cimice asiatica", "Dorifora",
+]
+OPERATORI = ["Mario Rossi", "Luigi Bianchi", "Giovanni Verdi", "Paolo Neri", "Anna Galli", "Marco Ferrari", "Sara Colombo"]
+CONDIZIONI_METEO = ["Sereno", "Poco nuvoloso", "Nuvoloso", "Coperto", "Vento debole"]
+TIPI_MEZZO = ["Trattore", "Atomizzatore", "Spandiconcime", "Irroratrice", "Seminatrice", "Mietitrebbia"]
+MARCHE = ["John Deere", "New Holland", "Fendt", "Same", "Landini", "Kuhn", "Lemken"]
+TIPI_INTERVENTO = ["Revisione", "Tagliando", "Riparazione", "Cambio olio", "Taratura irroratrice"]
+OFFICINE = ["Officina Agricola Rossi", "Centro Assistenza Verdi", "Meccanica Padana", None]
+
+# Tabelle riempite dal generatore (i trigger su PostgreSQL vengono sospesi su queste)
+TABELLE_GENERATE = [
+    "users", "aziende", "campi", "prodotti", "limiti_prodotti", "mezzi",
+    "interventi_manutenzione", "trattamenti", "movimenti_magazzino",
+]
+
+
+def _prossimo_id(db: Session, modello) -> int:
+    return (db.execute(select(func.max(modello.id))).scalar() or 0) + 1
+
+
+def _poligono(rng: random.Random, ettari: float) -> List[List[float]]:
+    """Poligono irregolare (5-10 vertici) di circa `ettari` ettari in un punto casuale dell'area"""
+    lati = rng.randint(5, 10)
+    lat_centro = rng.uniform(*AREA_LAT)
+    lng_centro = rng.uniform(*AREA_LNG)
+    # Raggio del poligono regolare con la stessa area
+    raggio = math.sqrt(ettari * 10000.0 / (0.5 * lati * math.sin(2 * math.pi / lati)))
+    metri_per_grado_lng = 111320.0 * math.cos(math.radians(lat_centro))
+    rotazione = rng.uniform(0, 2 * math.pi)
+
+    anello = []
+    for i in range(lati):
+        angolo = rotazione + 2 * math.pi * (i + rng.uniform(-0.25, 0.25)) / lati
+        distanza = raggio * rng.uniform(0.85, 1.15)
+        anello.append([
+            round(lat_centro + distanza * math.sin(angolo) / 111320.0, 6),
+            round(lng_centro + distanza * math.cos(angolo) / metri_per_grado_lng, 6),
+        ])
+    return anello
+
+
+def _sospendi_trigger(db: Session) -> List[str]:
+    """
+    Disattiva i trigger (ricerca, sincronizzazione, cascate) durante il caricamento
+
+    Su SQLite vengono eliminati e restituiti per ricrearli identici; su
+    PostgreSQL restano definiti ma disattivati (DISABLE TRIGGER USER lascia
+    attivi i vincoli di chiave esterna).
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        for tabella in TABELLE_GENERATE:
+            db.execute(text(f"ALTER TABLE {tabella} DISABLE TRIGGER USER"))
+        db.commit()
+        return []
+
+    trigger = db.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")).all()
+    for nome, _ in trigger:
+        db.execute(text(f"DROP TRIGGER {nome}"))
+    db.commit()
+    return [sql for _, sql in trigger]
+
+
+def _ripristina_trigger(db: Session, ddl: List[str]):
+    if db.get_bind().dialect.name == "postgresql":
+        for tabella in TABELLE_GENERATE:
+            db.execute(text(f"ALTER TABLE {tabella} ENABLE TRIGGER USER"))
+            # Gli id sono assegnati dal generatore: le sequenze ripartono dal massimo
+            db.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{tabella}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 1) FROM {tabella}))"
+            ))
+    else:
+        for istruzione in ddl:
+            db.execute(text(istruzione))
+    db.commit()
+
+
+class GeneratoreMassivo:
+    """
+    Genera aziende, campi, prodotti, mezzi, interventi e trattamenti sintetici
+
+    Tutti i valori vengono da un unico random.Random(seme) e dalle date
+    delle stagioni: a parità di parametri il database generato è identico.
+    Gli id sono assegnati qui (nessun RETURNING) e le righe inserite con
+    INSERT multipli, un blocco per transazione.
+    """
+
+    def __init__(self, db: Session, seme: int, ultimo_anno: int, stagioni: int,
+                 dimensione_blocco: int, progresso: Callable[[str], None]):
+        self.db = db
+        self.rng = random.Random(seme)
+        self.anni = list(range(ultimo_anno - stagioni + 1, ultimo_anno + 1))
+        self.dimensione_blocco = dimensione_blocco
+        self.progresso = progresso
+        self.revisione = db.execute(text("SELECT revisione FROM sync_stato WHERE id = 1")).scalar() or 0
+
+    def _revisione(self) -> int:
+        """Revisione di sincronizzazione (normalmente assegnata dai trigger)"""
+        self.revisione += 1
+        return self.revisione
+
+    def _inserisci(self, modello, righe: List[dict]):
+        for inizio in range(0, len(righe), self.dimensione_blocco):
+            self.db.execute(insert(modello.__table__), righe[inizio:inizio + self.dimensione_blocco])
+        self.db.commit()
+
+    def anagrafiche(self, aziende: int, campi: int, prodotti: int, mezzi: int, interventi: int):
+        """Utenti, aziende, campi, prodotti (con limiti d'impiego), mezzi e interventi"""
+        rng = self.rng
+        password_hash = pwd_context.hash("admin123")  # Un solo hash bcrypt per tutti gli utenti
+
+        id_utente, id_azienda = _prossimo_id(self.db, User), _prossimo_id(self.db, Azienda)
+        id_campo, id_prodotto = _prossimo_id(self.db, Campo), _prossimo_id(self.db, Prodotto)
+        id_mezzo, id_intervento = _prossimo_id(self.db, Mezzo), _prossimo_id(self.db, InterventoManutenzione)
+
+        utenti, righe_aziende, righe_campi, righe_prodotti, limiti, righe_mezzi, righe_interventi = (
+            [], [], [], [], [], [], []
+        )
+        # Per azienda: [(campo_id, superficie)], [(prodotto_id, tipo, dose_min, dose_max)], [mezzo_id]
+        self.campi, self.prodotti, self.mezzi = [], {}, {}
+        # prodotto_id -> (max applicazioni per campo e anno, intervallo minimo in giorni)
+        self.limiti = {}
+
+        for a in range(aziende):
+            azienda_id = id_azienda + a
+            utenti.append({
+                "id": id_utente + a,
+                "username": "admin" if a == 0 else f"azienda{a + 1}",
+                "password_hash": password_hash,
+            })
+            righe_aziende.append({
+                "id": azienda_id,
+                "user_id": id_utente + a,
+                "ragione_sociale": f"Azienda Agricola {a + 1} S.r.l.",
+                "p_iva": f"IT{10000000000 + azienda_id:011d}",
+                "indirizzo": f"Via dei Campi, {a + 1}",
+                "legale_rappresentante": rng.choice(OPERATORI),
+            })
+
+            for _ in range(campi):
+                superficie_target = min(60.0, max(0.3, rng.lognormvariate(1.6, 0.7)))
+                anello = _poligono(rng, superficie_target)
+                centro_lat, centro_lng = centro_poligono(anello)
+                superficie = area_ettari(anello)
+                righe_campi.append({
+                    "id": id_campo,
+                    "azienda_id": azienda_id,
+                    "nome": f"Campo {len(righe_campi) + 1}",
+                    "superficie_ettari": superficie,
+                    "coordinate_poligono": anello,
+                    "centro_lat": centro_lat,
+                    "centro_lng": centro_lng,
+                    "coltura_attuale": rng.choice(COLTURE),
+                    "revisione": self._revisione(),
+                })
+                self.campi.append((id_campo, azienda_id, superficie))
+                id_campo += 1
+
+            self.prodotti[azienda_id] = []
+            for p in range(prodotti):
+                # Il primo prodotto è un fitofarmaco senza limiti: c'è sempre un trattamento consentito
+                fitofarmaco = p == 0 or rng.random() < 0.7
+                if fitofarmaco:
+                    nome = FITOFARMACI[p % len(FITOFARMACI)]
+                    dose_min, dose_max = rng.choice([(0.2, 1.5), (0.5, 3.0), (1.0, 5.0)])
+                    tipo, unita = TipoProdotto.FITOFARMACO, "L"
+                else:
+                    nome = CONCIMI[p % len(CONCIMI)]
+                    dose_min, dose_max = rng.choice([(50.0, 150.0), (100.0, 300.0), (150.0, 400.0)])
+                    tipo, unita = TipoProdotto.CONCIME, "kg"
+                righe_prodotti.append({
+                    "id": id_prodotto,
+                    "azienda_id": azienda_id,
+                    "nome_commerciale": f"{nome} {p + 1}",
+                    "tipo": tipo,
+                    "quantita_disponibile": 0.0,  # Ricalcolato dai movimenti alla fine
+                    "unita_misura": unita,
+                    "revisione": self._revisione(),
+                })
+                if fitofarmaco and p > 0 and rng.random() < 0.5:
+                    limiti.append({
+                        "prodotto_id": id_prodotto,
+                        "dose_max_ettaro": dose_max,
+                        "max_applicazioni_anno": rng.randint(3, 8),
+                        "intervallo_minimo_giorni": rng.choice([7, 10, 14]),
+                    })
+                    self.limiti[id_prodotto] = (limiti[-1]["max_applicazioni_anno"], limiti[-1]["intervallo_minimo_giorni"])
+                self.prodotti[azienda_id].append((id_prodotto, tipo, dose_min, dose_max))
+                id_prodotto += 1
+
+            self.mezzi[azienda_id] = []
+            for m in range(mezzi):
+                tipo_mezzo = TIPI_MEZZO[m % len(TIPI_MEZZO)]
+                righe_mezzi.append({
+                    "id": id_mezzo,
+                    "azienda_id": azienda_id,
+                    "nome": f"{tipo_mezzo} {m + 1}",
+                    "tipo_mezzo": tipo_mezzo,
+                    "marca": rng.choice(MARCHE),
+                    "targa": f"AG{rng.randint(100, 999)}{chr(65 + rng.randint(0, 25))}{chr(65 + rng.randint(0, 25))}",
+                    "anno_acquisto": rng.randint(self.anni[0] - 15, self.anni[-1]),
+                    "data_revisione": date(self.anni[-1] + 1, rng.randint(1, 12), rng.randint(1, 28)),
+                    "revisione": self._revisione(),
+                })
+                for _ in range(interventi):
+                    tipo_intervento = rng.choice(TIPI_INTERVENTO)
+                    data_intervento = date(rng.choice(self.anni), rng.randint(1, 12), rng.randint(1, 28))
+                    righe_interventi.append({
+                        "id": id_intervento,
+                        "mezzo_id": id_mezzo,
+                        "data_intervento": data_intervento,
+                        "tipo_intervento": tipo_intervento,
+                        "descrizione": f"{tipo_intervento} periodica",
+                        "costo": round(rng.uniform(80, 2500), 2),
+                        "officina": rng.choice(OFFICINE),
+                        "prossima_scadenza": data_intervento + timedelta(days=365) if tipo_intervento == "Revisione" else None,
+                        "revisione": self._revisione(),
+                    })
+                    id_intervento += 1
+                self.mezzi[azienda_id].append(id_mezzo)
+                id_mezzo += 1
+
+        for modello, righe in [
+            (User, utenti), (Azienda, righe_aziende), (Campo, righe_campi), (Prodotto, righe_prodotti),
+            (LimiteProdotto, limiti), (Mezzo, righe_mezzi), (InterventoManutenzione, righe_interventi),
+        ]:
+            if righe:
+                self._inserisci(modello, righe)
+        self.progresso(
+            f"✅ {len(righe_aziende)} aziende, {len(righe_campi)} campi, {len(righe_prodotti)} prodotti, "
+            f"{len(righe_mezzi)} mezzi, {len(righe_interventi)} interventi"
+        )
+
+    def _date_stagione(self, anno: int, numero: int) -> List[date]:
+        """`numero` date tra marzo e ottobre, più fitte tra maggio e luglio, in ordine"""
+        inizio = date(anno, 3, 1)
+        giorni = [inizio + timedelta(days=g) for g in range((date(anno, 10, 31) - inizio).days + 1)]
+        pesi = [1.0 + math.sin(math.pi * g / len(giorni)) ** 2 * 2 for g in range(len(giorni))]
+        return sorted(self.rng.choices(giorni, weights=pesi, k=numero))
+
+    def _consentito(self, prodotto_id: int, campo_id: int, data: date, applicazioni: dict, ultime: dict) -> bool:
+        """True se i limiti del prodotto ammettono un'altra applicazione sul campo in quella data"""
+        limite = self.limiti.get(prodotto_id)
+        if limite is None:
+            return True
+        massimo, intervallo = limite
+        ultima = ultime.get((campo_id, prodotto_id))
+        return applicazioni[(campo_id, prodotto_id)] < massimo and (ultima is None or (data - ultima).days >= intervallo)
+
+    def _scegli_prodotto(self, campo_id: int, azienda_id: int, data: date, applicazioni: dict, ultime: dict) -> tuple:
+        """Prodotto a caso tra quelli che i limiti d'impiego consentono (di solito il primo estratto)"""
+        prodotti = self.prodotti[azienda_id]
+        scelto = self.rng.choice(prodotti)
+        if self._consentito(scelto[0], campo_id, data, applicazioni, ultime):
+            return scelto
+        return self.rng.choice([p for p in prodotti if self._consentito(p[0], campo_id, data, applicazioni, ultime)])
+
+    def trattamenti(self, totale: int):
+        """
+        Trattamenti in ordine cronologico, con lo scarico di magazzino di ciascuno
+
+        Gli id crescono con la data, come in un database reale. Ogni
+        prodotto riceve un carico per stagione pari al consumo (più una
+        scorta), datato 1 febbraio. I trattamenti rispettano i limiti
+        d'impiego generati (dose, applicazioni per campo e anno, intervallo
+        minimo): i dati passano la stessa verifica delle registrazioni.
+        """
+        rng = self.rng
+        id_trattamento = _prossimo_id(self.db, Trattamento)
+        id_movimento = _prossimo_id(self.db, MovimentoMagazzino)
+        consumi = defaultdict(float)  # (prodotto_id, anno) -> quantità usata
+        ultime = {}  # (campo_id, prodotto_id) -> data dell'ultima applicazione
+        generati = 0
+        inizio = time.perf_counter()
+
+        for indice_anno, anno in enumerate(self.anni):
+            numero = totale // len(self.anni) + (1 if indice_anno < totale % len(self.anni) else 0)
+            # Alcuni lotti per prodotto e stagione
+            lotti = {}
+            applicazioni = defaultdict(int)  # (campo_id, prodotto_id) -> applicazioni nell'anno
+            trattamenti, movimenti = [], []
+
+            for data in self._date_stagione(anno, numero):
+                campo_id, azienda_id, superficie = self.campi[rng.randrange(len(self.campi))]
+                prodotto_id, tipo, dose_min, dose_max = self._scegli_prodotto(
+                    campo_id, azienda_id, data, applicazioni, ultime
+                )
+                applicazioni[(campo_id, prodotto_id)] += 1
+                ultime[(campo_id, prodotto_id)] = data
+                dose = round(rng.uniform(dose_min, dose_max), 2)
+                quantita_totale = round(dose * superficie, 3)
+                lotto = lotti.get(prodotto_id)
+                if lotto is None:
+                    lotto = lotti[prodotto_id] = [f"L{anno % 100:02d}{prodotto_id:05d}{n}" for n in "ABC"]
+                fitofarmaco = tipo is TipoProdotto.FITOFARMACO
+                mezzi = self.mezzi[azienda_id]
+
+                trattamenti.append({
+                    "id": id_trattamento,
+                    "campo_id": campo_id,
+                    "data": data,
+                    "prodotto_id": prodotto_id,
+                    "avversita": rng.choice(AVVERSITA) if fitofarmaco else None,
+                    "quantita_per_ettaro": dose,
+                    "quantita_totale": quantita_totale,
+                    "operatore": rng.choice(OPERATORI),
+                    "mezzo_id": rng.choice(mezzi) if mezzi and rng.random() < 0.85 else None,
+                    "condizioni_meteo": rng.choice(CONDIZIONI_METEO),
+                    "temperatura": round(rng.uniform(8, 32), 1),
+                    "umidita": round(rng.uniform(35, 90), 1),
+                    "velocita_vento": round(rng.uniform(0, 12), 1),
+                    "note": None,
+                    "numero_lotto": rng.choice(lotto) if fitofarmaco else None,
+                    "revisione": self._revisione(),
+                })
+                movimenti.append({
+                    "id": id_movimento,
+                    "prodotto_id": prodotto_id,
+                    "data": data,
+                    "tipo": TipoMovimento.TRATTAMENTO,
+                    "quantita": -quantita_totale,
+                    "trattamento_id": id_trattamento,
+                    "creato_il": datetime.combine(data, datetime.min.time()),
+                })
+                consumi[(prodotto_id, anno)] += quantita_totale
+                id_trattamento += 1
+                id_movimento += 1
+
+                if len(trattamenti) >= self.dimensione_blocco:
+                    generati += self._scrivi_trattamenti(trattamenti, movimenti)
+                    trattamenti, movimenti = [], []
+                    self.progresso(
+                        f"  📋 {generati} trattamenti ({generati / (time.perf_counter() - inizio):.0f}/s)"
+                    )
+
+            if trattamenti:
+                generati += self._scrivi_trattamenti(trattamenti, movimenti)
+            self.progresso(f"  📅 Stagione {anno} completata ({generati} trattamenti)")
+
+        carichi = []
+        for (prodotto_id, anno), consumo in sorted(consumi.items()):
+            carichi.append({
+                "id": id_movimento,
+                "prodotto_id": prodotto_id,
+                "data": date(anno, 2, 1),
+                "tipo": TipoMovimento.CARICO,
+                "quantita": round(consumo * rng.uniform(1.05, 1.3), 1),
+                "riferimento": f"FT-{anno}-{id_movimento}",
+                "creato_il": datetime(anno, 2, 1),
+            })
+            id_movimento += 1
+        self._inserisci(MovimentoMagazzino, carichi)
+        return generati
+
+    def _scrivi_trattamenti(self, trattamenti: List[dict], movimenti: List[dict]) -> int:
+        self.db.execute(insert(Trattamento.__table__), trattamenti)
+        self.db.execute(insert(MovimentoMagazzino.__table__), movimenti)
+        self.db.commit()
+        return len(trattamenti)
+
+    def completa(self):
+        """Dati derivati: giacenze, contatori d'impiego, indice di ricerca e revisione di sincronizzazione"""
+        ricostruisci_giacenze(self.db)
+        ricalcola_contatori(self.db)
+        self.db.execute(text("UPDATE sync_stato SET revisione = :revisione WHERE id = 1"), {"revisione": self.revisione})
+        # Revisione delle aziende (ETag, frammenti e report): i trigger erano sospesi
+        self.db.execute(text(
+            "INSERT INTO sync_revisioni_aziende (azienda_id, revisione) SELECT id, :revisione FROM aziende WHERE true "
+            "ON CONFLICT (azienda_id) DO UPDATE SET revisione = EXCLUDED.revisione"
+        ), {"revisione": self.revisione})
+        self.db.commit()
+        self.progresso("✅ Giacenze e contatori ricalcolati")
+        ricostruisci_indice(self.db.connection())
+        self.db.commit()
+        self.progresso("✅ Indice di ricerca ricostruito")
+
+
+def seed_massivo(
+    aziende: int = 10,
+    campi: int = 50,
+    prodotti: int = 30,
+    mezzi: int = 6,
+    interventi: int = 10,
+    trattamenti: int = 1_000_000,
+    stagioni: int = 10,
+    seme: int = 42,
+    ultimo_anno: Optional[int] = None,
+    dimensione_blocco: int = 20000,
+    progresso: Callable[[str], None] = print,
+    db: Optional[Session] = None,
+) -> dict:
+    """
+    Popola un database vuoto con un'azienda agricola sintetica di grandi dimensioni
+
+    `campi`, `prodotti` e `mezzi` sono per azienda, `interventi` per mezzo;
+    i `trattamenti` (totali) sono distribuiti sulle `stagioni` che finiscono
+    con `ultimo_anno` (default: anno corrente). Il primo utente è admin /
+    admin123, gli altri azienda2, azienda3... con la stessa password.
+
+    Durante il caricamento i trigger sono sospesi: revisioni di
+    sincronizzazione, giacenze, contatori e indice di ricerca vengono
+    calcolati alla fine in blocco. Restituisce i tempi delle fasi.
+    """
+    chiudi = db is None
+    db = db or SessionLocal()
+    tempi = {}
+    try:
+        if db.execute(select(User.id).limit(1)).first() is not None:
+            raise ValueError("Il database contiene già dei dati: il generatore massivo richiede un database vuoto")
+
+        generatore = GeneratoreMassivo(
+            db, seme, ultimo_anno or date.today().year, stagioni, dimensione_blocco, progresso
+        )
+        ddl = _sospendi_trigger(db)
+        try:
+            inizio = time.perf_counter()
+            generatore.anagrafiche(aziende, campi, prodotti, mezzi, interventi)
+            tempi["anagrafiche"] = time.perf_counter() - inizio
+
+            inizio = time.perf_counter()
+            generatore.trattamenti(trattamenti)
+            tempi["trattamenti"] = time.perf_counter() - inizio
+        finally:
+            db.rollback()
+            _ripristina_trigger(db, ddl)
+
+        inizio = time.perf_counter()
+        generatore.completa()
+        tempi["derivati"] = time.perf_counter() - inizio
+        return tempi
+    finally:
+        if chiudi:
+            db.close()
+
+
 if __name__ == "__main__":
+    import argparse
+    import logging
+
+    parser = argparse.ArgumentParser(description="Popola il database con dati di prova")
+    parser.add_argument("--massivo", action="store_true", help="Database sintetico di grandi dimensioni (database vuoto)")
+    parser.add_argument("--aziende", type=int, default=10)
+    parser.add_argument("--campi", type=int, default=50, help="Campi per azienda")
+    parser.add_argument("--prodotti", type=int, default=30, help="Prodotti per azienda")
+    parser.add_argument("--mezzi", type=int, default=6, help="Mezzi per azienda")
+    parser.add_argument("--interventi", type=int, default=10, help="Interventi di manutenzione per mezzo")
+    parser.add_argument("--trattamenti", type=int, default=1_000_000, help="Trattamenti totali")
+    parser.add_argument("--stagioni", type=int, default=10, help="Stagioni (anni) su cui distribuire i trattamenti")
+    parser.add_argument("--ultimo-anno", type=int, help="Ultima stagione generata (default: anno corrente)")
+    parser.add_argument("--seme", type=int, default=42, help="Seme del generatore casuale")
+    parser.add_argument("--blocco", type=int, default=20000, help="Righe per transazione")
+    args = parser.parse_args()
+
     print("🌱 Inizializzazione database...")
     init_db()
-    print("🌱 Popolamento database con dati di prova...\n")
-    seed_data()
+    if not args.massivo:
+        print("🌱 Popolamento database con dati di prova...\n")
+        seed_data()
+    else:
+        logging.getLogger("agrinote.sql").setLevel(logging.ERROR)  # Le query del caricamento sono lente per scelta
+        print(f"🌱 Generazione di {args.trattamenti} trattamenti su {args.stagioni} stagioni (seme {args.seme})...\n")
+        inizio = time.perf_counter()
+        try:
+            tempi = seed_massivo(
+                args.aziende, args.campi, args.prodotti, args.mezzi, args.interventi,
+                args.trattamenti, args.stagioni, args.seme, args.ultimo_anno, args.blocco,
+            )
+        except ValueError as e:
+            print(f"⚠️  {e}. Elimina il file agrinote.db per ricreare i dati.")
+            raise SystemExit(1)
+        print(f"\n🎉 Database generato in {time.perf_counter() - inizio:.0f}s "
+              + ", ".join(f"{fase} {secondi:.0f}s" for fase, secondi in tempi.items()))
+        print("📌 Credenziali: admin / admin123 (altre aziende: azienda2, azienda3... stessa password)")
 
@@ -0,0 +1,430 @@
+"""
+Sincronizzazione incrementale per i dispositivi offline (tablet in campo)
+
+Ogni inserimento o modifica di campi, prodotti, mezzi, trattamenti e
+interventi riceve una revisione da un contatore globale; le eliminazioni
+lasciano una riga in sync_eliminazioni. Revisioni ed eliminazioni sono
+registrate da trigger sul database, quindi valgono anche per import
+massivi e script. Il dispositivo chiede solo le modifiche successive
+all'ultima revisione ricevuta (il cursore).
+
+Gli stessi trigger salvano in sync_revisioni_aziende l'ultima revisione
+dei dati di ogni azienda: ETag, frammenti di pagina e report la usano
+come versione dei dati, in tutti i worker e anche dopo modifiche fatte
+da script, e non cambiano quando a modificare i dati è un'altra azienda.
+"""
+import math
+from datetime import date, datetime
+from enum import Enum
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, insert, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from importa_trattamenti import scrivi_blocco, TESTO, NUMERI
+from models import (
+    Campo, Prodotto, Mezzo, Trattamento, TrattamentoArchiviato, InterventoManutenzione,
+    StatoSync, RevisioneAzienda, EliminazioneSync
+)
+
+MAX_MODIFICHE = 1000
+MAX_CARICAMENTO = 1000
+
+# Tabelle sincronizzate: tabella -> (modello, azienda della riga nei trigger)
+TABELLE = {
+    "campi": (Campo, "{r}.azienda_id"),
+    "prodotti": (Prodotto, "{r}.azienda_id"),
+    "mezzi": (Mezzo, "{r}.azienda_id"),
+    "trattamenti": (Trattamento, "(SELECT azienda_id FROM campi WHERE id = {r}.campo_id)"),
+    "interventi_manutenzione": (InterventoManutenzione, "(SELECT azienda_id FROM mezzi WHERE id = {r}.mezzo_id)"),
+}
+
+PROSSIMA_REVISIONE = "UPDATE sync_stato SET revisione = revisione + 1 WHERE id = 1"
+REVISIONE_CORRENTE = "(SELECT revisione FROM sync_stato WHERE id = 1)"
+
+
+def _revisione_aziende(azienda: str, righe: Tuple[str, ...], revisione: str) -> str:
+    """Upsert della revisione delle aziende delle righe (NEW, OLD o entrambe se un UPDATE cambia azienda)"""
+    aziende = " UNION ".join(f"SELECT {azienda.format(r=r)} AS azienda_id" for r in righe)
+    return (
+        f"INSERT INTO sync_revisioni_aziende (azienda_id, revisione) "
+        f"SELECT azienda_id, {revisione} FROM ({aziende}) AS righe WHERE azienda_id IS NOT NULL "
+        f"ON CONFLICT (azienda_id) DO UPDATE SET revisione = EXCLUDED.revisione"
+    )
+
+
+def _filtro_azienda(modello, azienda_id: int):
+    """Condizione WHERE per le righe di un'azienda (senza join)"""
+    if modello in (Trattamento, TrattamentoArchiviato):
+        return modello.campo_id.in_(select(Campo.id).where(Campo.azienda_id == azienda_id))
+    if modello is InterventoManutenzione:
+        return InterventoManutenzione.mezzo_id.in_(select(Mezzo.id).where(Mezzo.azienda_id == azienda_id))
+    return modello.azienda_id == azienda_id
+
+
+# ========== TRIGGER ==========
+
+def _ddl_sqlite() -> List[str]:
+    ddl = []
+    for tabella, (_, azienda) in TABELLE.items():
+        eliminazione = (
+            f"INSERT INTO sync_eliminazioni (tabella, riga_id, azienda_id, revisione) "
+            f"VALUES ('{tabella}', OLD.id, {azienda.format(r='OLD')}, {REVISIONE_CORRENTE})"
+        )
+        assegna = f"UPDATE {tabella} SET revisione = {REVISIONE_CORRENTE} WHERE id = NEW.id"
+        ddl += [
+            f"DROP TRIGGER IF EXISTS sync_{tabella}_ai",
+            f"DROP TRIGGER IF EXISTS sync_{tabella}_au",
+            f"DROP TRIGGER IF EXISTS sync_{tabella}_ad",
+            f"CREATE TRIGGER sync_{tabella}_ai AFTER INSERT ON {tabella} "
+            f"BEGIN {PROSSIMA_REVISIONE}; {assegna}; "
+            f"{_revisione_aziende(azienda, ('NEW',), REVISIONE_CORRENTE)}; END",
+            # La condizione evita di rieseguire il trigger per l'assegnazione della revisione
+            f"CREATE TRIGGER sync_{tabella}_au AFTER UPDATE ON {tabella} "
+            f"WHEN NEW.revisione = OLD.revisione "
+            f"BEGIN {PROSSIMA_REVISIONE}; {assegna}; "
+            f"{_revisione_aziende(azienda, ('NEW', 'OLD'), REVISIONE_CORRENTE)}; END",
+            f"CREATE TRIGGER sync_{tabella}_ad AFTER DELETE ON {tabella} "
+            f"BEGIN {PROSSIMA_REVISIONE}; {eliminazione}; "
+            f"{_revisione_aziende(azienda, ('OLD',), REVISIONE_CORRENTE)}; END",
+        ]
+    return ddl
+
+
+def _ddl_postgres() -> List[str]:
+    ddl = []
+    for tabella, (_, azienda) in TABELLE.items():
+        ddl += [
+            f"CREATE OR REPLACE FUNCTION sync_{tabella}() RETURNS trigger AS $$ "
+            f"DECLARE nuova INTEGER; BEGIN "
+            f"{PROSSIMA_REVISIONE} RETURNING revisione INTO nuova; "
+            f"IF TG_OP = 'DELETE' THEN "
+            f"INSERT INTO sync_eliminazioni (tabella, riga_id, azienda_id, revisione) "
+            f"VALUES ('{tabella}', OLD.id, {azienda.format(r='OLD')}, nuova); "
+            f"{_revisione_aziende(azienda, ('OLD',), 'nuova')}; RETURN OLD; END IF; "
+            f"IF TG_OP = 'UPDATE' THEN {_revisione_aziende(azienda, ('NEW', 'OLD'), 'nuova')}; "
+            f"ELSE {_revisione_aziende(azienda, ('NEW',), 'nuova')}; END IF; "
+            f"NEW.revisione := nuova; RETURN NEW; END $$ LANGUAGE plpgsql",
+            f"DROP TRIGGER IF EXISTS sync_{tabella}_modifica ON {tabella}",
+            f"CREATE TRIGGER sync_{tabella}_modifica BEFORE INSERT OR UPDATE ON {tabella} "
+            f"FOR EACH ROW EXECUTE FUNCTION sync_{tabella}()",
+            f"DROP TRIGGER IF EXISTS sync_{tabella}_eliminazione ON {tabella}",
+            f"CREATE TRIGGER sync_{tabella}_eliminazione AFTER DELETE ON {tabella} "
+            f"FOR EACH ROW EXECUTE FUNCTION sync_{tabella}()",
+        ]
+    return ddl
+
+
+def inizializza_sync(conn: Connection):
+    """
+    Crea il contatore delle revisioni e i trigger (idempotente, eseguita dalle migrazioni)
+
+    Alla prima esecuzione le righe esistenti ricevono revisioni distinte
+    (id + scostamento per tabella), così la prima sincronizzazione
+    (cursore 0) le include tutte e la paginazione per revisione resta esatta.
+    """
+    if conn.execute(text("SELECT revisione FROM sync_stato WHERE id = 1")).first() is None:
+        scostamento = 0
+        for tabella in TABELLE:
+            conn.execute(text(
+                f"UPDATE {tabella} SET revisione = id + :scostamento WHERE revisione = 0"
+            ), {"scostamento": scostamento})
+            scostamento += conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {tabella}")).scalar()
+        conn.execute(text("INSERT INTO sync_stato (id, revisione) VALUES (1, :revisione)"), {"revisione": scostamento})
+    # Aziende senza revisione propria: partono dalla revisione globale attuale
+    RevisioneAzienda.__table__.create(conn, checkfirst=True)
+    conn.execute(text(
+        "INSERT INTO sync_revisioni_aziende (azienda_id, revisione) "
+        "SELECT id, (SELECT revisione FROM sync_stato WHERE id = 1) FROM aziende "
+        "WHERE id NOT IN (SELECT azienda_id FROM sync_revisioni_aziende)"
+    ))
+    postgres = conn.dialect.name == "postgresql"
+    for istruzione in (_ddl_postgres() if postgres else _ddl_sqlite()):
+        conn.execute(text(istruzione))
+
+
+# ========== SCARICAMENTO ==========
+
+def _valore_json(valore):
+    if isinstance(valore, (date, datetime)):
+        return valore.isoformat()
+    if isinstance(valore, Enum):
+        return valore.value
+    return valore
+
+
+def _riga_json(oggetto) -> dict:
+    return {c.name: _valore_json(getattr(oggetto, c.key)) for c in oggetto.__table__.columns}
+
+
+def revisione_corrente(db: Session) -> int:
+    return db.execute(select(StatoSync.revisione).where(StatoSync.id == 1)).scalar() or 0
+
+
+def revisione_azienda(db: Session, azienda_id: int) -> int:
+    """Ultima revisione dei dati sincronizzati dell'azienda (0 se non ne ha mai modificati)"""
+    return db.execute(
+        select(RevisioneAzienda.revisione).where(RevisioneAzienda.azienda_id == azienda_id)
+    ).scalar() or 0
+
+
+def modifiche(db: Session, azienda_id: int, cursore: int = 0, limite: int = MAX_MODIFICHE) -> dict:
+    """
+    Modifiche ed eliminazioni dell'azienda con revisione > cursore
+
+    Ogni tabella restituisce al massimo `limite` righe in ordine di
+    revisione. Se una tabella raggiunge il limite, la risposta si ferma
+    alla revisione più bassa tra quelle troncate (`altro` = True) e il
+    dispositivo ripete la richiesta con il nuovo cursore.
+    """
+    # Letta prima delle tabelle: le modifiche successive arriveranno col prossimo cursore
+    fino_a = revisione_corrente(db)
+
+    risultati, troncate = {}, []
+    for tabella, (modello, _) in TABELLE.items():
+        righe = db.execute(
+            select(modello)
+            .where(_filtro_azienda(modello, azienda_id), modello.revisione > cursore, modello.revisione <= fino_a)
+            .order_by(modello.revisione)
+            .limit(limite)
+        ).scalars().all()
+        risultati[tabella] = righe
+        if len(righe) == limite:
+            troncate.append(righe[-1].revisione)
+
+    eliminazioni = db.execute(
+        select(EliminazioneSync.tabella, EliminazioneSync.riga_id, EliminazioneSync.revisione)
+        .where(
+            EliminazioneSync.azienda_id == azienda_id,
+            EliminazioneSync.revisione > cursore,
+            EliminazioneSync.revisione <= fino_a,
+        )
+        .order_by(EliminazioneSync.revisione)
+        .limit(limite)
+    ).all()
+    if len(eliminazioni) == limite:
+        troncate.append(eliminazioni[-1].revisione)
+
+    if troncate:
+        fino_a = min(troncate)
+
+    return {
+        "cursore": fino_a,
+        "altro": bool(troncate),
+        "modifiche": {
+            tabella: [_riga_json(r) for r in righe if r.revisione <= fino_a]
+            for tabella, righe in risultati.items()
+        },
+        "eliminati": [
+            {"tabella": e.tabella, "id": e.riga_id}
+            for e in eliminazioni if e.revisione <= fino_a
+        ],
+    }
+
+
+# ========== CARICAMENTO ==========
+
+def _data(valore) -> date:
+    return date.fromisoformat(str(valore))
+
+
+def _numero(valore) -> Optional[float]:
+    if valore is None or valore == "":
+        return None
+    numero = float(valore)
+    if not math.isfinite(numero):
+        raise ValueError(f"Numero non valido: {valore}")
+    return numero
+
+
+def _id(valore) -> Optional[int]:
+    """Id intero del JSON (None per stringhe, liste, booleani...): usabile negli insiemi e nelle query"""
+    return valore if isinstance(valore, int) and not isinstance(valore, bool) else None
+
+
+def _testo(valore) -> Optional[str]:
+    if valore is None or valore == "":
+        return None
+    if not isinstance(valore, str):
+        raise ValueError(f"Testo non valido: {valore!r}")
+    return valore
+
+
+def _oggetti(record: list, tabella: str, report: dict) -> List[dict]:
+    """Record che sono oggetti JSON; gli altri (liste, stringhe, numeri) finiscono tra gli errori"""
+    validi = []
+    for r in record:
+        if isinstance(r, dict):
+            validi.append(r)
+        else:
+            report["errori"].append({"tabella": tabella, "id_client": None, "errore": "Record non valido: atteso un oggetto"})
+    return validi
+
+
+def _gia_caricati(db: Session, modello, azienda_id: int, record: List[dict]) -> Tuple[dict, set]:
+    """
+    Record già ricevuti: (id_client -> id dell'azienda, id_client usati da altre aziende)
+
+    Un caricamento ripetuto dopo un errore di rete riceve gli id già
+    assegnati. L'indice su id_client è unico per tutte le aziende: un
+    id_client di un'altra azienda non restituisce il suo id, il record
+    viene rifiutato. I trattamenti si cercano anche nell'archivio: un
+    record spostato da archivio.py non viene inserito una seconda volta.
+    """
+    id_client = [r["id_client"] for r in record if isinstance(r.get("id_client"), str) and r["id_client"]]
+    if not id_client:
+        return {}, set()
+    propri, altrui = {}, set()
+    for tabella in ((modello, TrattamentoArchiviato) if modello is Trattamento else (modello,)):
+        for valore, riga_id, proprio in db.execute(
+            select(tabella.id_client, tabella.id, _filtro_azienda(tabella, azienda_id))
+            .where(tabella.id_client.in_(id_client))
+        ).all():
+            if proprio:
+                propri[valore] = riga_id
+            else:
+                altrui.add(valore)
+    return propri, altrui
+
+
+def carica_trattamenti(db: Session, azienda_id: int, record: List[dict], report: dict):
+    """Valida e inserisce i trattamenti creati offline, in blocco (senza commit)"""
+    record = _oggetti(record, "trattamenti", report)
+    presenti, altrui = _gia_caricati(db, Trattamento, azienda_id, record)
+    superfici = dict(db.execute(
+        select(Campo.id, Campo.superficie_ettari)
+        .where(Campo.azienda_id == azienda_id, Campo.id.in_({_id(r.get("campo_id")) for r in record} - {None}))
+    ).all())
+    prodotti = set(db.execute(
+        select(Prodotto.id)
+        .where(Prodotto.azienda_id == azienda_id, Prodotto.id.in_({_id(r.get("prodotto_id")) for r in record} - {None}))
+    ).scalars())
+    mezzi = set(db.execute(
+        select(Mezzo.id).where(Mezzo.azienda_id == azienda_id, Mezzo.id.in_({_id(r.get("mezzo_id")) for r in record} - {None}))
+    ).scalars())
+
+    nuovi = []
+    for r in record:
+        id_client = r.get("id_client")
+        try:
+            if not id_client or not isinstance(id_client, str):
+                raise ValueError("id_client mancante o non valido")
+            if id_client in altrui:
+                raise ValueError("id_client già usato da un'altra azienda")
+            if id_client in presenti:
+                report["trattamenti"].append({"id_client": id_client, "id": presenti[id_client]})
+                continue
+            campo_id, prodotto_id = _id(r.get("campo_id")), _id(r.get("prodotto_id"))
+            if campo_id not in superfici:
+                raise ValueError("Campo non trovato")
+            if prodotto_id not in prodotti:
+                raise ValueError("Prodotto non trovato")
+            dose = _numero(r.get("quantita_per_ettaro"))
+            if dose is None or dose <= 0:
+                raise ValueError("La dose per ettaro deve essere maggiore di zero")
+            totale = dose * superfici[campo_id]
+            if not math.isfinite(totale):
+                raise ValueError("Dose per ettaro fuori scala")
+
+            valori = {
+                "id_client": id_client,
+                "campo_id": campo_id,
+                "prodotto_id": prodotto_id,
+                "data": _data(r["data"]),
+                "quantita_per_ettaro": dose,
+                "quantita_totale": totale,
+                "mezzo_id": _id(r.get("mezzo_id")) if _id(r.get("mezzo_id")) in mezzi else None,
+            }
+            for colonna in TESTO:
+                valori[colonna] = _testo(r.get(colonna))
+            for colonna in NUMERI:
+                valori[colonna] = _numero(r.get(colonna))
+        except (KeyError, ValueError, TypeError) as e:
+            report["errori"].append({"tabella": "trattamenti", "id_client": id_client, "errore": str(e)})
+            continue
+        presenti[id_client] = None
+        nuovi.append(valori)
+
+    if nuovi:
+        scrivi_blocco(db, nuovi)
+        for id_client, trattamento_id in _gia_caricati(db, Trattamento, azienda_id, nuovi)[0].items():
+            report["trattamenti"].append({"id_client": id_client, "id": trattamento_id})
+
+
+def carica_interventi(db: Session, azienda_id: int, record: List[dict], report: dict):
+    """Valida e inserisce gli interventi di manutenzione creati offline (senza commit)"""
+    record = _oggetti(record, "interventi_manutenzione", report)
+    presenti, altrui = _gia_caricati(db, InterventoManutenzione, azienda_id, record)
+    mezzi = set(db.execute(
+        select(Mezzo.id).where(Mezzo.azienda_id == azienda_id, Mezzo.id.in_({_id(r.get("mezzo_id")) for r in record} - {None}))
+    ).scalars())
+
+    nuovi = []
+    for r in record:
+        id_client = r.get("id_client")
+        try:
+            if not id_client or not isinstance(id_client, str):
+                raise ValueError("id_client mancante o non valido")
+            if id_client in altrui:
+                raise ValueError("id_client già usato da un'altra azienda")
+            if id_client in presenti:
+                report["interventi_manutenzione"].append({"id_client": id_client, "id": presenti[id_client]})
+                continue
+            mezzo_id = _id(r.get("mezzo_id"))
+            if mezzo_id not in mezzi:
+                raise ValueError("Mezzo non trovato")
+            if not _testo(r.get("tipo_intervento")):
+                raise ValueError("Tipo intervento mancante")
+            valori = {
+                "id_client": id_client,
+                "mezzo_id": mezzo_id,
+                "data_intervento": _data(r["data_intervento"]),
+                "tipo_intervento": r["tipo_intervento"],
+                "descrizione": _testo(r.get("descrizione")),
+                "costo": _numero(r.get("costo")),
+                "officina": _testo(r.get("officina")),
+                "prossima_scadenza": _data(r["prossima_scadenza"]) if r.get("prossima_scadenza") else None,
+                "note": _testo(r.get("note")),
+            }
+        except (KeyError, ValueError, TypeError) as e:
+            report["errori"].append({"tabella": "interventi_manutenzione", "id_client": id_client, "errore": str(e)})
+            continue
+        presenti[id_client] = None
+        nuovi.append(valori)
+
+    if nuovi:
+        ids = db.execute(
+            insert(InterventoManutenzione).returning(InterventoManutenzione.id, sort_by_parameter_order=True),
+            nuovi,
+        ).scalars().all()
+        for valori, intervento_id in zip(nuovi, ids):
+            report["interventi_manutenzione"].append({"id_client": valori["id_client"], "id": intervento_id})
+
+
+def carica(db: Session, azienda_id: int, pacchetto: dict) -> dict:
+    """
+    Riceve i record creati offline e li inserisce in una sola transazione
+
+    Ogni record ha un `id_client` (UUID generato dal dispositivo): un
+    record già ricevuto non viene duplicato e la risposta riporta l'id
+    assegnato dal server, così il caricamento si può ripetere senza rischi.
+    """
+    trattamenti = pacchetto.get("trattamenti") or []
+    interventi = pacchetto.get("interventi_manutenzione") or []
+    if not isinstance(trattamenti, list) or not isinstance(interventi, list):
+        raise ValueError("trattamenti e interventi_manutenzione devono essere liste")
+    if len(trattamenti) + len(interventi) > MAX_CARICAMENTO:
+        raise ValueError(f"Troppi record in un caricamento (massimo {MAX_CARICAMENTO})")
+
+    report = {"trattamenti": [], "interventi_manutenzione": [], "errori": []}
+    try:
+        if trattamenti:
+            carica_trattamenti(db, azienda_id, trattamenti, report)
+        if interventi:
+            carica_interventi(db, azienda_id, interventi, report)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return report
@@ -0,0 +1,9 @@
+/** Configurazione di Tailwind per il CSS precompilato (python risorse.py --css) */
+module.exports = {
+  // Classi cercate nei template, anche negli script inline (es. classList.add('hidden'))
+  content: ["./templates/**/*.html"],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+};